@@ -0,0 +1,248 @@
+'''NY News API: read-only data service for the dashboard.
+The queries the Dash callbacks used to run themselves are served here, from an asynchronous (Motor)
+connection pool. Responses are cached in memory for a short while, and carry ETag/Last-Modified headers
+so that clients can revalidate them with a 304 instead of downloading them again.
+
+    uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4
+
+Settings: MONGODB_ADDRESS, MONGODB_PORT, API_MONGO_POOL_SIZE (connections per worker),
+API_CACHE_TTL (seconds a response is reused, 0 to disable the cache),
+API_CACHE_SIZE (number of cached responses per worker).
+'''
+
+import contextlib
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from motor.motor_asyncio import AsyncIOMotorClient
+
+MONGO_LABEL = os.environ.get('MONGODB_ADDRESS','localhost') #Unless you have your own address
+MONGO_PORT = int(os.environ.get('MONGODB_PORT',27017)) #Unless you have a specific port, default is 27017
+POOL_SIZE = int(os.environ.get('API_MONGO_POOL_SIZE', 20))
+CACHE_TTL = int(os.environ.get('API_CACHE_TTL', 60))
+CACHE_SIZE = int(os.environ.get('API_CACHE_SIZE', 256))
+
+db = None
+
+@contextlib.asynccontextmanager
+async def lifespan(app:FastAPI):
+    '''One Motor client per worker, connected at startup and closed at shutdown.'''
+    global db
+    client = AsyncIOMotorClient(host=MONGO_LABEL, port=MONGO_PORT, maxPoolSize=POOL_SIZE)
+    db = client['NY_Project']
+    yield
+    client.close()
+
+app = FastAPI(title='NY News API', description='Read-only access to the NY_Project collections.', lifespan=lifespan)
+
+class ResponseCache:
+    '''Small LRU cache of serialized responses: key -> (expiry, body, etag, last_modified).'''
+    def __init__(self, max_size:int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key:str):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key:str, body:bytes, etag:str, last_modified):
+        if CACHE_TTL <= 0: #API_CACHE_TTL=0 turns the cache off
+            return
+        self.entries[key] = (time.monotonic() + CACHE_TTL, body, etag, last_modified)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+response_cache = ResponseCache(CACHE_SIZE)
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+async def newswire_last_modified():
+    '''Newest updated_date of the Newswire collection (served by the updated_date index).'''
+    latest = await db['times_newswire'].find_one({}, {"updated_date":1, "_id":0}, sort=[("updated_date", -1)])
+    return (latest or {}).get('updated_date')
+
+async def articles_last_modified():
+    latest = await db['ny_articles'].find_one({}, {"pub_date":1, "_id":0}, sort=[("pub_date", -1)])
+    return (latest or {}).get('pub_date')
+
+async def conditional_response(request:Request, build, last_modified_of) -> Response:
+    '''Serves build()'s result as JSON, from the cache if possible, answering 304 when the client's
+    If-None-Match / If-Modified-Since headers show that it already has this version.'''
+    key = f'{request.url.path}?{sorted(request.query_params.multi_items())}'
+    entry = response_cache.get(key)
+    if entry is not None:
+        _, body, etag, last_modified = entry
+    else:
+        body = json.dumps(await build(), default=json_default).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        last_modified = await last_modified_of()
+        response_cache.put(key, body, etag, last_modified)
+
+    headers = {'ETag':etag, 'Cache-Control':f'public, max-age={CACHE_TTL}'}
+    if isinstance(last_modified, datetime.datetime):
+        last_modified = last_modified.replace(tzinfo=datetime.timezone.utc, microsecond=0)
+        headers['Last-Modified'] = email.utils.format_datetime(last_modified, usegmt=True)
+
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and 'if-none-match' not in request.headers and isinstance(last_modified, datetime.datetime):
+        try:
+            if last_modified <= email.utils.parsedate_to_datetime(if_modified_since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+
+    return Response(content=body, media_type='application/json', headers=headers)
+
+async def read_rollup(collection_name:str, query:dict, fields:list, limit:int = 0) -> list:
+    '''Rows of a daily rollup (see nyt_common/rollups.py), largest counts first.'''
+    projection = {field:1 for field in fields}
+    projection.update({"year":1, "month":1, "day":1, "nb_articles":1, "_id":0})
+    cursor = db[collection_name].find(query, projection).sort([("nb_articles",-1), ("year",-1), ("month",-1), ("day",-1)])
+    return await cursor.to_list(length=limit or None)
+
+@app.get('/newswire/timeline/sections')
+async def section_timeline(request:Request, section:str = None):
+    '''Daily number of articles per section.'''
+    query = {} if section is None else {"section":section}
+    return await conditional_response(request,
+        lambda: read_rollup('newswire_daily_by_section', query, ['section']),
+        newswire_last_modified)
+
+@app.get('/newswire/timeline/subsections')
+async def subsection_timeline(request:Request, section:str = None, subsection:str = None):
+    '''Daily number of articles per section and subsection.'''
+    query = {}
+    if section is not None:
+        query['section'] = section
+    if subsection is not None:
+        query['subsection'] = subsection
+    return await conditional_response(request,
+        lambda: read_rollup('newswire_daily_by_subsection', query, ['section', 'subsection']),
+        newswire_last_modified)
+
+@app.get('/newswire/authors')
+async def author_stats(request:Request, section:str = None, limit:int = Query(0, ge=0)):
+    '''Daily number of articles per author (byline), section and subsection.'''
+    query = {} if section is None else {"section":section}
+    return await conditional_response(request,
+        lambda: read_rollup('newswire_daily_by_author', query, ['byline', 'section', 'subsection'], limit),
+        newswire_last_modified)
+
+@app.get('/newswire/geo/{field}')
+async def geo_stats(request:Request, field:str, section:str = None):
+    '''Daily number of articles mentioning each country, in their title or their abstract.'''
+    if field not in ['title', 'abstract']:
+        raise HTTPException(status_code=404, detail='field must be title or abstract')
+
+    match = {"uri":{"$ne":''}, f"countries.{field}":{"$gt":''}}
+    if section is not None:
+        match['section'] = section
+
+    async def build():
+        cursor = db['times_newswire'].aggregate([
+            {"$match":match},
+            {"$project":{"country":f"$countries.{field}", "section":1,
+                         "aYear":{"$year":'$created_date'}, "aMonth":{"$month":'$created_date'},
+                         "aDay":{"$dayOfMonth":'$created_date'}}},
+            {"$unwind":"$country"},
+            {"$group":{"_id":{"country":"$country", "section":"$section",
+                              "aYear":"$aYear", "aMonth":"$aMonth", "aDay":"$aDay"},
+                       "nb_articles":{"$sum":1}}},
+            {"$sort":{"nb_articles":-1}},
+            {"$project":{"country":"$_id.country", "section":"$_id.section", "year":"$_id.aYear",
+                         "month":"$_id.aMonth", "day":"$_id.aDay", "nb_articles":1, "_id":0}},
+        ])
+        return await cursor.to_list(length=None)
+
+    return await conditional_response(request, build, newswire_last_modified)
+
+@app.get('/newswire/search')
+async def search_newswire(request:Request, q:str = Query(..., min_length=1), skip:int = Query(0, ge=0),
+                          limit:int = Query(10, ge=1, le=100)):
+    '''Text search over titles and abstracts, most relevant first: {"total": ..., "results": [...]}.'''
+    query = {"$text":{"$search":q}}
+
+    async def build():
+        total = await db['times_newswire'].count_documents(query)
+        cursor = (db['times_newswire'].find(query, {"_id":0, "title":1, "url":1, "abstract":1, "updated_date":1,
+                                                    "score":{"$meta":"textScore"}})
+                  .sort([("score",{"$meta":"textScore"}), ("updated_date",-1)]).skip(skip).limit(limit))
+        return {"total":total, "results":await cursor.to_list(length=limit)}
+
+    return await conditional_response(request, build, newswire_last_modified)
+
+@app.get('/newswire/newest')
+async def newest_newswire(request:Request):
+    '''Newest updated_date of the Newswire collection: {"updated_date": ...}.'''
+    async def build():
+        return {"updated_date":await newswire_last_modified()}
+
+    return await conditional_response(request, build, newswire_last_modified)
+
+@app.get('/newswire/sections')
+async def newswire_sections(request:Request):
+    '''Sections of the Newswire collection (served by the section index).'''
+    async def build():
+        return [section for section in await db['times_newswire'].distinct('section') if section != '']
+
+    return await conditional_response(request, build, newswire_last_modified)
+
+@app.get('/newswire/latest')
+async def latest_newswire(request:Request, limit:int = Query(10, ge=1, le=100)):
+    '''Most recently updated Newswire articles.'''
+    async def build():
+        cursor = db['times_newswire'].find({}, {"_id":0, "title":1, "url":1, "abstract":1, "section":1,
+                                                "updated_date":1}).sort("updated_date", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    return await conditional_response(request, build, newswire_last_modified)
+
+@app.get('/articles/latest')
+async def latest_articles(request:Request, limit:int = Query(5, ge=1, le=100)):
+    '''Most recently published articles of the Article Search collection.'''
+    async def build():
+        cursor = db['ny_articles'].find({}, {"_id":0, "headline":1, "web_url":1, "pub_date":1}).sort("pub_date", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    return await conditional_response(request, build, articles_last_modified)
+
+@app.get('/articles/stats')
+async def article_stats(request:Request):
+    '''Number of articles and average word count per news desk.'''
+    async def build():
+        cursor = db['ny_articles'].aggregate([
+            {"$group":{"_id":"$news_desk", "average_word_count":{"$avg":"$word_count"}, "article_count":{"$sum":1}}},
+            {"$project":{"section":"$_id", "average_word_count":{"$ifNull":["$average_word_count", 0]},
+                         "article_count":1, "_id":0}},
+            {"$sort":{"article_count":-1}},
+        ])
+        return await cursor.to_list(length=None)
+
+    return await conditional_response(request, build, articles_last_modified)
+
+@app.get('/articles/keywords')
+async def search_keywords(request:Request, q:str = Query(..., min_length=1), limit:int = Query(5, ge=1, le=100)):
+    '''Articles having a keyword that starts with q, a normalized term (see nyt_common/keywords.py).
+    The anchored prefix is answered by the keyword_terms index.'''
+    async def build():
+        cursor = db['ny_articles'].find({"keyword_terms":{"$regex":f'^{re.escape(q)}'}},
+                                        {"_id":0, "headline.main":1, "web_url":1}).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    return await conditional_response(request, build, articles_last_modified)
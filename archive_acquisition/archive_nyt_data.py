@@ -1,29 +1,29 @@
-import requests
-import pymongo
+import asyncio
+from pymongo import UpdateOne
+from concurrent.futures import ProcessPoolExecutor
 import datetime
-import time
+import ijson
+import multiprocessing
 from tqdm import tqdm
 import os
 import sys
 
-API_KEY = os.getenv('NYTIMES_API_KEY') #If None, will prompt the user to get a key.
-
-MONGO_LABEL = os.environ.get('MONGODB_ADDRESS','localhost') #Unless you have your own address
-MONGO_PORT = int(os.environ.get('MONGODB_PORT',27017)) #Unless you have a specific port, default is 27017
+#The shared helpers (HTTP client, rate limiter) live at the root of the repository.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nyt_common.nyt_http import NYTClient, run_in_thread
+from nyt_common.dates import DATE_FIELDS, convert_date_fields
+from nyt_common.indexes import ensure_indexes
+from nyt_common.keywords import normalize_keywords
+from nyt_common.countries import tag_countries
+from nyt_common.metrics import dump_metrics, mongo_batch
+from nyt_common.db import database
 
-DB_CLIENT = pymongo.MongoClient(host=MONGO_LABEL, port=MONGO_PORT)
-WAIT_TIME = 12
+API_KEY = os.getenv('NYTIMES_API_KEY') #If None, will prompt the user to get a key.
 
-#Reused from Newswire Acquisition - could need DRY, not important for now
-def nyt_requests_get(url, endpoint, payload=None):
-    '''All requests will have a 12-second wait timer attached to them.
-    I could use requests.get(...) then a time.sleep() everywhere, but it's better to simplify readability.'''
-    global WAIT_TIME
-    re = requests.get(f'{url}{endpoint}',params=payload)
-    time.sleep(WAIT_TIME)
-    return re
+#Rate limiting is shared with Newswire Acquisition: see NYTClient in nyt_common/nyt_http.py
 
-db = DB_CLIENT['NY_Project']
+#MongoDB settings (MONGODB_ADDRESS, MONGODB_PORT, pool size...) are read by nyt_common/db.py
+db = database()
 archive_collection = db['times_archive']
 
 def get_archive_data(years=3,months_offset=0,month_delta=0):
@@ -31,6 +31,11 @@ def get_archive_data(years=3,months_offset=0,month_delta=0):
     We will specify how many years we want to go back (three by default),
     as well as how many months we want to skip (say, we don't want the most
     recent articles; we can offset by one month)'''
+    return asyncio.run(get_archive_data_async(years, months_offset, month_delta))
+
+async def get_archive_data_async(years=3,months_offset=0,month_delta=0):
+    '''Asynchronous version of get_archive_data: while a month is being parsed and written
+    to MongoDB (in a worker thread), the request for the next month is already waiting for its slot.'''
 
     todays_date = datetime.date.today()
     archive_year = todays_date.year - (months_offset // 12)
@@ -53,38 +58,187 @@ def get_archive_data(years=3,months_offset=0,month_delta=0):
         if mth > todays_date.month:
             yr = yr - 1
 
-    #Run this no matter what:
-    while (yr < archive_year) or ((yr <= archive_year) and (mth <= archive_month)):
+    pending_month = None
 
-        endp_archive = f'{yr}/{mth}.json'
-        print(f'Processing archive entries for {mth}/{yr}...')
-        archive_json = nyt_requests_get(url, endp_archive, payload=payload).json()
+    async with NYTClient('archive') as client:
 
-        for article in archive_json.get('response',{}).get('docs',[]):
+        #Run this no matter what:
+        while (yr < archive_year) or ((yr <= archive_year) and (mth <= archive_month)):
 
-            for excess_key in ['multimedia','keywords','_id']:
-                try:
-                    del article[excess_key]
-                except:
-                    continue
+            endp_archive = f'{yr}/{mth}.json'
+            print(f'Processing archive entries for {mth}/{yr}...')
+            archive_res = await client.download(url, endp_archive, payload=payload, fresh_after=month_end(yr, mth))
+
+            #One month being processed at a time: wait for the previous month first.
+            if pending_month is not None:
+                await pending_month
+            if archive_res.path is None:
+                print(f'Could not acquire {mth}/{yr}: {archive_res.status_code} - {archive_res.content[:200]}')
+                pending_month = None
+            else:
+                pending_month = asyncio.ensure_future(run_in_thread(add_archive_month, archive_res.path, yr, mth, todays_date))
 
-            article['byline'] = article.get('byline',{}).get('original',None)
-            article['headline'] = article.get('headline',{}).get('main',None)
+            mth = mth + 1
 
-            mongo_check = archive_collection.find_one({"uri":article['uri']})
+            if mth == 13:
+                mth = 1
+                yr = yr + 1
 
-            if mongo_check is None:
-                archive_collection.insert_one(article)
-            elif (yr < todays_date.year):
-                break
-            elif (mth < todays_date.month):
-                break
+        if pending_month is not None:
+            await pending_month
 
-        mth = mth + 1
+def month_end(yr:int, mth:int) -> datetime.datetime:
+    '''When a month of archive data stops changing: a response cached after that can be reused
+    (see nyt_common/response_cache.py).'''
+    return datetime.datetime(yr + (mth // 12), (mth % 12) + 1, 1)
+
+def add_archive_month(path:str, yr:int, mth:int, todays_date:datetime.date):
+    '''Streams one month of archive data (spooled to disk) and sends its articles to MongoDB.
+    For past months, we stop at the first article we already have.'''
+    try:
+        stop_at_known = (yr < todays_date.year) or (mth < todays_date.month)
+        return insert_archive_docs(archive_collection, iter_archive_docs(path), stop_at_known)
+    finally:
+        os.remove(path)
+
+def iter_archive_docs(path:str):
+    '''Yields the articles of a spooled month one at a time (response.docs), already slimmed,
+    so that only one article and one batch are ever held in memory.'''
+    with open(path, 'rb') as archive_file:
+        for article in ijson.items(archive_file, 'response.docs.item', use_float=True):
+            yield slim_archive_article(article)
+
+def insert_archive_docs(collection, articles, stop_at_known:bool = False, batch_size:int = 1000) -> dict:
+    '''Inserts a stream of articles in batches: one $in query per batch to find the articles we already have,
+    then one unordered bulk_write of upserts for the others (articles we already have are left untouched).
+    With stop_at_known, we stop at the first article we already have.'''
+    counts = {'articles':0, 'inserted':0}
+    batch = []
+
+    def flush(batch):
+        with mongo_batch(collection.name, 'find', len(batch)):
+            known_uris = {doc['uri'] for doc in collection.find({"uri":{"$in":[article['uri'] for article in batch]}},
+                                                                {"_id":0, "uri":1})}
+        stop = False
+        operations = []
+        for article in batch:
+            if article['uri'] in known_uris:
+                if stop_at_known:
+                    stop = True
+                    break
+                continue
+            known_uris.add(article['uri'])
+            operations.append(UpdateOne({"uri":article['uri']}, {"$setOnInsert":article}, upsert=True))
+        if operations:
+            with mongo_batch(collection.name, 'bulk_write', len(operations)):
+                counts['inserted'] += collection.bulk_write(operations, ordered=False).upserted_count
+        return stop
+
+    for article in articles:
+        if not article.get('uri'):
+            continue
+        counts['articles'] += 1
+        batch.append(article)
+        if len(batch) >= batch_size:
+            if flush(batch):
+                return counts
+            batch = []
+
+    if batch:
+        flush(batch)
+    return counts
+
+def slim_archive_article(article:dict) -> dict:
+    '''Removes the fields we do not keep, flattens byline and headline and turns pub_date into a datetime, in place.
+    Keywords are only kept as a list of normalized values (keyword_terms), and mentioned countries are tagged.'''
+    article['keyword_terms'] = normalize_keywords(article.get('keywords'))
+
+    for excess_key in ['multimedia','keywords','_id']:
+        try:
+            del article[excess_key]
+        except:
+            continue
+
+    article['byline'] = (article.get('byline') or {}).get('original',None)
+    article['headline'] = (article.get('headline') or {}).get('main',None)
+    convert_date_fields(article, DATE_FIELDS['times_archive'])
+    tag_countries(article, 'times_archive')
+    return article
 
+#Backfill mode: a range of months, downloaded concurrently and processed by a pool of worker processes.
+#Completed months are recorded in the archive_checkpoints collection, so that an interrupted backfill
+#picks up where it stopped.
+
+def month_range(start:tuple, end:tuple) -> list:
+    '''All (year, month) pairs from start to end, both included.'''
+    months = []
+    yr, mth = start
+    while (yr, mth) <= tuple(end):
+        months.append((yr, mth))
+        mth = mth + 1
         if mth == 13:
             mth = 1
             yr = yr + 1
+    return months
+
+def process_archive_file(path:str, yr:int, mth:int) -> dict:
+    '''Worker process: streams a month of archive data spooled to disk into MongoDB (see insert_archive_docs).'''
+    #One MongoDB client per worker process, created on first use (see nyt_common/db.py)
+    collection = database()['times_archive']
+
+    return insert_archive_docs(collection, iter_archive_docs(path))
+
+def backfill_archive(start:tuple, end:tuple, workers:int = None):
+    '''Acquires every month from start to end (both as (year, month) tuples), skipping the months
+    that a previous run already completed.'''
+    return asyncio.run(backfill_archive_async(start, end, workers))
+
+async def backfill_archive_async(start:tuple, end:tuple, workers:int = None):
+    checkpoints = db['archive_checkpoints']
+    done = {(cp['year'], cp['month']) for cp in checkpoints.find({}, {"year":1, "month":1})}
+    months = [month for month in month_range(start, end) if month not in done]
+    print(f'Backfilling {len(months)} months ({len(done)} already completed).')
+
+    todays_date = datetime.date.today()
+    url = 'https://api.nytimes.com/svc/archive/v1/'
+    payload = {'api-key':API_KEY}
+
+    workers = workers or os.cpu_count() or 1
+    #Months downloaded but not processed yet stay on disk: this keeps the pool busy without piling them up.
+    in_flight = asyncio.Semaphore(workers * 2)
+    loop = asyncio.get_running_loop()
+    pbar = tqdm(range(len(months)), total=len(months), desc='Archive backfill')
+
+    async def backfill_month(client, pool, yr, mth):
+        async with in_flight:
+            archive_res = await client.download(url, f'{yr}/{mth}.json', payload=payload,
+                                                fresh_after=month_end(yr, mth))
+            if archive_res.path is None:
+                print(f'Could not acquire {mth}/{yr}: {archive_res.status_code} - {archive_res.content[:200]}')
+                return None
+
+            path = archive_res.path
+            try:
+                counts = await loop.run_in_executor(pool, process_archive_file, path, yr, mth)
+            finally:
+                os.remove(path)
+
+            #The current month is still being written: it is never considered complete.
+            if (yr, mth) < (todays_date.year, todays_date.month):
+                checkpoints.update_one({"year":yr, "month":mth},
+                                       {"$set":{**counts, "completed_at":datetime.datetime.utcnow()}},
+                                       upsert=True)
+            pbar.update()
+            return counts
+
+    #Spawned workers import this module afresh, instead of forking a process that already has a MongoClient
+    #and threads: they create their own client on first use (see nyt_common/db.py), as in newswire_job.py.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        async with NYTClient('archive') as client:
+            results = await asyncio.gather(*[backfill_month(client, pool, yr, mth) for yr, mth in months])
+    pbar.close()
+
+    return {f'{yr}-{mth:02d}':counts for (yr, mth), counts in zip(months, results)}
 
 if __name__=='__main__':
     if API_KEY is None:
@@ -95,7 +249,15 @@ if __name__=='__main__':
 Please run this script after performing this step.''')
     else:
         print("Performing data acquisition routines from the New York Times' Archive API.")
-        if len(sys.argv)>1:
+        ensure_indexes(db) #uri lookups and upserts rely on them
+        if len(sys.argv)>3 and sys.argv[1] == 'backfill':
+            #python3 archive_nyt_data.py backfill YYYY-MM YYYY-MM [nb_workers]
+            start_month = tuple(int(i) for i in sys.argv[2].split('-'))
+            end_month = tuple(int(i) for i in sys.argv[3].split('-'))
+            nb_workers = int(sys.argv[4]) if len(sys.argv)>4 else None
+            backfill_archive(start_month, end_month, nb_workers)
+
+        elif len(sys.argv)>1:
             if len(sys.argv)>2:
                 try:
                     nb_years = int(sys.argv[1])
@@ -118,3 +280,5 @@ Please run this script after performing this step.''')
                 print('''To do: implement CLI documentation here.''')
         else:
             get_archive_data()
+
+        dump_metrics('archive_nyt_data') #For the textfile collector and/or the Pushgateway (see nyt_common/metrics.py)
@@ -0,0 +1 @@
+'''Benchmarks of the acquisition scripts and the dashboard, on synthetic NY Times data (see run.py).'''
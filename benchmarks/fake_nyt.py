@@ -0,0 +1,93 @@
+'''Local stand-in for the NY Times APIs, serving synthetic data (see synthetic.py).
+It runs in a background thread, with its own event loop. Point the scripts at it with NYT_API_BASE_URL
+(see nyt_common/nyt_http.py):
+
+    server = FakeNYTServer(SyntheticNYT(10_000))
+    os.environ['NYT_API_BASE_URL'] = server.start()
+    ...
+    server.stop()
+'''
+
+import asyncio
+import json
+import threading
+
+from aiohttp import web
+
+class FakeNYTServer:
+    '''Serves the Newswire, Archive and Article Search endpoints the scripts use, and counts the requests.'''
+    def __init__(self, data, host:str = '127.0.0.1', port:int = 0, archive_months:int = 12):
+        self.data = data
+        self.host = host
+        self.port = port
+        self.archive_months = archive_months #The archive articles are spread over this many months
+        self.requests = 0
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/svc/news/v3/content/section-list.json', self.section_list)
+        app.router.add_get('/svc/news/v3/content/{source}/{section}.json', self.newswire_section)
+        app.router.add_get('/svc/archive/v1/{year}/{month}.json', self.archive_month)
+        app.router.add_get('/svc/search/v2/articlesearch.json', self.articlesearch)
+        return app
+
+    async def respond(self, build) -> web.Response:
+        '''Generates and serializes a response in a worker thread, so that large months do not block the loop.'''
+        self.requests += 1
+        body = await asyncio.get_running_loop().run_in_executor(None, lambda: json.dumps(build()))
+        return web.Response(text=body, content_type='application/json')
+
+    async def section_list(self, request):
+        return await self.respond(lambda: {'status':'OK', 'num_results':len(self.data.newswire_sections()),
+                                           'results':[{'section':section, 'display_name':section.title()}
+                                                      for section in self.data.newswire_sections()]})
+
+    async def newswire_section(self, request):
+        section = request.match_info['section']
+        offset = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', 20))
+        return await self.respond(lambda: {'status':'OK', 'num_results':limit,
+                                           'results':self.data.newswire_page(section, offset, limit)})
+
+    async def archive_month(self, request):
+        year, month = int(request.match_info['year']), int(request.match_info['month'])
+        def build():
+            docs = self.data.archive_month(year, month, self.archive_months)
+            return {'copyright':'Synthetic data', 'response':{'meta':{'hits':len(docs)}, 'docs':docs}}
+        return await self.respond(build)
+
+    async def articlesearch(self, request):
+        page = int(request.query.get('page', 0))
+        return await self.respond(lambda: {'status':'OK',
+                                           'response':{'docs':self.data.articlesearch_page(page),
+                                                       'meta':{'hits':self.data.size, 'offset':page * 10}}})
+
+    def start(self) -> str:
+        '''Starts serving in a background thread and returns the base URL of the server.'''
+        started = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.runner = web.AppRunner(self.application())
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, self.host, self.port)
+            self.loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1] #The actual port, when port 0 was asked for
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=serve, name='fake-nyt', daemon=True)
+        self.thread.start()
+        started.wait()
+        return f'http://{self.host}:{self.port}'
+
+    def stop(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
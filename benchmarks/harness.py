@@ -0,0 +1,78 @@
+'''Timing of the benchmarks, and their results as JSON.
+Each result records the wall-clock time of every repetition, plus a throughput when the number of processed
+items is known. Results are written along with the commit they were measured on, so that two files can be
+compared (see compare_results) to spot regressions between commits.
+'''
+
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import time
+import traceback
+
+class BenchmarkResults:
+    '''Collects the timings of a benchmark run: results[name] = {'seconds': [...], 'median': ..., ...}.'''
+    def __init__(self, scale:str, backend:str):
+        self.metadata = {
+            'commit': current_commit(),
+            'timestamp': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+            'scale': scale,
+            'backend': backend,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        }
+        self.results = {}
+
+    def measure(self, name:str, func, *args, repeat:int = 1, items:int = None, **kwargs):
+        '''Runs func(*args, **kwargs) repeat times and records its timings. An exception is recorded as the
+        result of the benchmark (its error, reported as failed) instead of stopping the run: benchmarks known not
+        to run on a backend are recorded with skip instead. Returns the value of the last call.'''
+        seconds, value = [], None
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                value = func(*args, **kwargs)
+                seconds.append(time.perf_counter() - start)
+        except Exception as error:
+            self.results[name] = {'error': f'{type(error).__name__}: {error}', 'traceback': traceback.format_exc()}
+            print(f'{name}: failed ({type(error).__name__}: {error})')
+            return None
+
+        result = {'seconds': seconds, 'min': min(seconds), 'median': statistics.median(seconds)}
+        if items:
+            result['items'] = items
+            result['items_per_second'] = items / result['median'] if result['median'] else None
+        self.results[name] = result
+        print(f'{name}: {result["median"] * 1000:.1f} ms (median of {repeat})')
+        return value
+
+    def skip(self, name:str, reason:str):
+        '''Records a benchmark that cannot run on this backend (e.g. an aggregation stage mongomock lacks).'''
+        self.results[name] = {'unsupported': reason}
+        print(f'{name}: unsupported ({reason})')
+
+    def to_dict(self) -> dict:
+        return {'metadata': self.metadata, 'results': self.results}
+
+    def write(self, path:str):
+        with open(path, 'w') as results_file:
+            json.dump(self.to_dict(), results_file, indent=2)
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare_results(baseline:dict, current:dict, threshold:float = 1.2) -> list:
+    '''Lists the benchmarks whose median is more than threshold times slower than in the baseline,
+    as (name, baseline median, current median).'''
+    regressions = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name, {})
+        if 'median' in result and before.get('median') and result['median'] > before['median'] * threshold:
+            regressions.append((name, before['median'], result['median']))
+    return regressions
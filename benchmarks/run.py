@@ -0,0 +1,225 @@
+'''Benchmarks of the project's hot paths, on synthetic data (see synthetic.py).
+The acquisition scripts fetch from a local fake NY Times server (see fake_nyt.py) and write to MongoDB,
+then the dashboard's data loaders and callbacks run against what they wrote. From the root of the repository:
+
+    python3 -m benchmarks.run --scale 10k                 #Against MONGODB_ADDRESS/MONGODB_PORT
+    python3 -m benchmarks.run --scale 100k --mongomock    #Against mongomock: no mongod needed
+    python3 -m benchmarks.run --scale 10k --baseline benchmarks/results/10k-abc1234-....json
+    python3 -m benchmarks.run --scale 1m --only search     #In-memory Newswire search alone: no MongoDB needed
+
+The benchmarks write to the NY_Project database: against a real mongod, use a dedicated (empty) instance.
+mongomock supports neither $merge (partial rollup refreshes) nor $text (the default Newswire search): under
+--mongomock, the benchmarks relying on them are recorded as unsupported instead of being run, and the Newswire
+data is loaded through write_section_output directly. Other failures are recorded with their error.
+Results are written as JSON (benchmarks/results by default); --baseline lists the benchmarks that got slower.
+'''
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.fake_nyt import FakeNYTServer
+from benchmarks.harness import BenchmarkResults, compare_results
+from benchmarks.synthetic import SCALES, SyntheticNYT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_FOLDERS = ['newswire_acquisition', 'archive_acquisition', 'ny_import', 'dash_app']
+ARCHIVE_MONTHS = 12
+NEEDS_MERGE = 'needs $merge, which mongomock does not support'
+NEEDS_TEXT = 'needs $text, which mongomock does not support (try NEWSWIRE_SEARCH_BACKEND=memory)'
+SEARCH_QUERIES = {'one term':'election', 'two terms':'court market', 'rare term':'france', 'no match':'zzzz',
+                  'one letter':'a'}
+
+def prepare_environment(base_url:str, cache_dir:str):
+    '''Settings read by the scripts when they are imported: fake API, no rate limiting, private dashboard cache.'''
+    os.environ['NYTIMES_API_KEY'] = os.environ.get('NYTIMES_API_KEY') or 'benchmark'
+    os.environ['NYT_API_BASE_URL'] = base_url
+    for api in ['NEWSWIRE', 'ARCHIVE', 'ARTICLESEARCH']:
+        os.environ[f'NYT_{api}_PER_MINUTE'] = '1000000'
+        os.environ[f'NYT_{api}_PER_DAY'] = '100000000'
+        os.environ[f'NYT_{api}_BURST'] = '1000'
+    os.environ['DASH_CACHE_DIR'] = cache_dir
+    os.environ['NEWSWIRE_REFRESH_INTERVAL'] = '0' #The benchmarks call the loaders themselves
+    for folder in SCRIPT_FOLDERS:
+        sys.path.insert(0, os.path.join(ROOT, folder))
+
+def use_mongomock():
+    '''Every MongoClient the scripts create (see nyt_common/db.py) becomes the same in-memory mongomock client.'''
+    import mongomock
+    import pymongo
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+    return client
+
+def loaded_module(filename:str, name:str):
+    '''The module Dash imported for a page (the name it gives pages may differ), or a fresh import.'''
+    for module in list(sys.modules.values()):
+        if getattr(module, '__file__', None) and os.path.abspath(module.__file__) == os.path.join(ROOT, filename):
+            return module
+    return importlib.import_module(name)
+
+def unwrapped(func):
+    '''The function behind a Dash callback or an lru_cache, so that it can be called directly.'''
+    return getattr(func, '__wrapped__', func)
+
+def run_ingest_benchmarks(results:BenchmarkResults, data:SyntheticNYT, nb_pages:int, mongomock:bool = False):
+    import nyt_newswire
+    import archive_nyt_data
+    import ny_articlesearch_import
+
+    if mongomock:
+        #The sweeps refresh the rollups of the days they touched with $merge: time the writes alone instead
+        results.skip('newswire.get_full_newswire_output', NEEDS_MERGE)
+        results.skip('newswire.add_section_output (nothing new)', NEEDS_MERGE)
+        sections = {section:data.newswire_page(section, 0, data.size) for section in data.newswire_sections()}
+        def write_sections():
+            for section, items in sections.items():
+                nyt_newswire.write_section_output(section, items)
+        results.measure('newswire.write_section_output (all sections)', write_sections, items=data.size)
+    else:
+        results.measure('newswire.get_full_newswire_output', nyt_newswire.get_full_newswire_output, 'nyt', True,
+                        items=data.size)
+        #Second sweep of one section: everything is already known, the high-water mark stops it after one page
+        results.measure('newswire.add_section_output (nothing new)', nyt_newswire.add_section_output,
+                        data.newswire_sections()[0], repeat=3)
+    results.measure('archive.get_archive_data', archive_nyt_data.get_archive_data, 0, 0, ARCHIVE_MONTHS,
+                    items=data.size)
+    results.measure('articlesearch.get_article_search_pages', ny_articlesearch_import.get_article_search_pages,
+                    nb_pages, items=nb_pages * 10)
+
+def run_dashboard_benchmarks(results:BenchmarkResults, repeat:int, mongomock:bool = False):
+    importlib.import_module('web_gui') #Creating the app imports the pages
+    newswire = loaded_module('dash_app/newswire.py', 'newswire')
+    articles = loaded_module('dash_app/articles.py', 'articles')
+    nwdata = newswire.nwdata
+
+    #Cold loads (what a cache refresh costs), then incremental refreshes, then reads of the data cache: a first one
+    #which fills it, then reads of what it holds
+    loaders = {
+        'sections': (nwdata.load_section_data, nwdata.get_section_data),
+        'subsections': (nwdata.load_subsection_data, nwdata.get_subsection_data),
+        'authors': (nwdata.load_authors, nwdata.get_authors),
+        'geo_title': (lambda previous=None: nwdata.load_geo_data('title', previous), lambda: nwdata.get_geo_data(0)),
+        'geo_abstract': (lambda previous=None: nwdata.load_geo_data('abstract', previous), lambda: nwdata.get_geo_data(1)),
+    }
+    for name, (load, get) in loaders.items():
+        loaded = results.measure(f'dash.newswire.load_{name} (cold)', load, repeat=repeat)
+        if loaded is not None:
+            results.measure(f'dash.newswire.load_{name} (incremental)', load, loaded, repeat=repeat)
+        if results.measure(f'dash.newswire.get_{name} (cache miss)', get) is not None:
+            results.measure(f'dash.newswire.get_{name} (cached)', get, repeat=repeat)
+
+    def load_articles():
+        nwdata.article_log = None
+        return nwdata.get_articles()
+    store = results.measure('dash.newswire.get_articles (cold)', load_articles, repeat=repeat)
+    if store is not None:
+        measure_store(results, store, repeat)
+
+    def search_first_page(term):
+        handle, result = nwdata.search(term)
+        return newswire.format_search_results(nwdata.search_page(result, 0, newswire.nw_search_size), result.total)
+    if mongomock and newswire.SEARCH_BACKEND != 'memory':
+        results.skip('dash.newswire.search (first page)', NEEDS_TEXT)
+    else:
+        results.measure('dash.newswire.search (first page)', search_first_page, 'election', repeat=repeat)
+
+    results.measure('dash.newswire.load_subsections', unwrapped(newswire.load_subsections), 'world', repeat=repeat)
+    results.measure('dash.newswire.topic_figure (all sections)', newswire.topic_figure, 'All', 'All', repeat=repeat)
+    results.measure('dash.newswire.topic_figure (one section)', newswire.topic_figure, 'world', 'All', repeat=repeat)
+    results.measure('dash.newswire.country_figure (title)', newswire.country_figure, 'In the title', 'All',
+                    repeat=repeat)
+    results.measure('dash.newswire.section_update_by_mode', unwrapped(newswire.section_update_by_mode),
+                    'In the article', repeat=repeat)
+
+    results.measure('dash.articles.load_articles_overview', articles.load_articles_overview, repeat=repeat)
+    results.measure('dash.articles.layout', articles.layout, repeat=repeat)
+    results.measure('dash.articles.search_keywords', unwrapped(articles.search_keywords_cached), 'elect', 5, 0,
+                    repeat=repeat)
+
+def measure_store(results:BenchmarkResults, store, repeat:int):
+    '''Searches and filters of the in-memory article log, as the 'memory' search backend runs them.'''
+    from search_handles import search_handles
+    for name, query in SEARCH_QUERIES.items():
+        results.measure(f'dash.article_store.search ({name})', store.search, query, search_handles.max_ids,
+                        repeat=repeat * 3)
+    results.measure('dash.article_store.filter (section)', store.filter, section='world', repeat=repeat * 3)
+
+def run_search_benchmarks(results:BenchmarkResults, data:SyntheticNYT, repeat:int):
+    '''The in-memory Newswire search alone, on a store built from the synthetic items directly (without MongoDB,
+    hence at any scale).'''
+    from article_store import ArticleStore
+    items = (item for section in data.newswire_sections() for item in data.newswire_page(section, 0, data.size))
+    store = results.measure('dash.article_store.from_documents', ArticleStore.from_documents, items,
+                            items=data.size)
+    if store is not None:
+        results.measure('dash.article_store.build_search_index', store.build_search_index, items=data.size)
+    if store is not None and store.search_index is not None:
+        measure_store(results, store, repeat)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the NY Times acquisition scripts and dashboard.')
+    parser.add_argument('--scale', choices=list(SCALES), default='10k', help='Number of articles per API')
+    parser.add_argument('--mongomock', action='store_true', help='Use mongomock instead of a MongoDB server')
+    parser.add_argument('--allow-existing', action='store_true',
+                        help='Run even if the NY_Project database already holds articles')
+    parser.add_argument('--pages', type=int, default=None, help='Article Search pages to fetch (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions of the dashboard benchmarks')
+    parser.add_argument('--only', choices=['ingest', 'dashboard', 'search'], default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON file to write (default: benchmarks/results/...)')
+    parser.add_argument('--baseline', default=None, help='Earlier results to compare with')
+    args = parser.parse_args()
+
+    data = SyntheticNYT(SCALES[args.scale], args.seed)
+    server = FakeNYTServer(data, archive_months=ARCHIVE_MONTHS)
+    prepare_environment(server.start(), tempfile.mkdtemp(prefix='nyt_benchmark_cache_'))
+
+    if args.only == 'search':
+        backend = 'none'
+    elif args.mongomock:
+        backend, db = 'mongomock', use_mongomock()['NY_Project']
+    else:
+        from nyt_common.db import database
+        backend, db = 'mongod', database()
+    existing = [name for name in ['times_newswire', 'times_archive', 'ny_articles']
+                if db[name].estimated_document_count() > 0] if backend != 'none' else []
+    if existing and args.only != 'dashboard' and not args.allow_existing:
+        server.stop()
+        sys.exit(f'NY_Project already holds articles ({", ".join(existing)}): use a dedicated MongoDB instance, '
+                 'or --allow-existing.')
+
+    results = BenchmarkResults(args.scale, backend)
+    try:
+        if args.only in [None, 'ingest']:
+            run_ingest_benchmarks(results, data, args.pages or data.size // 10, args.mongomock)
+        if args.only in [None, 'dashboard']:
+            run_dashboard_benchmarks(results, args.repeat, args.mongomock)
+        if args.only == 'search':
+            run_search_benchmarks(results, data, args.repeat)
+    finally:
+        server.stop()
+    results.metadata['fake_nyt_requests'] = server.requests
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(ROOT, 'benchmarks', 'results'), exist_ok=True)
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        output = os.path.join(ROOT, 'benchmarks', 'results', f'{args.scale}-{results.metadata["commit"]}-{stamp}.json')
+    results.write(output)
+    print(f'\nResults written to {output}')
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(json.load(baseline_file), results.to_dict())
+        for name, before, after in regressions:
+            print(f'Slower: {name}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms')
+        if not regressions:
+            print('No regression against the baseline.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+'''Synthetic NY Times data, shaped like the responses of the Newswire, Archive and Article Search APIs.
+Every document is generated from its index and the seed, so that the fake server (see fake_nyt.py) can
+serve any page of a million-article dataset without holding it in memory, and two runs see the same data.
+'''
+
+import datetime
+import math
+import random
+import uuid
+
+from nyt_common.countries import COUNTRY_NAMES
+
+SCALES = {'10k':10_000, '100k':100_000, '1m':1_000_000}
+
+SECTIONS = ['world', 'u.s.', 'politics', 'business', 'technology', 'science', 'health', 'sports', 'arts',
+            'books', 'style', 'food', 'travel', 'magazine', 'opinion', 'real estate', 'climate', 'education',
+            'movies', 'theater', 'well', 'podcasts', 'briefing', 'obituaries', 'nyregion']
+SUBSECTIONS = {'world':['europe', 'asia', 'africa', 'americas', 'middleeast', 'australia', 'canada'],
+               'business':['economy', 'dealbook', 'media', 'energy-environment'],
+               'arts':['music', 'television', 'design', 'dance'],
+               'sports':['baseball', 'basketball', 'soccer', 'tennis', 'football']}
+NEWS_DESKS = ['Foreign', 'National', 'Washington', 'Business', 'Culture', 'Sports', 'OpEd', 'Science',
+              'Metro', 'Styles', 'Dining', 'Travel', 'Magazine', 'Books', 'Climate']
+WORDS = ('election government court market economy climate policy president minister war peace talks trade '
+         'report study health vaccine school city state budget tax energy oil storm record season team '
+         'league game film music museum review novel chef recipe travel housing police strike protest '
+         'company deal shares bank rates inflation jobs workers union space research data privacy '
+         'artificial intelligence startup investors crisis aid border migrants summit treaty sanctions').split()
+AUTHORS = [f'{first} {last}' for first in ['Alex', 'Maria', 'David', 'Sarah', 'James', 'Emily', 'Carlos', 'Nina']
+           for last in ['Smith', 'Chen', 'Garcia', 'Cohen', 'Okafor', 'Dubois', 'Kim', 'Rossi', 'Patel']]
+
+NEWSWIRE_PER_SECTION = 1000 #The ingestor reads at most 1,000 items (two pages of 500) per section
+ARTICLE_SEARCH_PAGE = 10 #Article Search returns 10 documents per page
+START = datetime.datetime(2024, 6, 30, 23, 0) #Newest article; older ones go back over two years
+SPAN = datetime.timedelta(days=730)
+
+class SyntheticNYT:
+    '''Deterministic generator of `size` articles for each API.'''
+    def __init__(self, size:int, seed:int = 0):
+        self.size = size
+        self.seed = seed
+
+    def rng(self, kind:str, index:int) -> random.Random:
+        return random.Random(f'{self.seed}:{kind}:{index}')
+
+    def sentence(self, rng:random.Random, nb_words:int, country_chance:float) -> str:
+        words = [rng.choice(WORDS) for _ in range(nb_words)]
+        if rng.random() < country_chance:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(COUNTRY_NAMES))
+        return ' '.join(words).capitalize()
+
+    def uri(self, kind:str, index:int) -> str:
+        return f'nyt://article/{uuid.UUID(int=random.Random(f"{self.seed}:{kind}:uri:{index}").getrandbits(128))}'
+
+    def date_of(self, index:int) -> datetime.datetime:
+        '''Articles are spread evenly over SPAN, index 0 being the newest.'''
+        return START - SPAN * (index / max(self.size, 1))
+
+    #Newswire API
+    def newswire_sections(self) -> list:
+        '''Enough sections to hold every article (up to NEWSWIRE_PER_SECTION each).'''
+        nb_sections = max(1, math.ceil(self.size / NEWSWIRE_PER_SECTION))
+        return [SECTIONS[i] if i < len(SECTIONS) else f'section {i}' for i in range(nb_sections)]
+
+    def newswire_page(self, section:str, offset:int, limit:int) -> list:
+        '''Items of a section, newest first: section k holds articles k, k + nb_sections, k + 2 * nb_sections...'''
+        sections = self.newswire_sections()
+        if section not in sections:
+            return []
+        position = sections.index(section)
+        indices = range(position + offset * len(sections), self.size, len(sections))
+        return [self.newswire_item(index, section) for index in indices[:limit]]
+
+    def newswire_item(self, index:int, section:str) -> dict:
+        rng = self.rng('newswire', index)
+        created = self.date_of(index)
+        updated = created + datetime.timedelta(minutes=rng.randrange(0, 600))
+        subsection = rng.choice(SUBSECTIONS.get(section, [''] * 3 + ['features']))
+        iso = lambda date: date.strftime('%Y-%m-%dT%H:%M:%S-05:00')
+        return {
+            'slug_name': f'{section}-{index}',
+            'section': section,
+            'subsection': subsection,
+            'title': self.sentence(rng, rng.randint(6, 12), 0.3),
+            'abstract': self.sentence(rng, rng.randint(20, 40), 0.4),
+            'uri': self.uri('newswire', index),
+            'url': f'https://www.nytimes.com/{created:%Y/%m/%d}/{section.replace(" ", "-")}/article-{index}.html',
+            'byline': 'By ' + ' and '.join(rng.sample(AUTHORS, rng.randint(1, 2))),
+            'item_type': rng.choice(['Article'] * 9 + ['Interactive']),
+            'source': 'New York Times',
+            'updated_date': iso(updated),
+            'created_date': iso(created),
+            'published_date': iso(created),
+            'first_published_date': iso(created),
+            'material_type_facet': rng.choice(['News', 'Op-Ed', 'Review', '']),
+            'kicker': '',
+            'subheadline': '',
+            'des_facet': [rng.choice(WORDS).title() for _ in range(3)],
+            'org_facet': [],
+            'per_facet': [],
+            'geo_facet': [],
+            'related_urls': None,
+            'multimedia': [{'url':f'https://static01.nyt.com/images/{index}-{size}.jpg', 'format':size,
+                            'height':height, 'width':width, 'type':'image', 'subtype':'photo',
+                            'caption':'', 'copyright':'The New York Times'}
+                           for size, height, width in [('Standard Thumbnail', 75, 75), ('mediumThreeByTwo210', 140, 210),
+                                                       ('Normal', 127, 190), ('mediumThreeByTwo440', 293, 440)]],
+        }
+
+    #Archive and Article Search APIs (same document format)
+    def search_document(self, kind:str, index:int, published:datetime.datetime = None) -> dict:
+        rng = self.rng(kind, index)
+        published = published or self.date_of(index)
+        headline = self.sentence(rng, rng.randint(6, 12), 0.3)
+        authors = rng.sample(AUTHORS, rng.randint(1, 2))
+        return {
+            'abstract': self.sentence(rng, rng.randint(20, 40), 0.4),
+            'web_url': f'https://www.nytimes.com/{published:%Y/%m/%d}/{kind}-{index}.html',
+            'snippet': self.sentence(rng, 20, 0.1),
+            'lead_paragraph': self.sentence(rng, 50, 0.2),
+            'source': 'The New York Times',
+            'multimedia': [{'rank':0, 'subtype':'xlarge', 'caption':None, 'credit':None, 'type':'image',
+                            'url':f'images/{index}.jpg', 'height':400, 'width':600}] * 3,
+            'headline': {'main':headline, 'kicker':None, 'print_headline':headline},
+            'keywords': [{'name':rng.choice(['subject', 'glocations', 'persons', 'organizations']),
+                          'value':rng.choice(WORDS).title(), 'rank':rank, 'major':'N'}
+                         for rank in range(1, rng.randint(2, 8))],
+            'pub_date': published.strftime('%Y-%m-%dT%H:%M:%S+0000'),
+            'document_type': 'article',
+            'news_desk': rng.choice(NEWS_DESKS),
+            'section_name': rng.choice(SECTIONS).title(),
+            'byline': {'original':'By ' + ' and '.join(authors),
+                       'person':[{'firstname':author.split()[0], 'lastname':author.split()[1]} for author in authors],
+                       'organization':None},
+            'type_of_material': 'News',
+            '_id': self.uri(kind, index),
+            'word_count': rng.randint(200, 3000),
+            'uri': self.uri(kind, index),
+        }
+
+    def archive_month(self, year:int, month:int, nb_months:int) -> list:
+        '''One month of the Archive API: the articles are spread over nb_months months, counting back from START.'''
+        months_back = (START.year - year) * 12 + (START.month - month)
+        per_month = math.ceil(self.size / max(nb_months, 1))
+        first = (months_back % max(nb_months, 1)) * per_month
+        month_start = datetime.datetime(year, month, 1)
+        return [self.search_document(f'archive:{year}-{month}', index,
+                                     month_start + datetime.timedelta(days=28) * ((index - first) / per_month))
+                for index in range(first, min(first + per_month, self.size))]
+
+    def articlesearch_page(self, page:int) -> list:
+        first = page * ARTICLE_SEARCH_PAGE
+        return [self.search_document('articlesearch', index)
+                for index in range(first, min(first + ARTICLE_SEARCH_PAGE, self.size))]
@@ -0,0 +1,48 @@
+'''Client of the NY News API (see api/main.py).
+When NYT_DATA_API_URL is set (e.g. http://api:8000), the dashboard reads its data from the API instead of
+querying MongoDB itself: no page then opens a MongoDB connection. Responses are kept in memory along with their
+ETag, so that unchanged data is revalidated with a 304 instead of being downloaded and decoded again.
+
+Settings: NYT_DATA_API_URL, NYT_DATA_API_TIMEOUT (seconds).
+'''
+
+import json
+import os
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+API_URL = os.environ.get('NYT_DATA_API_URL', '').rstrip('/')
+API_TIMEOUT = float(os.environ.get('NYT_DATA_API_TIMEOUT', 30))
+
+def enabled() -> bool:
+    return bool(API_URL)
+
+_responses = {} #url -> (etag, decoded body)
+_lock = threading.Lock()
+
+def get_json(path:str, params:dict = None):
+    '''GETs an API endpoint and returns its decoded JSON body. Parameters set to None are left out.'''
+    query = urllib.parse.urlencode({key:value for key, value in (params or {}).items() if value is not None})
+    url = f'{API_URL}{path}' + (f'?{query}' if query else '')
+
+    request = urllib.request.Request(url, headers={'Accept':'application/json'})
+    with _lock:
+        cached = _responses.get(url)
+    if cached is not None:
+        request.add_header('If-None-Match', cached[0])
+
+    try:
+        with urllib.request.urlopen(request, timeout=API_TIMEOUT) as response:
+            data = json.loads(response.read())
+            etag = response.headers.get('ETag')
+    except urllib.error.HTTPError as error:
+        if error.code == 304 and cached is not None:
+            return cached[1]
+        raise
+
+    if etag:
+        with _lock:
+            _responses[url] = (etag, data)
+    return data
@@ -0,0 +1,227 @@
+'''Columnar, in-memory store of the Newswire article log.
+Articles used to be kept as one dict per article (every field, four datetimes each), which cost a few KB per
+article. The store only keeps the fields the search and timeline views use, one column each:
+- section, subsection, item_type and byline are categoricals (each distinct string is stored once),
+- dates are datetime64[ns] columns (one int64 per article),
+- title, abstract and url are plain string columns.
+Lookups return row indices (numpy arrays), and rows() turns the requested ones into dicts for display.
+
+search() matches substrings of titles and abstracts, through an inverted index built once per store (that is,
+once per data refresh, see SearchIndex): a sorted vocabulary of the lowercased words, and the rows of each word.
+A query term never holds a space, so it matches an article if and only if it is a substring of one of its words:
+the words containing the term are found in the vocabulary, and their rows are merged, then intersected per term.
+'''
+
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+TEXT_FIELDS = ['title', 'abstract', 'url']
+CATEGORICAL_FIELDS = ['section', 'subsection', 'item_type', 'byline']
+DATE_FIELDS = ['updated_date', 'created_date']
+FIELDS = TEXT_FIELDS + CATEGORICAL_FIELDS + DATE_FIELDS
+
+#A word found in more than 1/BITMAP_FRACTION of the articles keeps its rows as a bitmap (one bit per article),
+#which is then smaller than its list of rows (4 bytes per row).
+BITMAP_FRACTION = 32
+INDEX_CHUNK_SIZE = 100_000 #Articles tokenized at a time while building the index
+SCAN_CHUNK_BYTES = 8192 #Bitmap bytes (8 articles each) scanned at a time while collecting the first rows
+SEPARATOR = '\x00' #Between two articles while tokenizing: removed from the texts beforehand
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+#Rows of the articles matching (part of) a query, stored as a bitmap rather than a sorted array of rows
+RowBitmap = namedtuple('RowBitmap', ['bits'])
+
+class ArticleStore:
+    '''Article log as a DataFrame of compact columns, sorted by updated_date (most recent first).'''
+    def __init__(self, frame:pd.DataFrame = None):
+        if frame is None:
+            frame = pd.DataFrame({field:[] for field in FIELDS})
+        self.frame = self.compact(frame)
+        self.search_index = None #Built by build_search_index, or by the first search
+
+    @staticmethod
+    def projection() -> dict:
+        '''MongoDB projection of the fields the store keeps.'''
+        projection = {field:1 for field in FIELDS}
+        projection['_id'] = 0
+        return projection
+
+    @classmethod
+    def from_documents(cls, documents) -> 'ArticleStore':
+        '''Builds the store from an iterable of documents (e.g. a cursor), one column at a time, so that the
+        documents themselves are never all held in memory.'''
+        columns = {field:[] for field in FIELDS}
+        for doc in documents:
+            for field, column in columns.items():
+                column.append(doc.get(field))
+        return cls(pd.DataFrame(columns))
+
+    @staticmethod
+    def compact(frame:pd.DataFrame) -> pd.DataFrame:
+        frame = frame.reindex(columns=FIELDS)
+        for field in TEXT_FIELDS:
+            frame[field] = frame[field].fillna('').astype(str)
+        for field in CATEGORICAL_FIELDS:
+            frame[field] = frame[field].fillna('').astype(str).astype('category')
+        for field in DATE_FIELDS:
+            frame[field] = pd.to_datetime(frame[field], errors='coerce')
+        frame = frame.sort_values('updated_date', ascending=False, kind='stable', na_position='last')
+        return frame.reset_index(drop=True)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def memory_usage(self) -> int:
+        '''Bytes held by the store, strings included.'''
+        return int(self.frame.memory_usage(deep=True).sum())
+
+    def filter(self, section:str = None, subsection:str = None, start=None, end=None) -> np.ndarray:
+        '''Row indices of the articles of a section/subsection whose updated_date is within [start, end),
+        most recent first. Arguments left to None do not filter.'''
+        mask = np.ones(len(self.frame), dtype=bool)
+        if section is not None:
+            mask &= (self.frame['section'] == section).to_numpy()
+        if subsection is not None:
+            mask &= (self.frame['subsection'] == subsection).to_numpy()
+        if start is not None:
+            mask &= (self.frame['updated_date'] >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            mask &= (self.frame['updated_date'] < pd.Timestamp(end)).to_numpy()
+        return np.flatnonzero(mask)
+
+    def rows(self, indices, fields:list = None) -> list:
+        '''The articles at the given row indices, as dicts (dates as datetimes), in the order of the indices.'''
+        selected = self.frame.iloc[np.asarray(indices, dtype=np.int64)]
+        if fields is not None:
+            selected = selected[fields]
+        records = selected.to_dict('records')
+        for record in records:
+            for field in DATE_FIELDS:
+                if field in record:
+                    record[field] = None if pd.isna(record[field]) else record[field].to_pydatetime()
+        return records
+
+    def build_search_index(self):
+        self.search_index = SearchIndex((self.frame['title'] + '\n' + self.frame['abstract']).str.lower())
+
+    def search(self, query:str, max_ids:int = None) -> tuple:
+        '''Articles whose title or abstract contains every term of the query (case-insensitive substrings).
+        Returns (row indices of the first max_ids of them, or all of them if None, number of matching articles).
+        Rows are sorted: since they are sorted by updated_date, most recent first.'''
+        terms = [term for term in query.lower().split() if term]
+        if not terms or len(self.frame) == 0:
+            return np.array([], dtype=np.int64), 0
+        if self.search_index is None:
+            self.build_search_index()
+        return self.search_index.search(terms, max_ids)
+
+class SearchIndex:
+    '''Inverted index of the words (whitespace-separated) of a Series of lowercased texts, one per row.
+    The vocabulary is kept as one string, words separated by SEPARATOR, to find the words containing a term
+    with a single scan. The rows of each word are sorted, and stored either as a slice of one array of rows,
+    or as a bitmap for the words of more than 1/BITMAP_FRACTION of the rows (see BITMAP_FRACTION).'''
+    def __init__(self, texts:pd.Series):
+        self.nb_rows = len(texts)
+        texts = texts.str.replace(SEPARATOR, ' ', regex=False).reset_index(drop=True)
+
+        vocabulary, word_ids, rows = {}, [], []
+        for start in range(0, self.nb_rows, INDEX_CHUNK_SIZE):
+            #One split of the whole chunk: SEPARATOR words mark where each article starts
+            words = f' {SEPARATOR} '.join(texts.iloc[start:start + INDEX_CHUNK_SIZE].tolist()).split()
+            codes, uniques = pd.factorize(np.array(words, dtype=object))
+            separator = [code for code, word in enumerate(uniques) if word == SEPARATOR]
+            chunk_rows = np.zeros(len(codes), dtype=np.int64) + start
+            if separator:
+                is_separator = codes == separator[0]
+                chunk_rows += np.cumsum(is_separator)
+                codes, chunk_rows = codes[~is_separator], chunk_rows[~is_separator]
+            ids = np.fromiter((vocabulary.setdefault(word, len(vocabulary)) for word in uniques), dtype=np.int64,
+                              count=len(uniques))
+            #Distinct (word, row) pairs, sorted by word then row
+            keys = np.sort(ids[codes] * max(self.nb_rows, 1) + chunk_rows)
+            keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+            word_ids.append((keys // max(self.nb_rows, 1)).astype(np.int32))
+            rows.append((keys % max(self.nb_rows, 1)).astype(np.int32))
+
+        #Chunks hold increasing rows: a stable sort by word keeps the rows of each word sorted
+        word_ids = np.concatenate(word_ids) if word_ids else np.array([], dtype=np.int32)
+        rows = np.concatenate(rows) if rows else np.array([], dtype=np.int32)
+        rows = rows[np.argsort(word_ids, kind='stable')]
+        counts = np.bincount(word_ids, minlength=len(vocabulary))
+        del word_ids
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        dense = counts > self.nb_rows / BITMAP_FRACTION
+        self.bitmap_of = np.full(len(vocabulary), -1, dtype=np.int64) #Word -> its row in self.bitmaps, or -1
+        self.bitmap_of[dense] = np.arange(dense.sum())
+        self.bitmaps = np.stack([self.bitmap(rows[offsets[word]:offsets[word + 1]]) for word in np.flatnonzero(dense)]) \
+                       if dense.any() else np.zeros((0, (self.nb_rows + 7) // 8), dtype=np.uint8)
+        self.rows = rows[~np.repeat(dense, counts)]
+        self.offsets = np.concatenate(([0], np.cumsum(np.where(dense, 0, counts))))
+
+        words = list(vocabulary)
+        lengths = np.fromiter((len(word) + 1 for word in words), dtype=np.int64, count=len(words))
+        self.word_starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(words) else lengths
+        self.vocabulary = SEPARATOR.join(words)
+
+    def bitmap(self, rows:np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.nb_rows, dtype=bool)
+        mask[rows] = True
+        return np.packbits(mask)
+
+    def words_containing(self, term:str) -> np.ndarray:
+        positions = np.fromiter((match.start() for match in re.finditer(re.escape(term), self.vocabulary)),
+                                dtype=np.int64)
+        return np.unique(np.searchsorted(self.word_starts, positions, side='right') - 1)
+
+    def term_rows(self, term:str):
+        '''Rows of the words containing term: a sorted array of rows, or a RowBitmap if they are many.'''
+        words = self.words_containing(term)
+        bitmap_rows = self.bitmap_of[words]
+        listed = words[bitmap_rows < 0]
+        starts, ends = self.offsets[listed], self.offsets[listed + 1]
+        lengths = ends - starts
+        #The slices of self.rows of every listed word, end to end
+        rows = self.rows[np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)]
+
+        if not (bitmap_rows >= 0).any() and len(rows) <= self.nb_rows / BITMAP_FRACTION:
+            return np.unique(rows)
+        bits = self.bitmap(rows)
+        for bitmap_row in bitmap_rows[bitmap_rows >= 0]:
+            bits |= self.bitmaps[bitmap_row]
+        return RowBitmap(bits)
+
+    @staticmethod
+    def intersect(matches, rows):
+        if isinstance(matches, RowBitmap) and isinstance(rows, RowBitmap):
+            return RowBitmap(matches.bits & rows.bits)
+        if isinstance(matches, RowBitmap):
+            matches, rows = rows, matches
+        if isinstance(rows, RowBitmap):
+            return matches[(rows.bits[matches >> 3] >> (7 - (matches & 7))) & 1 == 1]
+        return np.intersect1d(matches, rows, assume_unique=True)
+
+    def search(self, terms:list, max_ids:int = None) -> tuple:
+        '''(first max_ids rows containing every term, number of such rows), see ArticleStore.search.'''
+        matches = None
+        for term in sorted(set(terms), key=len, reverse=True):
+            rows = self.term_rows(term)
+            matches = rows if matches is None else self.intersect(matches, rows)
+            if not isinstance(matches, RowBitmap) and len(matches) == 0:
+                break
+        if not isinstance(matches, RowBitmap):
+            return matches[:max_ids].astype(np.int64), len(matches)
+
+        #Only the first max_ids rows are listed, the others are only counted
+        total = int(POPCOUNT[matches.bits].sum(dtype=np.int64))
+        found, nb_found = [], 0
+        for start in range(0, len(matches.bits), SCAN_CHUNK_BYTES):
+            chunk_rows = np.flatnonzero(np.unpackbits(matches.bits[start:start + SCAN_CHUNK_BYTES])) + start * 8
+            found.append(chunk_rows)
+            nb_found += len(chunk_rows)
+            if max_ids is not None and nb_found >= max_ids:
+                break
+        return np.concatenate(found)[:max_ids].astype(np.int64), total
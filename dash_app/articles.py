@@ -1,188 +1,169 @@
 import os
+import re
+import sys
+import time
+from functools import lru_cache
 import dash
 from dash import dcc, html, Input, Output, callback
 import plotly.express as px
 import pymongo
 import dash_bootstrap_components as dbc
-from dash_bootstrap_templates import load_figure_template
+
+#The shared helpers live at the root of the repository.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nyt_common.keywords import normalize_term
+from nyt_common.metrics import timed_callback
+from nyt_common.db import database
+from data_cache import data_cache, dataset_ttl
+import api_client
+from query_profiler import profile_collection
 
 dash.register_page(__name__)
 
 #Receiving our data from MongoDB
-MONGO_LABEL = os.environ.get('MONGODB_ADDRESS','localhost') #Unless you have your own address
-MONGO_PORT = int(os.environ.get('MONGODB_PORT',27017)) #Unless you have a specific port, default is 27017
-DB_CLIENT = pymongo.MongoClient(MONGO_LABEL, MONGO_PORT) # pymongo.MongoClient(host=MONGO_LABEL, port=MONGO_PORT)
-db = DB_CLIENT['NY_Project']
+#One client per worker process, connecting on first use (MONGODB_ADDRESS, MONGODB_PORT, pool size...: see nyt_common/db.py)
+db = database()
 
-articlesearch = db['ny_articles'] #Kenan's NY Articles Collection
+articlesearch = profile_collection(db['ny_articles']) #Kenan's NY Articles Collection
 
 #Article Search Section
-pipeline = [
+#Per-news-desk statistics: one small document per desk, whatever the size of the collection.
+desk_pipeline = [
     {
         '$group': {
             '_id': '$news_desk',
             # 'section_word_count': {'$sum': '$word_count'},
-            'section_word_count': {'$avg': '$word_count'},
-            'section_article_count': {'$sum': 1},
-            'newest_articles': {
-                '$push': {
-                    'headline': '$headline',
-                    'web_url': '$web_url',
-                    'pub_date': '$pub_date'
-                }
-            }
-        }
-    },
-    {
-        '$group': {
-            '_id': None,
-            'average_word_count': {'$avg': '$section_word_count'},
-            'total_article_count': {'$sum': '$section_article_count'},
-            'sections': {
-                '$push': {
-                    'section': '$_id',
-                    'average_word_count': {'$avg': '$section_word_count'},
-                    'article_count': '$section_article_count'
-                }
-            },
-            'all_articles': {'$push': '$newest_articles'}
+            'average_word_count': {'$avg': '$word_count'},
+            'article_count': {'$sum': 1}
         }
     },
     {
         '$project': {
-            'average_word_count': 1,
-            'total_article_count': 1,
-            'sections': 1,
-            # Flatten the array of arrays
-            'flattened_articles': {'$reduce': {
-                'input': '$all_articles',
-                'initialValue': [],
-                'in': {'$concatArrays': ['$$value', '$$this']}
-            }}
+            'section': '$_id',
+            'average_word_count': {'$ifNull': ['$average_word_count', 0]},
+            'article_count': 1,
+            '_id': 0
         }
     },
     {
-        '$unwind': '$flattened_articles'
-    },
-    {
-        '$sort': {'flattened_articles.pub_date': -1}
-    },
-    {
-        '$limit': 5
-    },
-    {
-        '$group': {
-            '_id': '$_id',
-            'average_word_count': {'$first': '$average_word_count'},
-            'total_article_count': {'$first': '$total_article_count'},
-            'sections': {'$first': '$sections'},
-            'newest_articles': {'$push': '$flattened_articles'}
-        }
+        '$sort': {'article_count': -1}
     }
 ]
 
-result_article_search = list(articlesearch.aggregate(pipeline))
-
-if result_article_search:
-   # Extracting data from the 'result' for 'sections'
-    sections_data = [    {'section': section['section'], 'count': section['article_count']}
-        for section in result_article_search[0]['sections']
-    ]
+def load_articles_overview():
+    """
+    Statistics shown on the Articles page: per-desk stats from a $group, and the 5 newest articles
+    from an indexed sort on pub_date (see nyt_common/indexes.py).
+    """
+    if api_client.enabled():
+        sections = api_client.get_json('/articles/stats')
+        newest_articles = api_client.get_json('/articles/latest', {'limit': 5})
+    else:
+        sections = list(articlesearch.aggregate(desk_pipeline))
+        newest_articles = list(articlesearch.find({}, {'headline': 1, 'web_url': 1, 'pub_date': 1, '_id': 0})
+                                            .sort('pub_date', pymongo.DESCENDING).limit(5))
+
+    # The average word count is the average of each section's average, as it always was
+    return {
+        'total_article_count': sum(section['article_count'] for section in sections),
+        'average_word_count': (sum(section['average_word_count'] for section in sections) / len(sections)) if sections else 0,
+        'sections': sections,
+        'newest_articles': newest_articles
+    }
 
-    # # Save aggregated data into a new collection
-    # aggregated_data_collection = db.ny_articles_aggregated_data
-    # aggregated_data_collection.insert_one({
-    #     'total_articles': sum(section['count'] for section in sections_data),
-    #     'average_word_count': result[0]['average_word_count'],
-    #     'sections': sections_data,
-    #     'newest_articles': result[0]['newest_articles'],
-    #     'timestamp': datetime.now()
-    # })
+def layout():
+    """
+    The page is built when it is visited, not when the app starts. Its data goes through the shared cache.
+    """
+    result_article_search = data_cache.get('articles_overview', load_articles_overview)
 
     # # Extract total number of articles, average word count, sections with counts, and newest articles
-    total_articles = result_article_search[0]["total_article_count"]
-    average_word_count = result_article_search[0]["average_word_count"]
-    sections = [section['section'] for section in result_article_search[0]['sections']]
-    article_counts = [section['article_count'] for section in result_article_search[0]['sections']]
-    newest_articles = result_article_search[0]['newest_articles']
+    total_articles = result_article_search["total_article_count"]
+    average_word_count = result_article_search["average_word_count"]
+    sections = [section['section'] for section in result_article_search['sections']]
+    article_counts = [section['article_count'] for section in result_article_search['sections']]
+    newest_articles = result_article_search['newest_articles']
 
     ## Figure
     # Extract the data for the scatter plot
-    scatter_data = result_article_search[0]['sections']
-
-#Article search: Plotly
-# Create a scatter plot using Plotly Express
-fig_article = px.scatter(
-    scatter_data,
-    x='article_count',
-    y='average_word_count',
-    text='section',
-    labels={'article_count': 'Number of Articles', 'average_word_count': 'Average Word Count'},
-    color='section',
-    title='Number of Articles vs Average Word Count per Section',
-    template='plotly_dark'
-)
-fig_article.update_layout(
-        {
-            "paper_bgcolor": "rgba(0, 0, 0, 0)",
-            "plot_bgcolor": "rgba(0, 0, 0, 0)",
-        }
-    )
-
-# Scatter plot showing number of articles vs average word count per section
-scatter_plot = dcc.Graph(
-    id='section-scatter-plot',
-    figure=fig_article,
-    config={'displayModeBar': False}  # Hide the interactive mode bar
-)
+    scatter_data = result_article_search['sections']
+
+    #Article search: Plotly
+    # Create a scatter plot using Plotly Express
+    if scatter_data:
+        fig_article = px.scatter(
+            scatter_data,
+            x='article_count',
+            y='average_word_count',
+            text='section',
+            labels={'article_count': 'Number of Articles', 'average_word_count': 'Average Word Count'},
+            color='section',
+            title='Number of Articles vs Average Word Count per Section',
+            template='plotly_dark'
+        )
+    else:
+        fig_article = px.scatter(title='No articles yet', template='plotly_dark')
+    fig_article.update_layout(
+            {
+                "paper_bgcolor": "rgba(0, 0, 0, 0)",
+                "plot_bgcolor": "rgba(0, 0, 0, 0)",
+            }
+        )
 
-tab_art_landing = html.Div([
-    html.H2(children='NY Times Article Statistics'),
-    html.Div(children=f'Total articles: {total_articles}', style={'marginBottom': 20}),
-    html.Div(children=f'The average word count is: {average_word_count:.2f}', style={'marginBottom': 20}),
-    html.Br(),
-    html.H2("5 Latest Articles:"),
-    # Create a list of links to the 5 newest articles
-    html.Ul([
-        html.Li(html.A(article['headline']['main'], href=article['web_url'],target='_blank'), style={'list-style-type': 'none'}) for article in newest_articles
-    ])]
+    # Scatter plot showing number of articles vs average word count per section
+    scatter_plot = dcc.Graph(
+        id='section-scatter-plot',
+        figure=fig_article,
+        config={'displayModeBar': False}  # Hide the interactive mode bar
     )
 
-tab_art_graph = html.Div([
-    html.H2("Scatter Plot: Number of Articles vs Average Word Count per Section"),
-    scatter_plot
+    tab_art_landing = html.Div([
+        html.H2(children='NY Times Article Statistics'),
+        html.Div(children=f'Total articles: {total_articles}', style={'marginBottom': 20}),
+        html.Div(children=f'The average word count is: {average_word_count:.2f}', style={'marginBottom': 20}),
+        html.Br(),
+        html.H2("5 Latest Articles:"),
+        # Create a list of links to the 5 newest articles
+        html.Ul([
+            html.Li(html.A((article.get('headline') or {}).get('main'), href=article.get('web_url'),target='_blank'), style={'list-style-type': 'none'}) for article in newest_articles
+        ])]
+        )
+
+    tab_art_graph = html.Div([
+        html.H2("Scatter Plot: Number of Articles vs Average Word Count per Section"),
+        scatter_plot
+        ])
+
+    tab_art_sections_detailed = html.Div([
+        html.H2("Articles per Section:"),
+        html.Br(),
+        # Create a list of sections and counts
+        html.Ul([
+            html.Li(f"{section}: {count} articles") for section, count in zip(sections, article_counts)
+        ])
     ])
 
-tab_art_sections_detailed = html.Div([
-    html.H2("Articles per Section:"),
-    html.Br(),
-    # Create a list of sections and counts
-    html.Ul([
-        html.Li(f"{section}: {count} articles") for section, count in zip(sections, article_counts)
-    ])
-])
-
-tab_art_search = html.Div(children=[
+    tab_art_search = html.Div(children=[
 
-    # Search bar
-    html.H2("Article Search"),
-    dcc.Input(id='search-input', type='text', placeholder='Enter keywords...'),
+        # Search bar
+        html.H2("Article Search"),
+        dcc.Input(id='search-input', type='text', placeholder='Enter keywords...', debounce=True),
 
-    # Create a list of links to the articles based on the search results
-    html.Ul(id='search-results')
+        # Create a list of links to the articles based on the search results
+        html.Ul(id='search-results')
 
-])
+    ])
 
-article_tabs = dbc.Tabs([
-    dbc.Tab([tab_art_landing, tab_art_search], label='Articles at a Glance'),
-    dbc.Tab(tab_art_graph, label='Word Count Distribution Per Section'),
-    dbc.Tab(tab_art_sections_detailed, label='More Section Info')
-])
+    article_tabs = dbc.Tabs([
+        dbc.Tab([tab_art_landing, tab_art_search], label='Articles at a Glance'),
+        dbc.Tab(tab_art_graph, label='Word Count Distribution Per Section'),
+        dbc.Tab(tab_art_sections_detailed, label='More Section Info')
+    ])
 
-#On first load and on reload
-article_tabs.active_tab = 'tab-0'
+    #On first load and on reload
+    article_tabs.active_tab = 'tab-0'
 
-layout = html.Div([article_tabs])
+    return html.Div([article_tabs])
 
 # Define callback to update search results
 @callback(
@@ -190,19 +171,41 @@ layout = html.Div([article_tabs])
     [Input('search-input', 'value')],
     prevent_initial_call=True
 )
+@timed_callback('update_search_results')
 def update_search_results(search_query):
-    # MongoDB query to find articles containing the search query in keywords
-    search_pipeline = [
-        {'$match': {'keywords.value': {'$regex': f'{search_query}', '$options': 'i'}}},
-        {'$project': {'headline': '$headline.main', 'web_url': '$web_url', '_id': 0}},
-        {'$limit': 5}
-    ]
-
-    search_results = list(articlesearch.aggregate(search_pipeline))
+    # The input is debounced: this only runs when the user presses Enter or leaves the field
+    search_results = search_keywords(normalize_term(search_query))
 
     # Display search results as links
     result_links = [
-        html.Li(html.A(result['headline'], href=result['web_url'],target='_blank')) for result in search_results
+        html.Li(html.A(headline, href=web_url,target='_blank')) for headline, web_url in search_results
     ]
 
     return result_links
+
+def search_keywords(search_term, limit=5):
+    """
+    Returns (headline, web_url) pairs of articles having a keyword that starts with the (normalized) search term.
+    The anchored, case-sensitive prefix is answered by the keyword_terms index, and results are cached per query
+    for DASH_CACHE_TTL_ARTICLES_SEARCH seconds (see data_cache.py), so that newly ingested articles show up.
+    """
+    ttl = max(1, dataset_ttl('articles_search'))
+    return search_keywords_cached(search_term, limit, int(time.time() // ttl))
+
+@lru_cache(maxsize=256)
+def search_keywords_cached(search_term, limit, period):
+    '''search_keywords, cached per query and per TTL period: entries of past periods are never hit again,
+    and the LRU evicts them.'''
+    if not search_term:
+        return ()
+
+    if api_client.enabled():
+        search_results = api_client.get_json('/articles/keywords', {'q': search_term, 'limit': limit})
+        return tuple(((result.get('headline') or {}).get('main'), result.get('web_url')) for result in search_results)
+
+    search_results = articlesearch.find(
+        {'keyword_terms': {'$regex': f'^{re.escape(search_term)}'}},
+        {'headline.main': 1, 'web_url': 1, '_id': 0}
+    ).limit(limit)
+
+    return tuple(((result.get('headline') or {}).get('main'), result.get('web_url')) for result in search_results)
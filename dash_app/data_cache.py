@@ -0,0 +1,125 @@
+'''Data cache shared by every worker process of the dashboard.
+Each dataset (usually a DataFrame) is pickled to a local directory, so N gunicorn workers share one copy
+on disk instead of running N copies of each aggregation. Datasets expire after their TTL, and are then
+refreshed stale-while-revalidate: the stale copy is served right away while one worker (chosen through a
+file lock) rebuilds it in a background thread. Only a cold start, with nothing on disk, waits for the loader.
+Incremental loaders receive the previous copy of their dataset (None on a cold start), so that they only
+fetch what changed since.
+
+Settings: DASH_CACHE_DIR (defaults to a folder in the system's temporary directory),
+DASH_CACHE_TTL (default TTL in seconds), DASH_CACHE_TTL_<DATASET> (TTL of one dataset).
+'''
+
+import fcntl
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+CACHE_DIR = os.environ.get('DASH_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nyt_dashboard_cache'))
+DEFAULT_TTL = int(os.environ.get('DASH_CACHE_TTL', 900))
+
+#TTL per dataset, in seconds. Rollups change every few hours at most, hence the longer TTLs.
+DATASET_TTLS = {
+    'newswire_sections': 900,
+    'newswire_subsections': 900,
+    'newswire_authors': 1800,
+    'newswire_geo_title': 1800,
+    'newswire_geo_abstract': 1800,
+    'newswire_section_labels': 3600, #New sections are rare
+    'articles_overview': 1800,
+    'articles_search': 300, #Kept in memory by each worker, see search_keywords in articles.py
+}
+
+def dataset_ttl(name:str) -> int:
+    return int(os.environ.get(f'DASH_CACHE_TTL_{name.upper()}', DATASET_TTLS.get(name, DEFAULT_TTL)))
+
+class DataCache:
+    '''File-backed cache: get(name, loader) returns the cached dataset, building it with loader() if needed
+    (loader(previous dataset) with incremental=True).'''
+    def __init__(self, cache_dir:str = CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.memory = {} #name -> (mtime of the file we loaded, dataset): avoids unpickling on every call
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def path(self, name:str) -> str:
+        return os.path.join(self.cache_dir, f'{name}.pkl')
+
+    def get(self, name:str, loader, ttl:int = None, incremental:bool = False):
+        ttl = dataset_ttl(name) if ttl is None else ttl
+        try:
+            mtime = os.path.getmtime(self.path(name))
+        except OSError:
+            #Cold start: build it (or wait for the worker that is already building it)
+            return self.build(name, loader, ttl, blocking=True, incremental=incremental)
+
+        dataset = self.load(name, mtime)
+        if time.time() - mtime > ttl:
+            self.refresh_in_background(name, loader, ttl, incremental)
+        return dataset
+
+    def invalidate(self, name:str):
+        '''Marks a dataset as expired: the next get() serves it one last time and rebuilds it.'''
+        try:
+            os.utime(self.path(name), (0, 0))
+        except OSError:
+            pass
+
+    def load(self, name:str, mtime:float):
+        cached = self.memory.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(self.path(name), 'rb') as cache_file:
+            dataset = pickle.load(cache_file)
+        self.memory[name] = (mtime, dataset)
+        return dataset
+
+    def build(self, name:str, loader, ttl:int, blocking:bool, incremental:bool = False):
+        '''Runs the loader and stores its result, holding the dataset's file lock so that only one
+        worker builds it at a time. Without blocking, gives up (returns None) if another worker holds the lock.'''
+        with open(os.path.join(self.cache_dir, f'{name}.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return None
+            try:
+                #Another worker may have built it while we were waiting for the lock
+                previous = None
+                if os.path.exists(self.path(name)):
+                    mtime = os.path.getmtime(self.path(name))
+                    if time.time() - mtime <= ttl:
+                        return self.load(name, mtime)
+                    if incremental:
+                        previous = self.load(name, mtime)
+
+                dataset = loader(previous) if incremental else loader()
+                temp_path = f'{self.path(name)}.{os.getpid()}.tmp'
+                with open(temp_path, 'wb') as cache_file:
+                    pickle.dump(dataset, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, self.path(name)) #Readers never see a half-written file
+                self.memory[name] = (os.path.getmtime(self.path(name)), dataset)
+                return dataset
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh_in_background(self, name:str, loader, ttl:int, incremental:bool = False):
+        with self.lock:
+            if name in self.refreshing:
+                return
+            self.refreshing.add(name)
+
+        def refresh():
+            try:
+                self.build(name, loader, ttl, blocking=False, incremental=incremental)
+            except Exception as error:
+                print(f'Could not refresh the cached dataset {name}: {error}')
+            finally:
+                with self.lock:
+                    self.refreshing.discard(name)
+
+        threading.Thread(target=refresh, name=f'refresh-{name}', daemon=True).start()
+
+data_cache = DataCache()
@@ -1,369 +1,362 @@
+import datetime
 import os
+import sys
+import threading
+import time
+import weakref
 import dash
 from dash import dcc, html, ctx, callback
 import pandas as pd
 import plotly.express as px
-import pymongo
-from datetime import datetime
 import dash_bootstrap_components as dbc
 from dash_bootstrap_templates import load_figure_template
 from dash.exceptions import PreventUpdate
 
+#The shared helpers live at the root of the repository.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nyt_common.rollups import created_date_range, day_of, refresh_newswire_rollups
+from nyt_common.metrics import timed_callback, timed_dataset
+from nyt_common.db import database
+from data_cache import data_cache
+import api_client
+from article_store import ArticleStore
+from search_handles import search_handles
+from timelines import bucket_timeline, visible_range
+from query_profiler import profile_collection
+
 dash.register_page(__name__)
 
+#Endpoints of the NY News API serving each rollup, when the dashboard runs as its client (see api_client.py)
+ROLLUP_ENDPOINTS = {
+    'newswire_daily_by_section': '/newswire/timeline/sections',
+    'newswire_daily_by_subsection': '/newswire/timeline/subsections',
+    'newswire_daily_by_author': '/newswire/authors',
+}
+
+#The DataFrames are refreshed incrementally every NEWSWIRE_REFRESH_INTERVAL seconds (0 to only refresh them
+#when they expire, see data_cache.py). Articles updated up to NEWSWIRE_REFRESH_OVERLAP seconds before the
+#newest one already loaded are read again, to catch those ingested (or rolled up) late.
+REFRESH_INTERVAL = int(os.environ.get('NEWSWIRE_REFRESH_INTERVAL', 300))
+REFRESH_OVERLAP = datetime.timedelta(seconds=int(os.environ.get('NEWSWIRE_REFRESH_OVERLAP', 86400)))
+
+#'mongo' (text index) or 'memory' (substring search over the in-memory article log)
+SEARCH_BACKEND = os.environ.get('NEWSWIRE_SEARCH_BACKEND', 'mongo')
+
 class NewswireData:
     '''The data that the Newswire API Dashboard uses will be loaded dynamically at times.'''
     def __init__(self):
-        self.country_list={"AF":"Afghanistan","AX":"\u00c5land Islands","AL":"Albania","DZ":"Algeria","AS":"American Samoa","AD":"Andorra","AO":"Angola","AI":"Anguilla","AQ":"Antarctica","AG":"Antigua & Barbuda","AR":"Argentina","AM":"Armenia","AW":"Aruba","AU":"Australia","AT":"Austria","AZ":"Azerbaijan","BS":"Bahamas","BH":"Bahrain","BD":"Bangladesh","BB":"Barbados","BY":"Belarus","BE":"Belgium","BZ":"Belize","BJ":"Benin","BM":"Bermuda","BT":"Bhutan","BO":"Bolivia","BA":"Bosnia & Herzegovina","BW":"Botswana","BV":"Bouvet Island","BR":"Brazil","IO":"British Indian Ocean Territory","VG":"British Virgin Islands","BN":"Brunei","BG":"Bulgaria","BF":"Burkina Faso","BI":"Burundi","KH":"Cambodia","CM":"Cameroon","CA":"Canada","CV":"Cape Verde","BQ":"Caribbean Netherlands","KY":"Cayman Islands","CF":"Central African Republic","TD":"Chad","CL":"Chile","CN":"China","CX":"Christmas Island","CC":"Cocos (Keeling) Islands","CO":"Colombia","KM":"Comoros","CG":"Congo - Brazzaville","CD":"Congo - Kinshasa","CK":"Cook Islands","CR":"Costa Rica","CI":"C\u00f4te d\u2019Ivoire","HR":"Croatia","CU":"Cuba","CW":"Cura\u00e7ao","CY":"Cyprus","CZ":"Czechia","DK":"Denmark","DJ":"Djibouti","DM":"Dominica","DO":"Dominican Republic","EC":"Ecuador","EG":"Egypt","SV":"El Salvador","GQ":"Equatorial Guinea","ER":"Eritrea","EE":"Estonia","SZ":"Eswatini","ET":"Ethiopia","FK":"Falkland Islands","FO":"Faroe Islands","FJ":"Fiji","FI":"Finland","FR":"France","GF":"French Guiana","PF":"French Polynesia","TF":"French Southern Territories","GA":"Gabon","GM":"Gambia","GE":"Georgia","DE":"Germany","GH":"Ghana","GI":"Gibraltar","GR":"Greece","GL":"Greenland","GD":"Grenada","GP":"Guadeloupe","GU":"Guam","GT":"Guatemala","GG":"Guernsey","GN":"Guinea","GW":"Guinea-Bissau","GY":"Guyana","HT":"Haiti","HM":"Heard & McDonald Islands","HN":"Honduras","HK":"Hong Kong SAR China","HU":"Hungary","IS":"Iceland","IN":"India","ID":"Indonesia","IR":"Iran","IQ":"Iraq","IE":"Ireland","IM":"Isle of Man","IL":"Israel","IT":"Italy","JM":"Jamaica","JP":"Japan","JE":"Jersey","JO":"Jordan","KZ":"Kazakhstan","KE":"Kenya","KI":"Kiribati","KW":"Kuwait","KG":"Kyrgyzstan","LA":"Laos","LV":"Latvia","LB":"Lebanon","LS":"Lesotho","LR":"Liberia","LY":"Libya","LI":"Liechtenstein","LT":"Lithuania","LU":"Luxembourg","MO":"Macao SAR China","MG":"Madagascar","MW":"Malawi","MY":"Malaysia","MV":"Maldives","ML":"Mali","MT":"Malta","MH":"Marshall Islands","MQ":"Martinique","MR":"Mauritania","MU":"Mauritius","YT":"Mayotte","MX":"Mexico","FM":"Micronesia","MD":"Moldova","MC":"Monaco","MN":"Mongolia","ME":"Montenegro","MS":"Montserrat","MA":"Morocco","MZ":"Mozambique","MM":"Myanmar (Burma)","NA":"Namibia","NR":"Nauru","NP":"Nepal","NL":"Netherlands","NC":"New Caledonia","NZ":"New Zealand","NI":"Nicaragua","NE":"Niger","NG":"Nigeria","NU":"Niue","NF":"Norfolk Island","KP":"North Korea","MK":"North Macedonia","MP":"Northern Mariana Islands","NO":"Norway","OM":"Oman","PK":"Pakistan","PW":"Palau","PS":"Palestinian Territories","PA":"Panama","PG":"Papua New Guinea","PY":"Paraguay","PE":"Peru","PH":"Philippines","PN":"Pitcairn Islands","PL":"Poland","PT":"Portugal","PR":"Puerto Rico","QA":"Qatar","RE":"R\u00e9union","RO":"Romania","RU":"Russia","RW":"Rwanda","WS":"Samoa","SM":"San Marino","ST":"S\u00e3o Tom\u00e9 & Pr\u00edncipe","SA":"Saudi Arabia","SN":"Senegal","RS":"Serbia","SC":"Seychelles","SL":"Sierra Leone","SG":"Singapore","SX":"Sint Maarten","SK":"Slovakia","SI":"Slovenia","SB":"Solomon Islands","SO":"Somalia","ZA":"South Africa","GS":"South Georgia & South Sandwich Islands","KR":"South Korea","SS":"South Sudan","ES":"Spain","LK":"Sri Lanka","BL":"St. Barth\u00e9lemy","SH":"St. Helena","KN":"St. Kitts & Nevis","LC":"St. Lucia","MF":"St. Martin","PM":"St. Pierre & Miquelon","VC":"St. Vincent & Grenadines","SD":"Sudan","SR":"Suriname","SJ":"Svalbard & Jan Mayen","SE":"Sweden","CH":"Switzerland","SY":"Syria","TW":"Taiwan","TJ":"Tajikistan","TZ":"Tanzania","TH":"Thailand","TL":"Timor-Leste","TG":"Togo","TK":"Tokelau","TO":"Tonga","TT":"Trinidad & Tobago","TN":"Tunisia","TR":"Turkey","TM":"Turkmenistan","TC":"Turks & Caicos Islands","TV":"Tuvalu","UM":"U.S. Outlying Islands","VI":"U.S. Virgin Islands","UG":"Uganda","UA":"Ukraine","AE":"United Arab Emirates","GB":"United Kingdom","US":"United States","UY":"Uruguay","UZ":"Uzbekistan","VU":"Vanuatu","VA":"Vatican City","VE":"Venezuela","VN":"Vietnam","WF":"Wallis & Futuna","EH":"Western Sahara","YE":"Yemen","ZM":"Zambia","ZW":"Zimbabwe"}
-        self.country_list = [i for i in self.country_list.values()]
+        #Nothing is read here: the page is imported by every worker (and by the gunicorn master) before any visit.
         self.article_log = None
-        self.latest = newswire.find_one(
-                {"uri":{"$ne":''}},
-                sort=[( 'updated_date', pymongo.DESCENDING )]
-                )
-        self.oldest = newswire.find_one(
-                {"uri":{"$ne":''}},
-                sort=[( 'updated_date', pymongo.ASCENDING )]
-                )
-        self.section_df = None
-        self.subsection_df = None
-        self.authors_df = None
-        self.geo_title_df = None
-        self.geo_abstract_df = None
+        self.article_log_until = None #updated_until of the section data when the article log was built
+        self.article_lock = threading.Lock()
         self.article_count = 0 #Nifty label for the number of articles we have
-
-    def get_articles(self):
-        '''Initialise the article DataFrame on first call, use it on subsequent calls.'''
+        self.refresh_thread = None
+        self.refresh_lock = threading.Lock()
+
+    @timed_dataset('articles')
+    def get_articles(self) -> ArticleStore:
+        '''Initialise the article log on first call, and rebuild it whenever the data is refreshed (the updated_until
+        of the section data moves, see load_daily_frame): in the background, the previous log answering meanwhile.
+        It is a columnar store of the fields the search and timeline views use, with its search index
+        (see article_store.py).'''
+        updated_until = data_cache.get('newswire_sections', self.load_section_data, incremental=True)['updated_until']
         if self.article_log is None:
-            self.article_log = list(newswire.find({"uri":{"$ne":''}},
-                                    {"_id":0,
-                                    "slug_name":0,
-                                    "uri": 0,
-                                    "multimedia":0}).sort("updated_date",-1))
-
-            for i in self.article_log:
-                i.update({
-                    'updated_date': datetime.fromisoformat(i['updated_date']),
-                    'created_date': datetime.fromisoformat(i['created_date']),
-                    'published_date': datetime.fromisoformat(i['published_date']),
-                    'first_published_date': datetime.fromisoformat(i['first_published_date'])
-                })
+            with self.article_lock:
+                if self.article_log is None:
+                    self.load_articles(updated_until)
+        elif updated_until != self.article_log_until and self.article_lock.acquire(blocking=False):
+            threading.Thread(target=self.reload_articles, args=(updated_until,), name='newswire-articles',
+                             daemon=True).start()
 
         return self.article_log
 
+    def load_articles(self, updated_until):
+        #Dates are stored as datetimes (see nyt_common/migrate_dates.py): no parsing needed here.
+        store = ArticleStore.from_documents(
+            newswire.find({"uri":{"$ne":''}}, ArticleStore.projection()).sort("updated_date",-1))
+        store.build_search_index()
+        self.article_log, self.article_log_until = store, updated_until
+        self.article_count = len(store)
+
+    def reload_articles(self, updated_until):
+        '''Rebuilds the article log in a background thread, which releases article_lock (see get_articles).'''
+        try:
+            self.load_articles(updated_until)
+        except Exception as error:
+            print(f'Could not rebuild the article log: {error}')
+        finally:
+            self.article_lock.release()
+
+    def read_rollup(self, collection_name:str, fields:list, days:list = None):
+        '''Reads one of the daily rollups kept up to date by the Newswire ingestor (see nyt_common/rollups.py),
+        only the given days if provided (served by the rollups' day index).
+        If the rollups were never built, we build them once here.'''
+        if api_client.enabled():
+            return api_client.get_json(ROLLUP_ENDPOINTS[collection_name])
+
+        rollup = profile_collection(db[collection_name])
+        if rollup.estimated_document_count() == 0 and newswire.estimated_document_count() > 0:
+            refresh_newswire_rollups(db)
+
+        projection = {field:1 for field in fields}
+        projection.update({"year":1, "month":1, "day":1, "nb_articles":1, "_id":0})
+        query = days_filter(days) if days else {}
+        return list(rollup.find(query, projection).sort([("nb_articles",-1), ("year",-1), ("month",-1), ("day",-1)]))
+
+    @timed_dataset('search')
+    def search(self, search_term:str, handle:str = None):
+        '''Searches titles and abstracts, reusing the results held under handle if they are still there
+        (see search_handles.py). Returns (handle, result): result holds the ids of the results, in display order.
+        With the default 'mongo' backend, the search goes through the text index of the collection (see
+        nyt_common/indexes.py): words are matched, title matches weigh more than abstract matches, and the most
+        relevant (then most recent) articles come first.
+        With the 'memory' backend (NEWSWIRE_SEARCH_BACKEND=memory), every term of the query is matched as a
+        substring of the in-memory article log (see article_store.py), most recent articles first.
+        When the dashboard reads its data from the API (see api_client.py), the API's text search is used.'''
+        result = search_handles.get(handle) if handle else None
+        if result is not None and result.query == search_term and self.is_current(result):
+            return handle, result
+
+        if api_client.enabled():
+            #The API pages through results itself: no ids to hold here
+            total = api_client.get_json('/newswire/search', {'q':search_term, 'limit':1})['total']
+            return search_handles.create(search_term, None, total)
+
+        if SEARCH_BACKEND == 'memory':
+            store = self.get_articles()
+            rows, total = store.search(search_term, search_handles.max_ids)
+            return search_handles.create(search_term, rows, total, weakref.ref(store))
+
+        query = {"$text":{"$search":search_term}}
+        total = newswire.count_documents(query)
+        ids = [doc['_id'] for doc in newswire.find(query, {"_id":1, "score":{"$meta":"textScore"}})
+                                             .sort([("score",{"$meta":"textScore"}), ("updated_date",-1)])
+                                             .limit(search_handles.max_ids)]
+        return search_handles.create(search_term, ids, total)
+
+    def is_current(self, result) -> bool:
+        '''Row indices of the memory backend refer to one ArticleStore: they are stale once it is replaced.'''
+        return result.source is None or result.source() is self.article_log
+
+    @timed_dataset('search_page')
+    def search_page(self, result, skip:int = 0, limit:int = 10) -> list:
+        '''The articles of one page of search results: only their displayed fields are fetched.'''
+        fields = ['title','url','abstract','updated_date']
+        if result.ids is None:
+            page = api_client.get_json('/newswire/search', {'q':result.query, 'skip':skip, 'limit':limit})
+            for article in page['results']:
+                article['updated_date'] = pd.to_datetime(article.get('updated_date'))
+            return page['results']
+
+        page_ids = result.ids[skip:skip + limit]
+        if result.source is not None:
+            return result.source().rows(page_ids, fields)
+
+        projection = {field:1 for field in fields}
+        articles = {doc['_id']:doc for doc in newswire.find({"_id":{"$in":list(page_ids)}}, projection)}
+        return [articles[article_id] for article_id in page_ids if article_id in articles]
+
+    @timed_dataset('section_labels')
+    def get_section_labels(self) -> list:
+        '''Values of the section dropdown of the Topic tab, shared by every worker through the data cache.'''
+        return data_cache.get('newswire_section_labels', self.load_section_labels)
+
+    def load_section_labels(self) -> list:
+        if api_client.enabled():
+            return ['All'] + api_client.get_json('/newswire/sections')
+        #Served by the (section, subsection, created_date) index. '' is a glitchy entry: left out.
+        return ['All'] + [section for section in newswire.distinct('section') if section != '']
+
+    @timed_dataset('authors')
     def get_authors(self):
-        '''Initialise the authors DataFrame on first call, use it on subsequent calls.'''
-        if self.authors_df is None:
-            #Load the dataframe's feeder data by
-            nb_articles_by_author = list(newswire.aggregate([
-                {"$match":
-                    {"byline":{"$ne":''}}
-                },
-                {"$project":
-                    {
-                        "byline":1,
-                        "section":1,
-                        "subsection":1,
-                        "item_type":1,
-
-                        "aYear": {"$year":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        },
-                        "aMonth": {"$month":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        },
-                        "aDay": {"$dayOfMonth":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        }
-                    }
-                },
-                {"$group":
-                    {"_id":
-                        {
-                            "byline":"$byline",
-                            "section":"$section",
-                            "subsection":"$subsection",
-                            "aYear":"$aYear",
-                            "aMonth":"$aMonth",
-                            "aDay":"$aDay"},
-                            "nb_articles":{"$sum":1}
-                    }
-                },
-                {
-                    "$sort":{"nb_articles": -1, "aYear":-1, "aMonth":-1, "aDay":-1}
-                },
-                {"$project":
-                {
-                    "byline":"$_id.byline",
-                    "section":"$_id.section",
-                    "subsection":"$_id.subsection",
-                    "year":"$_id.aYear",
-                    "month":"$_id.aMonth",
-                    "day":"$_id.aDay",
-                    "nb_articles":1,
-                    "_id":0
-                }
-                }
-            ]))
-            self.authors_df = pd.DataFrame(nb_articles_by_author)
+        '''Authors DataFrame, shared by every worker through the data cache (see data_cache.py).'''
+        return data_cache.get('newswire_authors', self.load_authors, incremental=True)['frame']
 
-        return self.authors_df
+    def load_authors(self, previous=None):
+        #Load the dataframe's feeder data from the pre-aggregated daily counts
+        return self.load_daily_frame(previous,
+            lambda days: self.read_rollup('newswire_daily_by_author', ['byline','section','subsection'], days),
+            columns=rollup_columns(['byline','section','subsection']))
 
+    @timed_dataset('sections')
     def get_section_data(self):
-        '''Initialise the section DataFrame (without subsections) on first call, use it on subsequent calls.'''
-        if self.section_df is None:
-            nb_articles_per_section = list(newswire.aggregate([
-                {"$match":
-                    {"uri":{"$ne":''}}
-                },
-                {"$project":
-                    {"section":1,
-                    "aYear": {"$year":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        },
-                    "aMonth": {"$month":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        },
-                    "aDay": {"$dayOfMonth":
-                            {"$dateFromString":{'dateString':'$created_date'}
-                        }
-                }}},
-                {"$group":
-                    {"_id":
-                        {"section":"$section",
-                        "aYear":"$aYear",
-                        "aMonth":"$aMonth",
-                        "aDay":"$aDay"},
-                    "nb_articles":{"$sum":1}}
-                },
-                {
-                    "$sort":{"nb_articles": -1, "aYear":-1, "aMonth":-1, "aDay":-1}
-                },
-                {"$project":
-                {
-                    "section":"$_id.section",
-                    "year":"$_id.aYear",
-                    "month":"$_id.aMonth",
-                    "day":"$_id.aDay",
-                    "nb_articles":1,
-                    "_id":0
-                }
-                }
-            ]))
-            self.section_df = pd.DataFrame(nb_articles_per_section)
+        '''Section DataFrame (without subsections), shared by every worker through the data cache.'''
+        return data_cache.get('newswire_sections', self.load_section_data, incremental=True)['frame']
 
-        return self.section_df
+    def load_section_data(self, previous=None):
+        return self.load_daily_frame(previous,
+            lambda days: self.read_rollup('newswire_daily_by_section', ['section'], days),
+            columns=rollup_columns(['section']))
 
+    @timed_dataset('subsections')
     def get_subsection_data(self):
-        '''Initialise the section DataFrame (with subsections) on first call, use it on subsequent calls.'''
-        if self.subsection_df is None:
-            nb_articles_per_subsection = list(newswire.aggregate([
-                {"$match":
-                    {"uri":{"$ne":''}}
-                },
-                {"$project":
-                    {
-                        "section":1,
-                        "subsection":1,
-                        "aYear": {"$year":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        },
-                        "aMonth": {"$month":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        },
-                        "aDay": {"$dayOfMonth":
-                            {"$dateFromString":{'dateString':'$created_date'}}
-                        }
-                    }
-                },
-                {"$group":
-                    {"_id":
-                        {
-                            "section":"$section",
-                            "subsection":"$subsection",
-                            "aYear":"$aYear",
-                            "aMonth":"$aMonth",
-                            "aDay":"$aDay"},
-                            "nb_articles":{"$sum":1}
-                    }
-                },
-                {
-                    "$sort":{"nb_articles": -1, "aYear":-1, "aMonth":-1, "aDay":-1}
-                },
-                {"$project":
-                {
-                    "section":"$_id.section",
-                    "subsection":"$_id.subsection",
-                    "year":"$_id.aYear",
-                    "month":"$_id.aMonth",
-                    "day":"$_id.aDay",
-                    "nb_articles":1,
-                    "_id":0
-                }
-                }
-            ]))
-            self.subsection_df = pd.DataFrame(nb_articles_per_subsection)
-            self.subsection_df = self.subsection_df.sort_values(by=['year','month','day'], ascending=False)
-            self.subsection_df['Date'] = pd.to_datetime(self.subsection_df[['year','month','day']])
+        '''Section DataFrame (with subsections), shared by every worker through the data cache.'''
+        return data_cache.get('newswire_subsections', self.load_subsection_data, incremental=True)['frame']
 
-        return self.subsection_df
+    def load_subsection_data(self, previous=None):
+        return self.load_daily_frame(previous,
+            lambda days: self.read_rollup('newswire_daily_by_subsection', ['section','subsection'], days),
+            columns=rollup_columns(['section','subsection']), dated=True)
 
+    @timed_dataset('geo')
     def get_geo_data(self, type:int):
-        '''Initialise the Geographical DataFrame on first call, use it on subsequent calls.'''
-        if (type==0):
-            if self.geo_title_df is None:
-                #Credits to umpirsky for the country lists - see:
-                #github.com/umpirsky/country-list/blob/master/data/en_us/country.json
-                country_list = {"AF":"Afghanistan","AX":"\u00c5land Islands","AL":"Albania","DZ":"Algeria","AS":"American Samoa","AD":"Andorra","AO":"Angola","AI":"Anguilla","AQ":"Antarctica","AG":"Antigua & Barbuda","AR":"Argentina","AM":"Armenia","AW":"Aruba","AU":"Australia","AT":"Austria","AZ":"Azerbaijan","BS":"Bahamas","BH":"Bahrain","BD":"Bangladesh","BB":"Barbados","BY":"Belarus","BE":"Belgium","BZ":"Belize","BJ":"Benin","BM":"Bermuda","BT":"Bhutan","BO":"Bolivia","BA":"Bosnia & Herzegovina","BW":"Botswana","BV":"Bouvet Island","BR":"Brazil","IO":"British Indian Ocean Territory","VG":"British Virgin Islands","BN":"Brunei","BG":"Bulgaria","BF":"Burkina Faso","BI":"Burundi","KH":"Cambodia","CM":"Cameroon","CA":"Canada","CV":"Cape Verde","BQ":"Caribbean Netherlands","KY":"Cayman Islands","CF":"Central African Republic","TD":"Chad","CL":"Chile","CN":"China","CX":"Christmas Island","CC":"Cocos (Keeling) Islands","CO":"Colombia","KM":"Comoros","CG":"Congo - Brazzaville","CD":"Congo - Kinshasa","CK":"Cook Islands","CR":"Costa Rica","CI":"C\u00f4te d\u2019Ivoire","HR":"Croatia","CU":"Cuba","CW":"Cura\u00e7ao","CY":"Cyprus","CZ":"Czechia","DK":"Denmark","DJ":"Djibouti","DM":"Dominica","DO":"Dominican Republic","EC":"Ecuador","EG":"Egypt","SV":"El Salvador","GQ":"Equatorial Guinea","ER":"Eritrea","EE":"Estonia","SZ":"Eswatini","ET":"Ethiopia","FK":"Falkland Islands","FO":"Faroe Islands","FJ":"Fiji","FI":"Finland","FR":"France","GF":"French Guiana","PF":"French Polynesia","TF":"French Southern Territories","GA":"Gabon","GM":"Gambia","GE":"Georgia","DE":"Germany","GH":"Ghana","GI":"Gibraltar","GR":"Greece","GL":"Greenland","GD":"Grenada","GP":"Guadeloupe","GU":"Guam","GT":"Guatemala","GG":"Guernsey","GN":"Guinea","GW":"Guinea-Bissau","GY":"Guyana","HT":"Haiti","HM":"Heard & McDonald Islands","HN":"Honduras","HK":"Hong Kong SAR China","HU":"Hungary","IS":"Iceland","IN":"India","ID":"Indonesia","IR":"Iran","IQ":"Iraq","IE":"Ireland","IM":"Isle of Man","IL":"Israel","IT":"Italy","JM":"Jamaica","JP":"Japan","JE":"Jersey","JO":"Jordan","KZ":"Kazakhstan","KE":"Kenya","KI":"Kiribati","KW":"Kuwait","KG":"Kyrgyzstan","LA":"Laos","LV":"Latvia","LB":"Lebanon","LS":"Lesotho","LR":"Liberia","LY":"Libya","LI":"Liechtenstein","LT":"Lithuania","LU":"Luxembourg","MO":"Macao SAR China","MG":"Madagascar","MW":"Malawi","MY":"Malaysia","MV":"Maldives","ML":"Mali","MT":"Malta","MH":"Marshall Islands","MQ":"Martinique","MR":"Mauritania","MU":"Mauritius","YT":"Mayotte","MX":"Mexico","FM":"Micronesia","MD":"Moldova","MC":"Monaco","MN":"Mongolia","ME":"Montenegro","MS":"Montserrat","MA":"Morocco","MZ":"Mozambique","MM":"Myanmar (Burma)","NA":"Namibia","NR":"Nauru","NP":"Nepal","NL":"Netherlands","NC":"New Caledonia","NZ":"New Zealand","NI":"Nicaragua","NE":"Niger","NG":"Nigeria","NU":"Niue","NF":"Norfolk Island","KP":"North Korea","MK":"North Macedonia","MP":"Northern Mariana Islands","NO":"Norway","OM":"Oman","PK":"Pakistan","PW":"Palau","PS":"Palestinian Territories","PA":"Panama","PG":"Papua New Guinea","PY":"Paraguay","PE":"Peru","PH":"Philippines","PN":"Pitcairn Islands","PL":"Poland","PT":"Portugal","PR":"Puerto Rico","QA":"Qatar","RE":"R\u00e9union","RO":"Romania","RU":"Russia","RW":"Rwanda","WS":"Samoa","SM":"San Marino","ST":"S\u00e3o Tom\u00e9 & Pr\u00edncipe","SA":"Saudi Arabia","SN":"Senegal","RS":"Serbia","SC":"Seychelles","SL":"Sierra Leone","SG":"Singapore","SX":"Sint Maarten","SK":"Slovakia","SI":"Slovenia","SB":"Solomon Islands","SO":"Somalia","ZA":"South Africa","GS":"South Georgia & South Sandwich Islands","KR":"South Korea","SS":"South Sudan","ES":"Spain","LK":"Sri Lanka","BL":"St. Barth\u00e9lemy","SH":"St. Helena","KN":"St. Kitts & Nevis","LC":"St. Lucia","MF":"St. Martin","PM":"St. Pierre & Miquelon","VC":"St. Vincent & Grenadines","SD":"Sudan","SR":"Suriname","SJ":"Svalbard & Jan Mayen","SE":"Sweden","CH":"Switzerland","SY":"Syria","TW":"Taiwan","TJ":"Tajikistan","TZ":"Tanzania","TH":"Thailand","TL":"Timor-Leste","TG":"Togo","TK":"Tokelau","TO":"Tonga","TT":"Trinidad & Tobago","TN":"Tunisia","TR":"Turkey","TM":"Turkmenistan","TC":"Turks & Caicos Islands","TV":"Tuvalu","UM":"U.S. Outlying Islands","VI":"U.S. Virgin Islands","UG":"Uganda","UA":"Ukraine","AE":"United Arab Emirates","GB":"United Kingdom","US":"United States","UY":"Uruguay","UZ":"Uzbekistan","VU":"Vanuatu","VA":"Vatican City","VE":"Venezuela","VN":"Vietnam","WF":"Wallis & Futuna","EH":"Western Sahara","YE":"Yemen","ZM":"Zambia","ZW":"Zimbabwe"}
-                country_list = [i for i in country_list.values()]
-                country_validator = '|'.join(country_list) #Regex mask incoming!
-
-                nb_articles_by_country_in_title = list(newswire.aggregate([
-                    {"$match":
-                        {"$and":
-                            [{"uri":{"$ne":''}},
-                            {"title":{"$regex":country_validator}}
-                            ]
-                        }
-                    },
-                    {"$project":
-                        {
-                            "title":{"$regexFind":
-                                    {"input":"$title",
-                                    "regex":country_validator}}
-                            ,
-                            "section":1,
-                            "subsection":1,
-                            "item_type":1,
-
-                            "aYear": {"$year":
-                                {"$dateFromString":{'dateString':'$created_date'}}
-                            },
-                            "aMonth": {"$month":
-                                {"$dateFromString":{'dateString':'$created_date'}}
-                            },
-                            "aDay": {"$dayOfMonth":
-                                {"$dateFromString":{'dateString':'$created_date'}}
-                            }
-                        }
-                    },
-                    {"$unwind":"$title"},
-                    {"$group":
-                        {"_id":
-                            {
-                                "country":"$title.match",
-                                "section":"$section",
-                                "aYear":"$aYear",
-                                "aMonth":"$aMonth",
-                                "aDay":"$aDay"},
-                                "nb_articles":{"$sum":1}
-                        }
-                    },
-                    {
-                        "$sort":{"nb_articles": -1, "aYear":-1, "aMonth":-1, "aDay":-1}
-                    },
-                    {"$project":
-                    {
-                        "country":"$_id.country",
-                        "section":"$_id.section",
-                        "year":"$_id.aYear",
-                        "month":"$_id.aMonth",
-                        "day":"$_id.aDay",
-                        "nb_articles":1,
-                        "_id":0
-                    }
-                    }
-                ]))
-                self.geo_title_df = pd.DataFrame(nb_articles_by_country_in_title)
-                self.geo_title_df = self.geo_title_df.sort_values(by=['year','month','day'], ascending=False)
-                self.geo_title_df['Date'] = pd.to_datetime(self.geo_title_df[['year','month','day']])
-            return self.geo_title_df
+        '''Geographical DataFrame, shared by every worker through the data cache.
+        type 0: countries mentioned in the title, type 1: countries mentioned in the abstract.'''
+        field = 'title' if type == 0 else 'abstract'
+        return data_cache.get(f'newswire_geo_{field}', lambda previous: self.load_geo_data(field, previous),
+                              incremental=True)['frame']
+
+    def load_geo_data(self, field:str, previous=None):
+        '''Countries are tagged at ingest time (see nyt_common/countries.py), so this is a plain $unwind/$group.'''
+        def read_days(days):
+            if api_client.enabled():
+                return api_client.get_json(f'/newswire/geo/{field}')
+            return self.aggregate_geo_data(field, days)
+        return self.load_daily_frame(previous, read_days,
+                                     columns=rollup_columns(['country','section']), dated=True)
+
+    def load_daily_frame(self, previous, read_days, columns:list, dated:bool = False) -> dict:
+        '''Loads a DataFrame of daily counts, as {'frame': DataFrame, 'updated_until': newest updated_date loaded}.
+        read_days(days) returns the rows of the given days, or every row if days is None.
+        Given the previous copy, only the days of the articles updated since (see changed_days) are read again,
+        and their rows replace the previous ones: the cost follows the amount of new data.
+        The frame always has the given columns, even when there is no data yet (empty or new collection).'''
+        if not isinstance(previous, dict) or api_client.enabled(): #Cold start, or a copy from an earlier version
+            updated_until = self.newest_update() #Read first: articles written meanwhile are picked up next time
+            frame = pd.DataFrame(read_days(None), columns=columns)
         else:
-            if self.geo_abstract_df is None:
-                country_list = {"AF":"Afghanistan","AX":"\u00c5land Islands","AL":"Albania","DZ":"Algeria","AS":"American Samoa","AD":"Andorra","AO":"Angola","AI":"Anguilla","AQ":"Antarctica","AG":"Antigua & Barbuda","AR":"Argentina","AM":"Armenia","AW":"Aruba","AU":"Australia","AT":"Austria","AZ":"Azerbaijan","BS":"Bahamas","BH":"Bahrain","BD":"Bangladesh","BB":"Barbados","BY":"Belarus","BE":"Belgium","BZ":"Belize","BJ":"Benin","BM":"Bermuda","BT":"Bhutan","BO":"Bolivia","BA":"Bosnia & Herzegovina","BW":"Botswana","BV":"Bouvet Island","BR":"Brazil","IO":"British Indian Ocean Territory","VG":"British Virgin Islands","BN":"Brunei","BG":"Bulgaria","BF":"Burkina Faso","BI":"Burundi","KH":"Cambodia","CM":"Cameroon","CA":"Canada","CV":"Cape Verde","BQ":"Caribbean Netherlands","KY":"Cayman Islands","CF":"Central African Republic","TD":"Chad","CL":"Chile","CN":"China","CX":"Christmas Island","CC":"Cocos (Keeling) Islands","CO":"Colombia","KM":"Comoros","CG":"Congo - Brazzaville","CD":"Congo - Kinshasa","CK":"Cook Islands","CR":"Costa Rica","CI":"C\u00f4te d\u2019Ivoire","HR":"Croatia","CU":"Cuba","CW":"Cura\u00e7ao","CY":"Cyprus","CZ":"Czechia","DK":"Denmark","DJ":"Djibouti","DM":"Dominica","DO":"Dominican Republic","EC":"Ecuador","EG":"Egypt","SV":"El Salvador","GQ":"Equatorial Guinea","ER":"Eritrea","EE":"Estonia","SZ":"Eswatini","ET":"Ethiopia","FK":"Falkland Islands","FO":"Faroe Islands","FJ":"Fiji","FI":"Finland","FR":"France","GF":"French Guiana","PF":"French Polynesia","TF":"French Southern Territories","GA":"Gabon","GM":"Gambia","GE":"Georgia","DE":"Germany","GH":"Ghana","GI":"Gibraltar","GR":"Greece","GL":"Greenland","GD":"Grenada","GP":"Guadeloupe","GU":"Guam","GT":"Guatemala","GG":"Guernsey","GN":"Guinea","GW":"Guinea-Bissau","GY":"Guyana","HT":"Haiti","HM":"Heard & McDonald Islands","HN":"Honduras","HK":"Hong Kong SAR China","HU":"Hungary","IS":"Iceland","IN":"India","ID":"Indonesia","IR":"Iran","IQ":"Iraq","IE":"Ireland","IM":"Isle of Man","IL":"Israel","IT":"Italy","JM":"Jamaica","JP":"Japan","JE":"Jersey","JO":"Jordan","KZ":"Kazakhstan","KE":"Kenya","KI":"Kiribati","KW":"Kuwait","KG":"Kyrgyzstan","LA":"Laos","LV":"Latvia","LB":"Lebanon","LS":"Lesotho","LR":"Liberia","LY":"Libya","LI":"Liechtenstein","LT":"Lithuania","LU":"Luxembourg","MO":"Macao SAR China","MG":"Madagascar","MW":"Malawi","MY":"Malaysia","MV":"Maldives","ML":"Mali","MT":"Malta","MH":"Marshall Islands","MQ":"Martinique","MR":"Mauritania","MU":"Mauritius","YT":"Mayotte","MX":"Mexico","FM":"Micronesia","MD":"Moldova","MC":"Monaco","MN":"Mongolia","ME":"Montenegro","MS":"Montserrat","MA":"Morocco","MZ":"Mozambique","MM":"Myanmar (Burma)","NA":"Namibia","NR":"Nauru","NP":"Nepal","NL":"Netherlands","NC":"New Caledonia","NZ":"New Zealand","NI":"Nicaragua","NE":"Niger","NG":"Nigeria","NU":"Niue","NF":"Norfolk Island","KP":"North Korea","MK":"North Macedonia","MP":"Northern Mariana Islands","NO":"Norway","OM":"Oman","PK":"Pakistan","PW":"Palau","PS":"Palestinian Territories","PA":"Panama","PG":"Papua New Guinea","PY":"Paraguay","PE":"Peru","PH":"Philippines","PN":"Pitcairn Islands","PL":"Poland","PT":"Portugal","PR":"Puerto Rico","QA":"Qatar","RE":"R\u00e9union","RO":"Romania","RU":"Russia","RW":"Rwanda","WS":"Samoa","SM":"San Marino","ST":"S\u00e3o Tom\u00e9 & Pr\u00edncipe","SA":"Saudi Arabia","SN":"Senegal","RS":"Serbia","SC":"Seychelles","SL":"Sierra Leone","SG":"Singapore","SX":"Sint Maarten","SK":"Slovakia","SI":"Slovenia","SB":"Solomon Islands","SO":"Somalia","ZA":"South Africa","GS":"South Georgia & South Sandwich Islands","KR":"South Korea","SS":"South Sudan","ES":"Spain","LK":"Sri Lanka","BL":"St. Barth\u00e9lemy","SH":"St. Helena","KN":"St. Kitts & Nevis","LC":"St. Lucia","MF":"St. Martin","PM":"St. Pierre & Miquelon","VC":"St. Vincent & Grenadines","SD":"Sudan","SR":"Suriname","SJ":"Svalbard & Jan Mayen","SE":"Sweden","CH":"Switzerland","SY":"Syria","TW":"Taiwan","TJ":"Tajikistan","TZ":"Tanzania","TH":"Thailand","TL":"Timor-Leste","TG":"Togo","TK":"Tokelau","TO":"Tonga","TT":"Trinidad & Tobago","TN":"Tunisia","TR":"Turkey","TM":"Turkmenistan","TC":"Turks & Caicos Islands","TV":"Tuvalu","UM":"U.S. Outlying Islands","VI":"U.S. Virgin Islands","UG":"Uganda","UA":"Ukraine","AE":"United Arab Emirates","GB":"United Kingdom","US":"United States","UY":"Uruguay","UZ":"Uzbekistan","VU":"Vanuatu","VA":"Vatican City","VE":"Venezuela","VN":"Vietnam","WF":"Wallis & Futuna","EH":"Western Sahara","YE":"Yemen","ZM":"Zambia","ZW":"Zimbabwe"}
-                country_list = [i for i in country_list.values()]
-                country_validator = '|'.join(country_list) #Regex mask incoming!
-                nb_articles_by_country_in_abstract = list(newswire.aggregate([
-                    {"$match":
-                        {"$and":
-                            [{"uri":{"$ne":''}},
-                            {"abstract":{"$regex":country_validator}}
-                            ]
-                        }
-                    },
-                    {"$project":
-                        {
-                            "abstract":{"$regexFind":
-                                    {"input":"$abstract",
-                                    "regex":country_validator}}
-                            ,
-                            "section":1,
-                            "subsection":1,
-                            "item_type":1,
-
-                            "aYear": {"$year":
-                                {"$dateFromString":{'dateString':'$created_date'}}
-                            },
-                            "aMonth": {"$month":
-                                {"$dateFromString":{'dateString':'$created_date'}}
-                            },
-                            "aDay": {"$dayOfMonth":
-                                {"$dateFromString":{'dateString':'$created_date'}}
-                            }
-                        }
-                    },
-                    {"$unwind":"$abstract"},
-                    {"$group":
-                        {"_id":
-                            {
-                                "country":"$abstract.match",
-                                "section":"$section",
-                                "aYear":"$aYear",
-                                "aMonth":"$aMonth",
-                                "aDay":"$aDay"},
-                                "nb_articles":{"$sum":1}
-                        }
-                    },
-                    {
-                        "$sort":{"nb_articles": -1, "aYear":-1, "aMonth":-1, "aDay":-1}
-                    },
-                    {"$project":
+            days, updated_until = self.changed_days(previous['updated_until'])
+            if not days:
+                return previous
+            frame = previous['frame'].drop(columns=['Date'], errors='ignore')
+            day_keys = frame['year'] * 10000 + frame['month'] * 100 + frame['day']
+            stale = day_keys.isin([day.year * 10000 + day.month * 100 + day.day for day in days])
+            fresh = pd.DataFrame(read_days(sorted(days)), columns=columns)
+            frame = pd.concat([frame[~stale], fresh], ignore_index=True)
+
+        if frame.empty:
+            frame = pd.DataFrame(columns=columns + (['Date'] if dated else []))
+        elif dated:
+            frame = frame.sort_values(by=['year','month','day'], ascending=False, ignore_index=True)
+            frame['Date'] = pd.to_datetime(frame[['year','month','day']])
+        else:
+            frame = frame.sort_values(by=['nb_articles','year','month','day'], ascending=False, ignore_index=True)
+        return {'frame':frame, 'updated_until':updated_until}
+
+    def newest_update(self):
+        if api_client.enabled():
+            newest = api_client.get_json('/newswire/newest')['updated_date']
+            return None if newest is None else datetime.datetime.fromisoformat(newest)
+        latest = newswire.find_one({"uri":{"$ne":''}}, {"_id":0, "updated_date":1}, sort=[("updated_date",-1)])
+        return (latest or {}).get('updated_date')
+
+    def changed_days(self, since) -> tuple:
+        '''Days (of created_date, as grouped by the rollups) of the articles updated after since, minus
+        REFRESH_OVERLAP: articles ingested late, or whose rollups were refreshed late, are picked up as well.
+        Returns (set of days, newest updated_date seen).'''
+        query = {"uri":{"$ne":''}}
+        if since is not None:
+            query["updated_date"] = {"$gt":since - REFRESH_OVERLAP}
+        days, newest = set(), since
+        for doc in newswire.find(query, {"_id":0, "created_date":1, "updated_date":1}):
+            day = day_of(doc.get('created_date'))
+            if day is not None:
+                days.add(day)
+            updated = doc.get('updated_date')
+            if isinstance(updated, datetime.datetime) and (newest is None or updated > newest):
+                newest = updated
+        return days, newest
+
+    def start_background_refresh(self, interval:int):
+        '''Refreshes every DataFrame (incrementally) every interval seconds, in a daemon thread. Each worker runs
+        one, started by its first visit of the page (see layout), but the data cache's lock lets a single worker do
+        the refresh while the others load its result. Calling it again does nothing.'''
+        with self.refresh_lock:
+            if self.refresh_thread is not None:
+                return
+            self.refresh_thread = threading.Thread(target=self.refresh_loop, args=(interval,), name='newswire-refresh',
+                                                   daemon=True)
+            self.refresh_thread.start()
+
+    def refresh_loop(self, interval:int):
+        while True:
+            time.sleep(interval)
+            for name, loader in [('newswire_sections', self.load_section_data),
+                                 ('newswire_subsections', self.load_subsection_data),
+                                 ('newswire_authors', self.load_authors),
+                                 ('newswire_geo_title', lambda previous: self.load_geo_data('title', previous)),
+                                 ('newswire_geo_abstract', lambda previous: self.load_geo_data('abstract', previous))]:
+                try:
+                    data_cache.get(name, loader, ttl=interval, incremental=True)
+                except Exception as error:
+                    print(f'Could not refresh {name}: {error}')
+
+    def aggregate_geo_data(self, field:str, days:list = None) -> list:
+        match = {"uri":{"$ne":''},
+                 f"countries.{field}":{"$gt":''}} #At least one country (served by the countries index)
+        if days:
+            match['created_date'] = created_date_range(days)
+        pipeline = [
+            {"$match":match},
+            {"$project":
+                {
+                    "country":f"$countries.{field}",
+                    "section":1,
+                    "aYear": {"$year":'$created_date'},
+                    "aMonth": {"$month":'$created_date'},
+                    "aDay": {"$dayOfMonth":'$created_date'}
+                }
+            },
+            {"$unwind":"$country"},
+            {"$group":
+                {"_id":
                     {
-                        "country":"$_id.country",
-                        "section":"$_id.section",
-                        "year":"$_id.aYear",
-                        "month":"$_id.aMonth",
-                        "day":"$_id.aDay",
-                        "nb_articles":1,
-                        "_id":0
-                    }
-                    }
-                ]))
-                self.geo_abstract_df = pd.DataFrame(nb_articles_by_country_in_abstract)
-                self.geo_abstract_df['Date'] = pd.to_datetime(self.geo_abstract_df[['year','month','day']])
-
-            return self.geo_abstract_df
+                        "country":"$country",
+                        "section":"$section",
+                        "aYear":"$aYear",
+                        "aMonth":"$aMonth",
+                        "aDay":"$aDay"},
+                        "nb_articles":{"$sum":1}
+                }
+            },
+            {
+                "$sort":{"nb_articles": -1, "aYear":-1, "aMonth":-1, "aDay":-1}
+            },
+            {"$project":
+            {
+                "country":"$_id.country",
+                "section":"$_id.section",
+                "year":"$_id.aYear",
+                "month":"$_id.aMonth",
+                "day":"$_id.aDay",
+                "nb_articles":1,
+                "_id":0
+            }
+            }
+        ]
+        if days: #The created_date range may span days that were not asked for
+            pipeline.insert(4, {"$match":{"$or":[{"_id.aYear":day.year, "_id.aMonth":day.month, "_id.aDay":day.day}
+                                                 for day in days]}})
+        return list(newswire.aggregate(pipeline))
+
+def rollup_columns(fields:list) -> list:
+    '''Columns of a DataFrame of daily counts grouped by fields.'''
+    return fields + ['year','month','day','nb_articles']
+
+def days_filter(days:list) -> dict:
+    '''Filter on the year/month/day fields of the rollups, matching the given days.'''
+    return {"$or":[{"year":day.year, "month":day.month, "day":day.day} for day in days]}
 
 #Receiving our data from MongoDB
-MONGO_LABEL = os.environ.get('MONGODB_ADDRESS','localhost') #Unless you have your own address
-MONGO_PORT = int(os.environ.get('MONGODB_PORT',27017)) #Unless you have a specific port, default is 27017
-DB_CLIENT = pymongo.MongoClient(MONGO_LABEL, MONGO_PORT) # pymongo.MongoClient(host=MONGO_LABEL, port=MONGO_PORT)
-db = DB_CLIENT['NY_Project']
+#One client per worker process, connecting on first use (MONGODB_ADDRESS, MONGODB_PORT, pool size...: see nyt_common/db.py)
+db = database()
 
-newswire = db['times_newswire'] #I moved mine to Kenan's db, but the collections are distinct from one another
+newswire = profile_collection(db['times_newswire']) #I moved mine to Kenan's db, but the collections are distinct from one another
 
+#Importing the page does not query MongoDB: the indexes are created by the ingest scripts (or by hand, see
+#nyt_common/indexes.py), and the data is loaded on first use.
 nwdata = NewswireData()
 
-#Loading the values that go into the section dropdown on the Topic tab - Newswire API Data
-section_labels = ['All']
-section_labels.extend(newswire.distinct('section'))
-
-try:
-    section_labels.remove('')
-except:
-    pass #No glitchy entry to remove
-
-nw_search_res = []
 nw_search_size = 10
 
 load_figure_template('slate')
@@ -378,7 +371,8 @@ tab_nw_search = html.Div([
         html.Button('Search', id='searchButton'),
         dbc.Pagination(min_value = 1, max_value=1, first_last=True, previous_next=True,
                        fully_expanded=False,
-                       id='searchResPage')]),
+                       id='searchResPage'),
+        dcc.Store(id='searchQuery')]), #The last search term and its results' handle, used when changing pages
     html.Br(),
     html.Div([dcc.Markdown(
         #blank_df.to_dict('records'),
@@ -387,15 +381,6 @@ tab_nw_search = html.Div([
         id='mdSearchContent')
 ])
 
-tab_nw_topic = html.Div([
-    html.H2('NYT Stats by topic'),
-    html.Div([
-        dcc.Dropdown(section_labels,None,id='sectionDrop'),
-        dcc.Dropdown(['All'],'All',id='subsectionDrop')
-    ]),
-    html.Br(),
-    html.Div(id='graphArea')
-])
 
 tab_nw_geo = html.Div([
     html.H2('NYT Stats by countries mentioned'),
@@ -407,39 +392,59 @@ tab_nw_geo = html.Div([
                 ))
     ])),
     html.Br(),
-    dcc.Markdown('Once a choice is made between **title** and **article** content (right above), be prepared to wait a little as graphs take time to generate.'),
+    dcc.Markdown('Once a choice is made between **title** and **article** content (right above), the graphs will show up below.'),
     html.Br(),
     html.Div(id='graphAreaCountry')
 ])
 
-newswire_tabs = dbc.Tabs([
-    dbc.Tab(tab_nw_search, label='Search for articles'),
-    dbc.Tab(tab_nw_topic, label='NY Times stats: Sections'),
-    dbc.Tab(tab_nw_geo, label='NY Times stats: Geographical mentions')
-])
-
-#On loading:
-newswire_tabs.active_tab = 'tab-0'
-
-layout = html.Div([newswire_tabs])
+def layout():
+    '''The page is built when it is visited, not when the app starts: the section list goes through the shared
+    cache, and the worker starts its background refresh on its first visit.'''
+    if REFRESH_INTERVAL > 0:
+        nwdata.start_background_refresh(REFRESH_INTERVAL)
+
+    #Loading the values that go into the section dropdown on the Topic tab - Newswire API Data
+    tab_nw_topic = html.Div([
+        html.H2('NYT Stats by topic'),
+        html.Div([
+            dcc.Dropdown(nwdata.get_section_labels(),None,id='sectionDrop'),
+            dcc.Dropdown(['All'],'All',id='subsectionDrop')
+        ]),
+        html.Br(),
+        html.Div(id='graphArea')
+    ])
+
+    newswire_tabs = dbc.Tabs([
+        dbc.Tab(tab_nw_search, label='Search for articles'),
+        dbc.Tab(tab_nw_topic, label='NY Times stats: Sections'),
+        dbc.Tab(tab_nw_geo, label='NY Times stats: Geographical mentions')
+    ])
+
+    #On loading:
+    newswire_tabs.active_tab = 'tab-0'
+
+    return html.Div([newswire_tabs])
 
 #Search for entries and manage how results look (this was pure pain to implement)
 @callback(
         dash.dependencies.Output('searchResultsLog', "children"),
         dash.dependencies.Output('searchResPage','active_page'),
         dash.dependencies.Output('searchResPage','max_value'),
+        dash.dependencies.Output('searchQuery','data'),
         dash.dependencies.Input('searchButton','n_clicks'),
         dash.dependencies.Input('searchResPage','active_page'),
         dash.dependencies.Input('searchResPage','max_value'),
         dash.dependencies.State('searchText','value'),
+        dash.dependencies.State('searchQuery','data'),
         prevent_initial_call = True)
-def get_search_results_newswire(pressed, page_nr, max_nr, search_term):
+@timed_callback('get_search_results_newswire')
+def get_search_results_newswire(pressed, page_nr, max_nr, search_term, last_search):
         '''This callback manages search results via the Newswire API in two ways:
         - Users enter their search term then press 'Search'
         - After obtaining their search results, users want to see older results
-        Due to Dash's limitations, both have to be handled in the same callback.'''
-        global nw_search_res
-        global nw_search_size
+        Due to Dash's limitations, both have to be handled in the same callback.
+        Each session keeps its query and a handle on its results (see search_handles.py) in the searchQuery
+        store, so that a page flip only fetches the articles of that page.'''
 
         #What is initiating the callback? The button, or the search results' page bar?
         trigger = ctx.triggered_id
@@ -449,27 +454,16 @@ def get_search_results_newswire(pressed, page_nr, max_nr, search_term):
 
             #Did someone randomly click on the page bar when we didn't do a search at all?
             #That's fine and all, but we don't have anything to show or change.
-            if len(nw_search_res) == 0:
-                return '',page_nr,max_nr
+            if not last_search:
+                return '',page_nr,max_nr,last_search
 
-            #Setting the limits of our range:
-            entry_start = (page_nr-1) * nw_search_size
-            entry_end = (page_nr) * nw_search_size
-
-            #If the maximum for that page goes beyond the amount of articles for that page, we bring it back to the max.
-            entry_end = len(nw_search_res) if entry_end > len(nw_search_res) else entry_end
-
-            #Preparing our results (this is Markdown)
-            txt = f'#### Showing {entry_end-entry_start} articles out of {len(nw_search_res)}:\n\n'
-            for res in nw_search_res[entry_start:entry_end]:
-                txt = txt+f'''
-
-* **[{res.get("title")}]({res.get("url")})**
-*Latest update: {res.get("updated_date").strftime("%m/%d/%Y, %H:%M:%S")}*
-{res.get("abstract")}
-
-'''
-            return txt, page_nr, max_nr #the page number and max number of pages does not change.
+            page_nr = page_nr or 1
+            if isinstance(last_search, str): #Stored by an earlier version of the page: the term only
+                last_search = {'query':last_search}
+            handle, result = nwdata.search(last_search['query'], last_search.get('handle'))
+            results = nwdata.search_page(result, (page_nr-1) * nw_search_size, nw_search_size)
+            #the max number of pages does not change.
+            return format_search_results(results, result.total), page_nr, max_nr, {'query':result.query, 'handle':handle}
 
         #Case #2: We are performing a new search.
         else:
@@ -477,35 +471,29 @@ def get_search_results_newswire(pressed, page_nr, max_nr, search_term):
             if search_term in ['',None] or pressed in [0,None]:
                 raise PreventUpdate('Please insert data.')
             else:
-                txt = ''
-                results = nwdata.get_articles()
-                nw_search_res = [i for i in results if (i.get('title','').lower().find(search_term.lower()) != -1
-                                                or i.get('abstract','').lower().find(search_term.lower()) != -1)]
-                if len(nw_search_res) != 0:
-                    res_nr = len(nw_search_res)
-
-
-                    show_max = res_nr if res_nr <= nw_search_size else nw_search_size
-                    pg = res_nr // nw_search_size
-
-                    if len(nw_search_res) % nw_search_size > 0:
-                        pg = pg + 1
-                    txt = txt+f'#### Showing {show_max} articles out of {res_nr}:\n\n'
-                    for res in nw_search_res[0:show_max]:
-                        txt = txt+f'''
+                handle, result = nwdata.search(search_term)
+                if result.total == 0:
+                    return 'No results found.', 1, 1, {'query':search_term, 'handle':handle}
+
+                nb_results = result.total if result.ids is None else len(result.ids) #Only the ids we hold can be shown
+                nb_pages = -(-nb_results // nw_search_size) #Rounding up
+                results = nwdata.search_page(result, 0, nw_search_size)
+                return format_search_results(results, result.total), 1, nb_pages, {'query':search_term, 'handle':handle}
+
+def format_search_results(results:list, res_nr:int) -> str:
+    '''Preparing our results (this is Markdown)'''
+    entries = [f'#### Showing {len(results)} articles out of {res_nr}:\n\n']
+    for res in results:
+        updated = res.get("updated_date")
+        updated = updated.strftime("%m/%d/%Y, %H:%M:%S") if updated is not None and not pd.isna(updated) else 'unknown'
+        entries.append(f'''
 
 * **[{res.get("title")}]({res.get("url")})**
-*Latest update: {res.get("updated_date").strftime("%m/%d/%Y, %H:%M:%S")}*
+*Latest update: {updated}*
 {res.get("abstract")}
 
-    '''
-
-                else:
-                    txt = 'No results found.'
-                    pg = 1
-
-                nb_pages = pg
-                return txt, 1, nb_pages
+''')
+    return ''.join(entries)
 
 #Load the subsections
 @callback(
@@ -514,6 +502,7 @@ def get_search_results_newswire(pressed, page_nr, max_nr, search_term):
     dash.dependencies.Input('sectionDrop','value'),
     prevent_initial_call = True
 )
+@timed_callback('load_subsections')
 def load_subsections(section):
     if section == 'All' or section is None:
         return ['All'],'All'
@@ -522,7 +511,8 @@ def load_subsections(section):
         my_df = my_df[my_df.section==section]
         sub_options = ['All']
         sub_options.extend(sorted(my_df.subsection.unique()))
-        sub_options[sub_options.index('')] = 'N/A'
+        if '' in sub_options: #No subsection for this section yet (e.g. on a new collection)
+            sub_options[sub_options.index('')] = 'N/A'
         return sub_options,'All'
 
 #Organize data by topic
@@ -532,7 +522,27 @@ def load_subsections(section):
     dash.dependencies.Input('subsectionDrop','value')],
     prevent_initial_call = True
 )
+@timed_callback('filter_graph_subsections')
 def filter_graph_subsections(section,subsection):
+    return [dcc.Graph(id='topicGraph',figure=topic_figure(section,subsection))]
+
+#Zooming in (or out) re-buckets the visible range (see timelines.py)
+@callback(
+    dash.dependencies.Output('topicGraph', "figure"),
+    dash.dependencies.Input('topicGraph','relayoutData'),
+    dash.dependencies.State('sectionDrop','value'),
+    dash.dependencies.State('subsectionDrop','value'),
+    prevent_initial_call = True
+)
+@timed_callback('zoom_graph_subsections')
+def zoom_graph_subsections(relayout_data,section,subsection):
+    try:
+        date_range = visible_range(relayout_data)
+    except ValueError:
+        raise PreventUpdate('Not a zoom.')
+    return topic_figure(section,subsection,date_range)
+
+def topic_figure(section,subsection,date_range=None):
     my_df = nwdata.get_subsection_data()
     my_title = 'Timeline: Articles published across'
 
@@ -546,7 +556,7 @@ def filter_graph_subsections(section,subsection):
         if subsection != 'All':
             if subsection == 'N/A':
                 sbsval = ''
-                my_title = my_title+f', without a subcategory'
+                my_title = my_title+', without a subcategory'
             else:
                 sbsval = subsection
                 my_title = my_title+f', in the {sbsval} subcategory'
@@ -556,11 +566,12 @@ def filter_graph_subsections(section,subsection):
     else:
         my_title = my_title+' all sections'
 
-    my_df = my_df.groupby(by=['Date']).sum(numeric_only=True).reset_index(drop=False)
-    my_df['Date'] = my_df['Date'].dt.strftime('%Y-%m-%d')
+    my_df, bucket = bucket_timeline(my_df, date_range)
     fig = px.line(my_df,x='Date',y='nb_articles',title=my_title,template='plotly_dark')
-    fig.update_layout(xaxis_title='Date',yaxis_title='Number of published articles')
+    fig.update_layout(xaxis_title=f'Date (per {bucket.lower()})',yaxis_title='Number of published articles')
+    return style_timeline(fig, date_range)
 
+def style_timeline(fig, date_range=None):
     #Transparent background hooray!
     fig.update_layout(
         {
@@ -568,7 +579,10 @@ def filter_graph_subsections(section,subsection):
             "plot_bgcolor": "rgba(0, 0, 0, 0)",
         }
     )
-    return [dcc.Graph(id='topicGraph',figure=fig)]
+    #Keep the zoom of the user when the figure is re-bucketed
+    if date_range is not None:
+        fig.update_xaxes(range=[date_range[0], date_range[1]])
+    return fig
 
 #Change the section dropdown values in the country field depending on what we're choosing
 @callback(
@@ -577,6 +591,7 @@ def filter_graph_subsections(section,subsection):
     dash.dependencies.Input('countryMode','value'),
     prevent_initial_call = True
 )
+@timed_callback('section_update_by_mode')
 def section_update_by_mode(mode):
     my_df = None
     if mode == 'In the title':
@@ -597,10 +612,31 @@ def section_update_by_mode(mode):
      dash.dependencies.Input('sectionDropCountry','value')],
     prevent_initial_call = True
 )
+@timed_callback('filter_graph_countries')
 def filter_graph_countries(mode,section):
     if mode is None:
         return None
 
+    return [dcc.Graph(id='countryGraph',figure=country_figure(mode,section))]
+
+@callback(
+    dash.dependencies.Output('countryGraph', "figure"),
+    dash.dependencies.Input('countryGraph','relayoutData'),
+    dash.dependencies.State('countryMode','value'),
+    dash.dependencies.State('sectionDropCountry','value'),
+    prevent_initial_call = True
+)
+@timed_callback('zoom_graph_countries')
+def zoom_graph_countries(relayout_data,mode,section):
+    try:
+        date_range = visible_range(relayout_data)
+    except ValueError:
+        raise PreventUpdate('Not a zoom.')
+    if mode is None:
+        raise PreventUpdate('No mode chosen.')
+    return country_figure(mode,section,date_range)
+
+def country_figure(mode,section,date_range=None):
     my_title = ''
     if mode == 'In the title':
         my_df = nwdata.get_geo_data(0)
@@ -617,18 +653,9 @@ def filter_graph_countries(mode,section):
         my_title = my_title+f' from the {section} vertical'
         my_df = my_df[my_df.section == section]
 
-    my_df = my_df.groupby(by=['country','Date']).sum(numeric_only=True).reset_index(drop=False)
-    my_df['Date'] = my_df['Date'].dt.strftime('%Y-%m-%d')
-
+    #Only the most mentioned countries get their own line, the others are summed up as "Other"
+    my_df, bucket = bucket_timeline(my_df, date_range, series='country')
 
     fig = px.line(my_df,x='Date',y='nb_articles',color='country',title=my_title,template='plotly_dark')
-    fig.update_layout(xaxis_title='Date',yaxis_title='Number of published articles')
-    #Transparent background hooray! (again)
-    fig.update_layout(
-        {
-            "paper_bgcolor": "rgba(0, 0, 0, 0)",
-            "plot_bgcolor": "rgba(0, 0, 0, 0)",
-        }
-    )
-
-    return [dcc.Graph(id='topicGraph',figure=fig)]
+    fig.update_layout(xaxis_title=f'Date (per {bucket.lower()})',yaxis_title='Number of published articles')
+    return style_timeline(fig, date_range)
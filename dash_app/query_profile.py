@@ -0,0 +1,35 @@
+import dash
+from dash import dcc, html
+import pandas as pd
+import dash_bootstrap_components as dbc
+
+from query_profiler import PROFILE_QUERIES, SLOW_QUERY_MS, profile_report
+from nyt_common.db import database
+
+#Only served when the queries are profiled (see query_profiler.py)
+if PROFILE_QUERIES:
+    dash.register_page(__name__, path='/query-profile', name='Query profile')
+
+#Receiving our data from MongoDB
+db = database() #See nyt_common/db.py
+
+def layout():
+    '''Slow queries recorded by the profiler, grouped by the function that ran them, slowest first.'''
+    report = pd.DataFrame(profile_report(db))
+    if report.empty:
+        table = html.P('No slow query recorded yet.')
+    else:
+        report['indexes'] = report['indexes'].apply(lambda indexes: ', '.join(indexes or []))
+        report['last_seen'] = report['last_seen'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        report = report.round({'avg_ms':1, 'max_ms':1, 'avg_docs_examined':0, 'avg_keys_examined':0, 'avg_returned':0})
+        report = report[['caller', 'collection', 'operation', 'count', 'avg_ms', 'max_ms', 'avg_docs_examined',
+                         'avg_keys_examined', 'avg_returned', 'indexes', 'last_seen']]
+        table = dbc.Table.from_dataframe(report, striped=True, bordered=True, hover=True, size='sm')
+
+    return html.Div([
+        html.H2('Query profile'),
+        dcc.Markdown(f'''Queries that took over **{SLOW_QUERY_MS:g} ms**, with the indexes of their winning plan.
+Many documents examined for few returned, or a COLLSCAN, point to the next index or rollup to add.'''),
+        html.Br(),
+        table
+    ])
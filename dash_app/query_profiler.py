@@ -0,0 +1,161 @@
+'''Opt-in profiling of the dashboard's MongoDB queries (DASH_PROFILE_QUERIES=1).
+profile_collection() wraps a collection so that every find(), find_one(), count_documents(), distinct() and
+aggregate() is timed. Queries slower than DASH_PROFILE_SLOW_MS are explained (executionStats), and recorded in
+the query_profile collection with the documents and keys they examined, the documents they returned (the count,
+for count_documents), the indexes of their winning plan and the function that ran them. The Query profile page (/query-profile) sums them up.
+Without DASH_PROFILE_QUERIES, profile_collection() returns the collection itself: no overhead.
+'''
+
+import datetime
+import os
+import sys
+import threading
+import time
+import traceback
+
+from bson import json_util
+from pymongo.errors import PyMongoError
+
+#The shared helpers live at the root of the repository.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nyt_common.indexes import explain_section, plan_indexes
+
+PROFILE_QUERIES = os.environ.get('DASH_PROFILE_QUERIES', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('DASH_PROFILE_SLOW_MS', 100))
+PROFILE_COLLECTION = 'query_profile'
+
+def profile_collection(collection):
+    '''The collection, wrapped by a ProfiledCollection if profiling is enabled.'''
+    return ProfiledCollection(collection) if PROFILE_QUERIES else collection
+
+def caller_of_query() -> str:
+    '''The dashboard function that ran the query: the closest frame outside of this module and pymongo.'''
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        if frame.filename != __file__ and f'{os.sep}pymongo{os.sep}' not in frame.filename:
+            return f'{os.path.basename(frame.filename)}:{frame.name}'
+    return 'unknown'
+
+def record_query(collection, operation:str, query, duration:float, nb_returned:int, caller:str, explain):
+    '''Explains a slow query and saves its profile, in a background thread so that the user does not wait for it.'''
+    def record():
+        try:
+            explained = explain()
+            stats = explain_section(explained, 'executionStats')
+            winning_plan = explain_section(explained, 'queryPlanner').get('winningPlan', {})
+            collection.database[PROFILE_COLLECTION].insert_one({
+                'collection': collection.name,
+                'operation': operation,
+                'caller': caller,
+                'query': json_util.dumps(query), #As a string: pipeline stages are not valid field names
+                'duration_ms': duration * 1000,
+                'returned': nb_returned,
+                'docs_examined': stats.get('totalDocsExamined'),
+                'keys_examined': stats.get('totalKeysExamined'),
+                'indexes': plan_indexes(winning_plan) or [winning_plan.get('stage', 'unknown')],
+                'winning_plan': json_util.dumps(winning_plan),
+                'recorded_at': datetime.datetime.utcnow(),
+            })
+        except PyMongoError as error:
+            print(f'Could not profile a query on {collection.name}: {error}')
+
+    threading.Thread(target=record, name='query-profile', daemon=True).start()
+
+class ProfiledCursor:
+    '''Cursor returned by ProfiledCollection.find(): chained calls (sort, skip, limit...) return the wrapper,
+    and the query is timed while it is iterated.'''
+    def __init__(self, cursor, collection, query:dict, caller:str):
+        self.cursor = cursor
+        self.collection = collection
+        self.query = query
+        self.caller = caller
+
+    def __getattr__(self, name):
+        attribute = getattr(self.cursor, name)
+        if not callable(attribute):
+            return attribute
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self if result is self.cursor else result
+        return call
+
+    def __iter__(self):
+        nb_returned = 0
+        start = time.perf_counter()
+        for doc in self.cursor:
+            nb_returned += 1
+            yield doc
+        duration = time.perf_counter() - start
+        if duration * 1000 >= SLOW_QUERY_MS:
+            record_query(self.collection, 'find', self.query, duration, nb_returned, self.caller,
+                         self.cursor.clone().explain)
+
+class ProfiledCollection:
+    '''Collection whose find(), find_one(), count_documents(), distinct() and aggregate() calls are profiled.
+    Everything else goes to the collection.'''
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def __getitem__(self, name):
+        return self.collection[name]
+
+    def find(self, *args, **kwargs):
+        query = args[0] if args else kwargs.get('filter', {})
+        return ProfiledCursor(self.collection.find(*args, **kwargs), self.collection, query, caller_of_query())
+
+    def timed(self, operation:str, query, run, nb_returned, explain):
+        '''Returns run(), recorded (see record_query) if it was slow: nb_returned(result) is the number of
+        documents it returned, and explain() explains it.'''
+        caller = caller_of_query()
+        start = time.perf_counter()
+        result = run()
+        duration = time.perf_counter() - start
+        if duration * 1000 >= SLOW_QUERY_MS:
+            record_query(self.collection, operation, query, duration, nb_returned(result), caller, explain)
+        return result
+
+    def explain_command(self, command:dict, verbosity:str = 'executionStats'):
+        return lambda: self.collection.database.command('explain', command, verbosity=verbosity)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        return self.timed('find_one', filter or {}, lambda: self.collection.find_one(filter, *args, **kwargs),
+                          lambda doc: int(doc is not None),
+                          lambda: self.collection.find(filter, *args, **kwargs).limit(1).explain())
+
+    def count_documents(self, filter:dict, **kwargs):
+        return self.timed('count_documents', filter, lambda: self.collection.count_documents(filter, **kwargs),
+                          lambda count: count, self.explain_command({'count':self.collection.name, 'query':filter}))
+
+    def distinct(self, key:str, filter:dict = None, **kwargs):
+        return self.timed('distinct', filter or {}, lambda: self.collection.distinct(key, filter, **kwargs), len,
+                          self.explain_command({'distinct':self.collection.name, 'key':key, 'query':filter or {}}))
+
+    def aggregate(self, pipeline:list, **kwargs):
+        '''Runs the aggregation and returns its results as a list (callers only iterate over them).'''
+        #$out and $merge stages cannot be explained with executionStats
+        writes = any('$out' in stage or '$merge' in stage for stage in pipeline)
+        explain = self.explain_command({'aggregate':self.collection.name, 'pipeline':pipeline, 'cursor':{}},
+                                       'queryPlanner' if writes else 'executionStats')
+        return self.timed('aggregate', pipeline, lambda: list(self.collection.aggregate(pipeline, **kwargs)), len,
+                          explain)
+
+def profile_report(db, limit:int = 50) -> list:
+    '''The profiled queries, grouped by caller and operation, slowest (on average) first.'''
+    return list(db[PROFILE_COLLECTION].aggregate([
+        {"$group":{"_id":{"collection":"$collection", "operation":"$operation", "caller":"$caller"},
+                   "count":{"$sum":1},
+                   "avg_ms":{"$avg":"$duration_ms"},
+                   "max_ms":{"$max":"$duration_ms"},
+                   "avg_docs_examined":{"$avg":"$docs_examined"},
+                   "avg_keys_examined":{"$avg":"$keys_examined"},
+                   "avg_returned":{"$avg":"$returned"},
+                   "indexes":{"$last":"$indexes"},
+                   "last_seen":{"$max":"$recorded_at"}}},
+        {"$sort":{"avg_ms":-1}},
+        {"$limit":limit},
+        {"$project":{"_id":0, "collection":"$_id.collection", "operation":"$_id.operation", "caller":"$_id.caller",
+                     "count":1, "avg_ms":1, "max_ms":1, "avg_docs_examined":1, "avg_keys_examined":1,
+                     "avg_returned":1, "indexes":1, "last_seen":1}},
+    ]))
@@ -0,0 +1,48 @@
+'''Per-session handles on search results.
+A search stores the ids of its results (at most SEARCH_MAX_IDS of them) under a random handle, which the
+browser keeps in a dcc.Store. Paging through the results then only fetches the articles of the requested page.
+Each worker process keeps its SEARCH_MAX_HANDLES most recently used handles: a session whose handle was evicted
+(or that lands on another worker) simply runs its search again.
+
+Settings: SEARCH_MAX_HANDLES, SEARCH_MAX_IDS.
+'''
+
+import os
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+
+SEARCH_MAX_HANDLES = int(os.environ.get('SEARCH_MAX_HANDLES', 1000))
+SEARCH_MAX_IDS = int(os.environ.get('SEARCH_MAX_IDS', 1000))
+
+#ids: ids (or row indices) of the results, in display order. total: number of results, ids beyond the cap included.
+#source: what the ids refer to, for backends whose ids can go stale (e.g. a weak reference to an ArticleStore).
+SearchResult = namedtuple('SearchResult', ['query', 'ids', 'total', 'source'])
+
+class SearchHandles:
+    '''Thread-safe LRU cache of search results, by handle.'''
+    def __init__(self, max_handles:int = SEARCH_MAX_HANDLES, max_ids:int = SEARCH_MAX_IDS):
+        self.max_handles = max_handles
+        self.max_ids = max_ids
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, query:str, ids, total:int, source=None):
+        '''Stores a search's results (capped to max_ids) and returns (handle, result).'''
+        handle = uuid.uuid4().hex
+        result = SearchResult(query, ids[:self.max_ids] if ids is not None else None, total, source)
+        with self.lock:
+            self.results[handle] = result
+            while len(self.results) > self.max_handles:
+                self.results.popitem(last=False)
+        return handle, result
+
+    def get(self, handle:str):
+        '''The results stored under a handle, or None if it was evicted or is unknown.'''
+        with self.lock:
+            result = self.results.get(handle)
+            if result is not None:
+                self.results.move_to_end(handle)
+            return result
+
+search_handles = SearchHandles()
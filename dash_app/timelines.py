@@ -0,0 +1,62 @@
+'''Time bucketing of the dashboard timelines.
+Plotting one point per day and per series gets heavy over long ranges (a few years, ~200 countries). Instead,
+the granularity is picked from the visible range (days, weeks or months), only the top series are plotted
+(the others are summed up as "Other"), and zooming in re-fetches the visible range at a finer granularity.
+Figures thus hold a roughly constant number of points, whatever the range.
+
+Settings: TIMELINE_MAX_POINTS (points per series), TIMELINE_TOP_N (series per figure).
+'''
+
+import os
+
+import pandas as pd
+
+TIMELINE_MAX_POINTS = int(os.environ.get('TIMELINE_MAX_POINTS', 180))
+TIMELINE_TOP_N = int(os.environ.get('TIMELINE_TOP_N', 10))
+
+#From finest to coarsest: (pandas frequency, length of one bucket in days, axis label)
+FREQUENCIES = [('D', 1, 'Day'), ('W-MON', 7, 'Week'), ('MS', 30, 'Month')]
+
+def pick_frequency(start, end) -> tuple:
+    '''The finest (frequency, label) that keeps [start, end] under TIMELINE_MAX_POINTS buckets.'''
+    days = max((pd.Timestamp(end) - pd.Timestamp(start)).days, 1)
+    for frequency, bucket_days, label in FREQUENCIES:
+        if days / bucket_days <= TIMELINE_MAX_POINTS:
+            return frequency, label
+    return FREQUENCIES[-1][0], FREQUENCIES[-1][2]
+
+def visible_range(relayout_data:dict):
+    '''The (start, end) of the x axis after a zoom or pan, or None if the full range is shown again.
+    Raises ValueError if the relayout event does not concern the x axis (e.g. autosize).'''
+    relayout_data = relayout_data or {}
+    if relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return pd.Timestamp(relayout_data['xaxis.range[0]']), pd.Timestamp(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        start, end = relayout_data['xaxis.range']
+        return pd.Timestamp(start), pd.Timestamp(end)
+    raise ValueError('No change of the x axis')
+
+def bucket_timeline(df:pd.DataFrame, date_range=None, series:str = None, top_n:int = TIMELINE_TOP_N):
+    '''Sums nb_articles per time bucket (and per series, e.g. country), over date_range (the whole data if None).
+    Only the top_n series with the most articles are kept, the others being summed up as "Other".
+    Returns (bucketed DataFrame with a Date column, axis label of the buckets).'''
+    if date_range is not None:
+        df = df[(df['Date'] >= date_range[0].normalize()) & (df['Date'] <= date_range[1])]
+    if df.empty:
+        return pd.DataFrame(columns=(['Date', 'nb_articles'] if series is None else [series, 'Date', 'nb_articles'])), 'Day'
+
+    start, end = date_range if date_range is not None else (df['Date'].min(), df['Date'].max())
+    frequency, label = pick_frequency(start, end)
+
+    keys = [pd.Grouper(key='Date', freq=frequency, closed='left', label='left')] #Buckets labelled by their first day
+    if series is not None:
+        totals = df.groupby(series, observed=True)['nb_articles'].sum()
+        if len(totals) > top_n:
+            top = totals.nlargest(top_n).index
+            df = df.assign(**{series:df[series].where(df[series].isin(top), 'Other')})
+        keys.insert(0, series)
+
+    bucketed = df.groupby(keys, observed=True)['nb_articles'].sum().reset_index()
+    return bucketed, label
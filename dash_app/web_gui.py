@@ -1,12 +1,25 @@
+import os
+import sys
 import dash
 from dash import dcc, html
 import dash_bootstrap_components as dbc
 from dash_bootstrap_templates import load_figure_template
+from flask import Response
+
+#The shared helpers live at the root of the repository.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nyt_common.metrics import metrics_response
 
 #Theme loaded: SLATE. Can change.
 app = dash.Dash(__name__, use_pages=True, pages_folder="./", external_stylesheets=[dbc.themes.SLATE], suppress_callback_exceptions=True)
 load_figure_template('slate')
 
+#Prometheus metrics of the dashboard (see nyt_common/metrics.py)
+@app.server.route('/metrics')
+def metrics():
+    body, content_type = metrics_response()
+    return Response(body, content_type=content_type)
+
 #Sidebar and main page implementations taken from DBC's documentation
 sidebar_style = {
     "position": "fixed",
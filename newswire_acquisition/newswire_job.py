@@ -0,0 +1,202 @@
+'''Newswire ingestion job: one rate-limited producer, a pool of worker processes writing to MongoDB.
+The producer fetches the pages of every selected section through a single NYTClient, so that all sections queue
+on the same token bucket and requests go out as fast as the quota allows. As soon as a section is fetched, its
+items are handed to a worker process, which cleans them, diffs them against MongoDB and bulk-writes them
+(write_section_summary in nyt_newswire.py) while the producer keeps fetching: the wall time is set by the API quota.
+A section's high-water mark only moves once its items are written and their days saved as pending rollups: the
+dashboard rollups are refreshed once, at the end, for every pending day. From the root of the repository:
+
+    python3 newswire_acquisition/newswire_job.py
+    python3 newswire_acquisition/newswire_job.py --sections world,u.s. --workers 2
+    python3 newswire_acquisition/newswire_job.py --exclude sports,arts --edition inyt --full
+    python3 newswire_acquisition/newswire_job.py --replay-history   #No network, see below
+
+With --replay-history, nothing is requested: every Newswire page kept by the response cache
+(NYT_RESPONSE_CACHE_DIR, see nyt_common/response_cache.py) is written again, keeping the newest version of each
+article. It is meant to rebuild an emptied times_newswire collection, e.g. after a schema change.
+The workers report their MongoDB metrics to the job's only if PROMETHEUS_MULTIPROC_DIR is set
+(see nyt_common/metrics.py).
+'''
+
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import sys
+
+from tqdm import tqdm
+
+#The shared helpers live at the root of the repository, the Newswire functions next to this file.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from nyt_common.nyt_http import NYTClient, run_in_thread
+from nyt_common.rollups import refresh_newswire_rollups
+from nyt_common.indexes import ensure_indexes
+from nyt_common.metrics import dump_metrics
+from nyt_common.dates import parse_nyt_datetime
+from nyt_common.response_cache import open_response_cache
+from nyt_newswire import (API_KEY, add_pending_rollup_days, db, fetch_section_items, fetch_section_names,
+                          normalize_batch_size, refresh_pending_rollups, set_newer_high_water_mark,
+                          write_section_summary)
+
+NB_WORKERS = int(os.environ.get('NEWSWIRE_JOB_WORKERS', min(4, os.cpu_count() or 1)))
+
+def select_sections(sec_names_list:list, sections:list = None, exclude:list = None) -> list:
+    '''The sections to ingest: the requested ones (all of them by default), minus the excluded ones.'''
+    if sections:
+        unknown = [sec for sec in sections if sec not in sec_names_list]
+        if unknown:
+            print(f'Unknown sections, ignored: {", ".join(unknown)}')
+        sec_names_list = [sec for sec in sec_names_list if sec in sections]
+    return [sec for sec in sec_names_list if sec not in (exclude or [])]
+
+async def run_job(sections:list = None, exclude:list = None, edition:str = 'nyt', full_sync:bool = False,
+                  batch_size:int = 500, nb_workers:int = NB_WORKERS):
+    '''Fetches the selected sections and writes them with a pool of nb_workers processes.
+    Returns the counts of each section (None for the sections that failed).'''
+
+    batch_size = normalize_batch_size(batch_size)
+    loop = asyncio.get_running_loop()
+    touched_days = set()
+
+    #Spawned workers import nyt_newswire afresh, and create their own MongoClient on first use (see nyt_common/db.py).
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nb_workers,
+                                                mp_context=multiprocessing.get_context('spawn')) as pool:
+
+        async with NYTClient('newswire') as client:
+            sec_names_list = await fetch_section_names(client)
+            if sec_names_list is None:
+                return None
+            sec_names_list = select_sections(sec_names_list, sections, exclude)
+
+            full_pbar = tqdm(range(len(sec_names_list)), desc='Overall progress')
+
+            async def process_section(sec):
+                try:
+                    sec_output, high_water_mark = await fetch_section_items(client, sec, batch_size, edition,
+                                                                            full_sync)
+                    if sec_output is None:
+                        return None
+
+                    #The worker converts the items (dates...): it sends back what we need from them, as datetimes
+                    counts, newest_date, days = await loop.run_in_executor(pool, write_section_summary, sec,
+                                                                           sec_output, batch_size)
+                    del sec_output
+
+                    touched_days.update(days)
+                    #Saved before the mark moves: if the final refresh never happens, the next one catches up.
+                    await run_in_thread(add_pending_rollup_days, days)
+                    await run_in_thread(set_newer_high_water_mark, edition, sec, newest_date, high_water_mark)
+                    return counts
+                except Exception as error:
+                    #One failing section must not stop the others: its mark did not move, the next run retries it.
+                    print(f'Section "{sec}" failed: {type(error).__name__}: {error}')
+                    return None
+                finally:
+                    full_pbar.update()
+
+            print(f'\n\nProcessing {len(sec_names_list)} sections from the NYT Newswire API with {nb_workers} workers')
+            results = await asyncio.gather(*[process_section(sec) for sec in sec_names_list])
+            full_pbar.close()
+
+    #Refresh the dashboard rollups once, for every day that received articles (and any day left pending).
+    await run_in_thread(refresh_pending_rollups, touched_days)
+
+    return dict(zip(sec_names_list, results))
+
+def newest_versions(pages:list) -> list:
+    '''The items of Newswire pages (oldest page first), keeping the newest version of each article, newest first.'''
+    items = {}
+    for page in pages:
+        for item in page:
+            known = items.get(item['uri'])
+            if known is None or (parse_nyt_datetime(item.get('updated_date')) or datetime.datetime.min) >= \
+                                (parse_nyt_datetime(known.get('updated_date')) or datetime.datetime.min):
+                items[item['uri']] = item
+    return sorted(items.values(), key=lambda item: parse_nyt_datetime(item.get('updated_date')) or datetime.datetime.min,
+                  reverse=True)
+
+async def replay_history(sections:list = None, exclude:list = None, edition:str = 'nyt', batch_size:int = 500,
+                         nb_workers:int = NB_WORKERS):
+    '''Writes every Newswire page of the response cache again, without any request.
+    Returns the counts of each section, like run_job.'''
+
+    cache = open_response_cache()
+    if cache is None:
+        sys.exit('--replay-history reads the response cache: please set NYT_RESPONSE_CACHE_DIR.')
+
+    batch_size = normalize_batch_size(batch_size)
+    loop = asyncio.get_running_loop()
+    touched_days = set()
+
+    #Pages are listed oldest first: /svc/news/v3/content/<edition>/<section>.json
+    prefix = f'https://api.nytimes.com/svc/news/v3/content/{edition}/'
+    pages_by_section = {}
+    for entry in await run_in_thread(cache.history, 'newswire', prefix):
+        pages_by_section.setdefault(entry['url'][len(prefix):-len('.json')], []).append(entry)
+    sec_names_list = select_sections(list(pages_by_section), sections, exclude)
+
+    def read_pages(entries):
+        return [json.loads(cache.read(entry)).get('results') or [] for entry in entries]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nb_workers,
+                                                mp_context=multiprocessing.get_context('spawn')) as pool:
+
+        async def replay_section(sec):
+            try:
+                sec_output = newest_versions(await run_in_thread(read_pages, pages_by_section[sec]))
+                counts, _, days = await loop.run_in_executor(pool, write_section_summary, sec, sec_output, batch_size)
+                touched_days.update(days)
+                return counts
+            except Exception as error:
+                print(f'Section "{sec}" failed: {type(error).__name__}: {error}')
+                return None
+
+        print(f'Replaying {len(sec_names_list)} sections from the response cache with {nb_workers} workers')
+        results = await asyncio.gather(*[replay_section(sec) for sec in sec_names_list])
+
+    await run_in_thread(refresh_newswire_rollups, db, touched_days)
+
+    return dict(zip(sec_names_list, results))
+
+def section_list(value:str) -> list:
+    return [sec.strip().lower() for sec in value.split(',') if sec.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingests the NY Times Newswire sections with a pool of workers.')
+    parser.add_argument('--sections', type=section_list, default=None,
+                        help='Comma-separated sections to ingest (default: every section)')
+    parser.add_argument('--exclude', type=section_list, default=None, help='Comma-separated sections to skip')
+    parser.add_argument('--edition', choices=['nyt', 'inyt', 'all'], default='nyt')
+    parser.add_argument('--workers', type=int, default=NB_WORKERS, help='Worker processes writing to MongoDB')
+    parser.add_argument('--batch-size', type=int, default=500, help='Items per API page and MongoDB batch')
+    parser.add_argument('--full', action='store_true', help='Ignore the high-water marks')
+    parser.add_argument('--replay-history', action='store_true',
+                        help='Write every page of the response cache again, without any request')
+    args = parser.parse_args()
+
+    if API_KEY is None and not args.replay_history:
+        sys.exit('Please generate an API key at https://developer.nytimes.com/ and export it as NYTIMES_API_KEY.')
+
+    ensure_indexes(db) #uri lookups and upserts rely on them
+    if args.replay_history:
+        results = asyncio.run(replay_history(args.sections, args.exclude, args.edition, args.batch_size,
+                                             max(1, args.workers)))
+    else:
+        results = asyncio.run(run_job(args.sections, args.exclude, args.edition, args.full, args.batch_size,
+                                      max(1, args.workers)))
+
+    if results is not None:
+        failed = [sec for sec, counts in results.items() if counts is None]
+        totals = {key: sum(counts[key] for counts in results.values() if counts) for key in
+                  ['inserted', 'modified', 'skipped']}
+        print(f'{len(results)} sections: {totals["inserted"]} inserted, {totals["modified"]} modified, '
+              f'{totals["skipped"]} skipped.' + (f' Failed: {", ".join(failed)}' if failed else ''))
+
+    dump_metrics('newswire_job') #For the textfile collector and/or the Pushgateway (see nyt_common/metrics.py)
+
+if __name__ == '__main__':
+    main()
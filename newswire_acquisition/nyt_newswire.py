@@ -2,54 +2,83 @@
 When used as a cron job, please set
 0 */4 * * * <full filename>
 to avoid Error 429: Too Many Requests
+Each section only pages back to the newest update seen on the previous run (stored in the sync_state
+collection). Add --full to the command to ignore it.
 '''
 
-import requests
-import pymongo
+import asyncio
+from pymongo import UpdateOne
 import datetime
-import time
 from tqdm import tqdm
 import os
 import sys
 
+#The shared helpers (HTTP client, rate limiter) live at the root of the repository.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nyt_common.nyt_http import NYTClient, run_in_thread
+from nyt_common.dates import DATE_FIELDS, convert_date_fields, parse_nyt_datetime
+from nyt_common.rollups import day_of, refresh_newswire_rollups
+from nyt_common.indexes import ensure_indexes
+from nyt_common.countries import tag_countries
+from nyt_common.metrics import dump_metrics, mongo_batch
+from nyt_common.db import database
+
 API_KEY = os.getenv('NYTIMES_API_KEY') #If None, will prompt the user to get a key.
 
-MONGO_LABEL = os.environ.get('MONGODB_ADDRESS','localhost') #Unless you have your own address
-MONGO_PORT = int(os.environ.get('MONGODB_PORT',27017)) #Unless you have a specific port, default is 27017
+#MongoDB settings (MONGODB_ADDRESS, MONGODB_PORT, pool size...) are read by nyt_common/db.py
+db = database()
 
-DB_CLIENT = pymongo.MongoClient(host=MONGO_LABEL, port=MONGO_PORT)
-WAIT_TIME = 12 #Waiting time for our requests set at 12 seconds. We want to avoid Error 429: Too many requests and Error 429: Rate Limit Exceeded
+#The time limitations of the API (avoiding Error 429: Too many requests and Error 429: Rate Limit Exceeded)
+#are handled by the token bucket of NYTClient, see nyt_common/nyt_http.py.
 
-#I'm aware that we have a bunch of API keys and DB addresses laying around, and we'll probably pass it as an environment
-#variable instead (os.getenv() hello)
-#import os
+def add_section_output(section:str, batch_size:int = 500, source:str = 'nyt', full_sync:bool = False):
+    '''We provide a section name, and we receive the output for that specific section here.
+    We can also provide the edition (by default the NY Times).
+    Items are written to MongoDB in batches of batch_size (see write_section_batch), and we return
+    the number of inserted, modified and skipped items.
+    Unless full_sync is set, we only page through the section until we pass its high-water mark
+    (the newest updated_date seen on the previous run, see get_high_water_mark).'''
+
+    async def single_section():
+        async with NYTClient('newswire') as client:
+            return await add_section_output_async(client, section, batch_size, source, full_sync)
+
+    return asyncio.run(single_section())
+
+async def add_section_output_async(client:NYTClient, section:str, batch_size:int = 500, source:str = 'nyt',
+                                   full_sync:bool = False, touched_days:set = None):
+    '''Asynchronous version of add_section_output, sharing the client (and its rate limiter) of the caller.
+    The pages are fetched in the event loop, the MongoDB writes happen in a worker thread.
+    The days of the items we received are added to touched_days if provided (the caller then refreshes
+    the dashboard rollups), otherwise the rollups of those days are refreshed here.
+    Either way, the days are saved as pending in sync_state before the mark moves (see add_pending_rollup_days):
+    if the refresh never happens, the next one still picks them up.'''
+
+    batch_size = normalize_batch_size(batch_size)
+    sec_output, high_water_mark = await fetch_section_items(client, section, batch_size, source, full_sync)
+    if sec_output is None:
+        return None
 
-#For the sake of cleanliness, I'll hard-implement the time limitations of the API in my requests.
-def nyt_requests_get(url, endpoint, payload=None):
-    '''All requests will have a 12-second wait timer attached to them.
-    I could use requests.get(...) then a time.sleep() everywhere, but it's better to simplify readability.'''
-    global WAIT_TIME
-    re = requests.get(f'{url}{endpoint}',params=payload)
-    time.sleep(WAIT_TIME)
-    return re
+    #To do if needed: filter the data before shipping it to MongoDB.
+    #<Insert code here>
 
-def add_section_output(section:str, batch_size:int = 500, source:str = 'nyt'):
-    '''We provide a section name, and we receive the output for that specific section here.
-    We can also provide the edition (by default the NY Times).'''
+    counts = await run_in_thread(write_section_output, section, sec_output, batch_size)
 
-    global API_KEY
-    global DB_CLIENT
-    global WAIT_TIME
+    #Recount the days of the articles we received in the dashboard rollups (see nyt_common/rollups.py)
+    days = {day_of(item.get('created_date')) for item in sec_output}
+    await run_in_thread(add_pending_rollup_days, days)
+    if touched_days is not None:
+        touched_days.update(days)
+    else:
+        await run_in_thread(refresh_pending_rollups, days)
 
-    db = DB_CLIENT['NY_Project']
-    nw_collection = db['times_newswire']
+    #Only move the mark once the items are safely in MongoDB.
+    await run_in_thread(move_high_water_mark, source, section, sec_output, high_water_mark)
 
-    endp_section = f'/{source}/{section}.json'
-    url = 'https://api.nytimes.com/svc/news/v3/content'
+    return counts
 
-    #We will receive 500 outputs from the API (potentially).
-    #That said, we could be wiser adjusting the limit and offset accordingly if we need to.
-    #Rule of thumb: resp_size must be a multiple of 20, and must be 20 at least.
+def normalize_batch_size(batch_size:int) -> int:
+    '''Rule of thumb: the response size must be a multiple of 20, between 20 and 500.'''
     if batch_size % 20 != 0:
         batch_size = batch_size - (batch_size % 20)
 
@@ -57,6 +86,20 @@ def add_section_output(section:str, batch_size:int = 500, source:str = 'nyt'):
         batch_size = 500
     elif batch_size < 20:
         batch_size = 20
+    return batch_size
+
+async def fetch_section_items(client:NYTClient, section:str, batch_size:int = 500, source:str = 'nyt',
+                              full_sync:bool = False):
+    '''Pages through a section of the Newswire API, newest items first.
+    Unless full_sync is set, we stop once we pass the section's high-water mark.
+    Returns (items, high-water mark we started from), or (None, mark) if the first page failed.'''
+
+    endp_section = f'/{source}/{section}.json'
+    url = 'https://api.nytimes.com/svc/news/v3/content'
+
+    #We will receive 500 outputs from the API (potentially).
+    #That said, we could be wiser adjusting the limit and offset accordingly if we need to.
+    batch_size = normalize_batch_size(batch_size)
 
     #Autocalculating the offsets after making sure that our response size was compliant with the Times API:
     offset_steps = range(0,1000,batch_size)
@@ -66,122 +109,260 @@ def add_section_output(section:str, batch_size:int = 500, source:str = 'nyt'):
         'limit':batch_size
     }
 
+    #Newest updated_date we saw for this section on a previous run: anything older than that is already in MongoDB.
+    high_water_mark = None if full_sync else await run_in_thread(get_high_water_mark, source, section)
+
     sec_output = []
 
     for offset in offset_steps:
         payload.update({'offset':offset})
-        re_sec = nyt_requests_get(url,endp_section,payload)
+        #Quota and connection errors (once the retries are spent) are raised to the caller, which skips the
+        #section without moving its mark: keeping the first pages only would skip the items of the next ones.
+        re_sec = await client.get(url,endp_section,payload)
 
         try:
-            sec_output.extend(re_sec.json()['results'])
+            page_output = (await run_in_thread(re_sec.json))['results']
         except:
             print(f'There was an error while acquiring data for the section {section}:\n{re_sec.status_code} - {re_sec.content} on loop {1 + (offset % 500)}')
             if offset == 0:
-                return None #We did not get any data, or there was a brutal error in there.
+                return None, high_water_mark #We did not get any data, or there was a brutal error in there.
             else:
                 break #If we did get at least the first wave, we will consider that we have data to process.
 
-    #To do if needed: filter the data before shipping it to MongoDB.
-    #<Insert code here>
+        if high_water_mark is None:
+            sec_output.extend(page_output)
+            continue
+
+        #The API returns the newest items first: once a page reaches the mark, the next pages hold nothing new.
+        new_items = [item for item in page_output if is_newer(item.get('updated_date'), high_water_mark)]
+        sec_output.extend(new_items)
+        if len(new_items) < len(page_output):
+            break
+
+    return sec_output, high_water_mark
+
+def move_high_water_mark(source:str, section:str, sec_output:list, high_water_mark):
+    '''Moves the mark of a section to the newest updated_date of the items we wrote.'''
+    set_newer_high_water_mark(source, section, newest_updated_date(sec_output), high_water_mark)
+
+def newest_updated_date(sec_output:list):
+    return max(sec_output, key=lambda item: parse_nyt_datetime(item.get('updated_date')) or datetime.datetime.min,
+               default={}).get('updated_date')
+
+def set_newer_high_water_mark(source:str, section:str, newest_date, high_water_mark):
+    if newest_date is not None and is_newer(newest_date, high_water_mark):
+        set_high_water_mark(source, section, newest_date)
+
+def is_newer(updated_date, high_water_mark) -> bool:
+    '''Whether an updated_date is more recent than the high-water mark (no mark: everything is new).'''
+    if high_water_mark is None:
+        return True
+    parsed_date = parse_nyt_datetime(updated_date)
+    parsed_mark = parse_nyt_datetime(high_water_mark)
+    if parsed_date is None or parsed_mark is None:
+        return True #When in doubt, let write_section_batch compare the dates
+    return parsed_date > parsed_mark
+
+def get_high_water_mark(source:str, section:str):
+    '''Returns the newest updated_date recorded for a (source, section) pair, or None on the first run.'''
+    sync_state = db['sync_state']
+    state = sync_state.find_one({"source":source, "section":section})
+    return None if state is None else state.get('high_water_mark')
+
+def set_high_water_mark(source:str, section:str, high_water_mark):
+    '''Records the newest updated_date seen for a (source, section) pair.'''
+    sync_state = db['sync_state']
+    sync_state.update_one({"source":source, "section":section},
+                          {"$set":{"high_water_mark":high_water_mark,
+                                   "synced_at":datetime.datetime.utcnow()}},
+                          upsert=True)
+
+#Days whose rollups still have to be refreshed, saved before the high-water marks move past their articles.
+PENDING_ROLLUPS_ID = 'newswire_rollups'
+
+def add_pending_rollup_days(days):
+    '''Saves days (datetime.date objects) whose rollups must be refreshed.'''
+    days = [datetime.datetime.combine(day, datetime.time.min) for day in days if day is not None]
+    if days:
+        db['sync_state'].update_one({"_id":PENDING_ROLLUPS_ID}, {"$addToSet":{"pending_days":{"$each":days}}},
+                                    upsert=True)
+
+def refresh_pending_rollups(days=()):
+    '''Refreshes the rollups of the given days, plus the days left pending by earlier runs,
+    and only then removes them from the pending days.'''
+    state = db['sync_state'].find_one({"_id":PENDING_ROLLUPS_ID}) or {}
+    pending = state.get('pending_days', [])
+    days = {day for day in days if day is not None} | {day.date() for day in pending}
+    if not days:
+        return
+    refresh_newswire_rollups(db, days)
+    #Days added by another run in the meantime stay pending
+    db['sync_state'].update_one({"_id":PENDING_ROLLUPS_ID}, {"$pullAll":{"pending_days":
+                                [datetime.datetime.combine(day, datetime.time.min) for day in days]}})
+
+def write_section_summary(section:str, sec_output:list, batch_size:int = 500) -> tuple:
+    '''write_section_output for a worker process (see newswire_job.py): the items are converted in the worker,
+    so it returns what the caller needs from them along with the counts:
+    (counts, newest updated_date as a datetime, days of the items for the rollups).'''
+    counts = write_section_output(section, sec_output, batch_size)
+    return counts, newest_updated_date(sec_output), {day_of(item.get('created_date')) for item in sec_output}
+
+def write_section_output(section:str, sec_output:list, batch_size:int = 500):
+    '''Cleans the items received for a section and sends them to MongoDB, batch by batch.'''
 
+    nw_collection = db['times_newswire']
 
     #Progress bar says hello for CLI clarity
     pbar = tqdm(range(len(sec_output)), total=len(sec_output), desc=section)
 
-    #Convert the datetime fields? Yay or nay.
-    convert_dts = False #Change to True if we want to convert, left at dev discretion.
-
     #In case we want to check for updated articles.
     unupdated_streak = 0
 
-    #If we have data, let's send it to MongoDB.
-    for item in sec_output:
-
-        #We will switch the ISO-formatted datetime strings to datetime types if we chose that option previously.
-        if convert_dts:
-            for field in ['updated_date', 'created_date', 'published_date', 'first_published_date']:
-                try:
-                    item[field] = datetime.datetime.fromisoformat(item[field])
-                except:
-                    continue #skip to the next if there is nothing in that field
-
-        for excess_key in ['multimedia','slug_name']:
-                try:
-                    del item[excess_key]
-                except:
-                    continue
-
-        #Query MongoDB to check if the item already exists + get the update date if it does:
-        mongo_check = nw_collection.find_one({"uri":item['uri']},{"uri":1,"updated_date":1})
-        pbar.update()
-
-        #If the item does not exist: add it
-        if mongo_check is None:
-            nw_collection.insert_one(item)
+    #Running tally of what happened to the items, shown at the end of the section.
+    counts = {'inserted':0, 'modified':0, 'skipped':0}
+
+    #If we have data, let's send it to MongoDB, one batch at a time.
+    for batch_start in range(0, len(sec_output), batch_size):
+        batch = sec_output[batch_start:batch_start+batch_size]
+
+        for item in batch:
+
+            #We switch the ISO-formatted datetime strings to (UTC) datetime types: MongoDB can then group and sort them natively.
+            convert_date_fields(item, DATE_FIELDS['times_newswire'])
+
+            for excess_key in ['multimedia','slug_name']:
+                    try:
+                        del item[excess_key]
+                    except:
+                        continue
+
+            #Countries mentioned in the title and the abstract, for the dashboard's geo tab
+            tag_countries(item, 'times_newswire')
+
+        batch_counts, unupdated_streak, streak_reached = write_section_batch(nw_collection, batch, unupdated_streak)
+        for key in counts:
+            counts[key] += batch_counts[key]
+        pbar.update(batch_counts['inserted'] + batch_counts['modified'] + batch_counts['skipped'])
+
+        if streak_reached:
+            break
+
+    pbar.close()
+    print(f'Section "{section}": {counts["inserted"]} inserted, {counts["modified"]} modified, {counts["skipped"]} skipped.')
+    return counts
+
+def write_section_batch(nw_collection, batch:list, unupdated_streak:int = 0, streak_limit:int = 50):
+    '''Sends one batch of cleaned Newswire items to MongoDB in two round trips:
+    one $in query to get the stored updated_date of every item in the batch, then one bulk_write
+    with an upsert for each new or changed item.
+    Returns the counts for the batch, the updated streak of unchanged items, and whether the streak
+    went past the limit (in which case, we stop reading the section).'''
+
+    #Query MongoDB once to check which items already exist + get their update date if they do:
+    batch_uris = [item['uri'] for item in batch]
+    with mongo_batch('times_newswire', 'find', len(batch_uris)):
+        stored_dates = {doc['uri']:doc.get('updated_date')
+                        for doc in nw_collection.find({"uri":{"$in":batch_uris}},{"_id":0,"uri":1,"updated_date":1})}
+
+    operations = []
+    skipped = 0
+    streak_reached = False
+
+    for item in batch:
+        #Domain-specific knowledge: an item is new if we do not have its uri, and changed if its 'updated_date' moved.
+        if item['uri'] not in stored_dates or stored_dates[item['uri']] != item['updated_date']:
+            operations.append(UpdateOne({"uri":item['uri']}, {"$set":item}, upsert=True))
+            stored_dates[item['uri']] = item['updated_date'] #Duplicates later in the batch count as unchanged
             unupdated_streak = 0
-
-        elif mongo_check['updated_date'] != item['updated_date']:
-            #Do we already have the item? Check if there was a change.
-            #Domain-specific knowledge: check if the 'updated_date' field has changed to determine that.
-                nw_collection.update_one({"uri":item['uri']}, {"$set":item}, upsert=True)
-                unupdated_streak = 0
-
-            #No else needed here if there was no update, it's like else: skip
-            #Eventualy, one thing we can do is "return None" on the ELSE section if there's a streak of unupdated articles.
-            #We could set a threshold of "if we get 5 un-updated articles in a row, we call it a wrap."
-            #I will pre-emptively include this.
         else:
+            skipped += 1
             unupdated_streak += 1
 
-            if unupdated_streak > 50:
-                    pbar.close()
-                    return None
+            #If we get a long streak of un-updated articles in a row, we call it a wrap.
+            if unupdated_streak > streak_limit:
+                streak_reached = True
+                break
 
+    inserted = 0
+    modified = 0
+    if operations:
+        with mongo_batch('times_newswire', 'bulk_write', len(operations)):
+            result = nw_collection.bulk_write(operations, ordered=False)
+        inserted = result.upserted_count
+        modified = result.modified_count
 
-def get_full_newswire_output(edition:str = 'nyt'):
+    return {'inserted':inserted, 'modified':modified, 'skipped':skipped}, unupdated_streak, streak_reached
+
+def get_full_newswire_output(edition:str = 'nyt', full_sync:bool = False):
     '''This function allows us to send a request and get the latest news articles
     via the News Wire API.'''
-    global DB_CLIENT
-    db = DB_CLIENT['NYT_project']
+    return asyncio.run(get_full_newswire_output_async(edition, full_sync))
+
+async def get_full_newswire_output_async(edition:str = 'nyt', full_sync:bool = False):
+    '''Asynchronous sweep of every section. All sections share one client, so they queue on the same
+    rate limiter: requests go out as fast as the quota allows, and each section is written to MongoDB
+    while the next requests are waiting for their slot.'''
 
     #This will tick on the first runtime: did we create the collection yet? If not, create it.
     #if 'times_newswire' not in db.list_collection_names():
     #    db.createCollection('times_newswire')
 
-    #Call the global variable: API_KEY (TO DO: choose one key in our code)
-    global API_KEY
+    async with NYTClient('newswire') as client:
+
+        #Step 1: Get our list of sections
+        sec_names_list = await fetch_section_names(client)
+        if sec_names_list is None:
+            return None
+
+        full_pbar = tqdm(range(len(sec_names_list)),desc="Overall progress")
+
+        #Step 2: Get an output for each section and send it to MongoDB.
+        touched_days = set()
+
+        async def process_section(sec):
+            try:
+                return await add_section_output_async(client, section=sec, source=edition, full_sync=full_sync,
+                                                      touched_days=touched_days)
+            except Exception as error:
+                #One failing section (quota reached, connection lost...) must not stop the others:
+                #its mark did not move, the next run retries it.
+                print(f'Section "{sec}" failed: {type(error).__name__}: {error}')
+                return None
+            finally:
+                full_pbar.update()
+
+        print(f'\n\nProcessing {len(sec_names_list)} sections from the NYT Newswire API')
+        try:
+            results = await asyncio.gather(*[process_section(sec) for sec in sec_names_list])
+        finally:
+            full_pbar.close()
+
+            #Step 3: Refresh the dashboard rollups once, for every day that received articles (and any day
+            #left pending by an earlier run that did not get that far), even if the sweep was interrupted.
+            await run_in_thread(refresh_pending_rollups, touched_days)
+
+    return dict(zip(sec_names_list, results))
+
+async def fetch_section_names(client:NYTClient):
+    '''The sections listed by the Newswire API, minus the ones we do not document. None if the API failed.'''
 
-    #Step 1: Get our list of sections
     url = 'https://api.nytimes.com/svc/news/v3/content'
     endpoint_section_list = '/section-list.json'
-    res = nyt_requests_get(url,endpoint_section_list,{'api-key':API_KEY})
-    sec_names_json = res.json().get('results')
-
-    sec_names_list = []
+    res = await client.get(url,endpoint_section_list,{'api-key':API_KEY})
 
     #Checking if the API returned the expected output (this code will break if it doesn't)
     try:
+        sec_names_json = res.json().get('results')
         sec_names_list = [sec['section'] for sec in sec_names_json]
-        #Removing sections that we may not want to document (see: 'admin')
-        sec_names_list.remove('admin')
-        sec_names_list.remove('multimedia/photos') #Seems like an error 400 hitting this.
-        #These values seem to return valid null results, and their removal is purely cosmetic.
-        sec_names_list.remove('universal')
-        sec_names_list.remove("today’s paper")
-        sec_names_list.remove("the weekly")
-        full_pbar = tqdm(range(len(sec_names_list)),desc="Overall progress")
     except:
         print('The API malfunctioned and did not return any results. Data acquisition postponed.')
+        return None
 
-
-    #Step 2: Get an output for each section and send it to MongoDB.
-
-    for sec in sec_names_list:
-
-        print(f'\n\nProcessing the section "{sec}" from the NYT Newswire API')
-        add_section_output(section=sec, source=edition)
-        full_pbar.update()
-        #print(f'Section "{sec}" processed.\n')
+    #Removing sections that we may not want to document (see: 'admin')
+    #'multimedia/photos' seems like an error 400 hitting this.
+    #The other values seem to return valid null results, and their removal is purely cosmetic.
+    excluded_sections = ['admin', 'multimedia/photos', 'universal', "today’s paper", "the weekly"]
+    return [sec for sec in sec_names_list if sec not in excluded_sections]
 
 if __name__=='__main__':
     if API_KEY is None:
@@ -192,6 +373,12 @@ if __name__=='__main__':
 Please run this script after performing this step.''')
     else:
         print("Performing data acquisition routines from the New York Times' TimesWire API.")
+        ensure_indexes(db) #uri lookups and upserts rely on them
+
+        #--full ignores the high-water marks and pages through every section again
+        full_sync = '--full' in sys.argv
+        if full_sync:
+            sys.argv.remove('--full')
 
         #CLI mode: we select specific sections, batch sizes, and editions
         if len(sys.argv) >=4:
@@ -211,10 +398,10 @@ Please run this script after performing this step.''')
                 except:
                     edition_param = 'nyt'
 
-                add_section_output(section_param, count_param, edition_param)
+                add_section_output(section_param, count_param, edition_param, full_sync)
 
             except:
-                get_full_newswire_output()
+                get_full_newswire_output(full_sync=full_sync)
 
         #Only one parameter: it better be your edition. If it's a help request, fine, we need to implement that.
         elif len(sys.argv) == 2 and not (sys.argv[1].lower() in ['-h', '--help', '-help']):
@@ -225,10 +412,12 @@ Please run this script after performing this step.''')
             except:
                 edition_param = 'nyt'
 
-            get_full_newswire_output(edition=edition_param)
+            get_full_newswire_output(edition=edition_param, full_sync=full_sync)
 
         elif len(sys.argv) == 2 and (sys.argv[1].lower() in ['-h', '--help', '-help']):
             print('''TO DO: implement documentation on CLI.''')
 
         elif len(sys.argv) == 1:
-            get_full_newswire_output()
+            get_full_newswire_output(full_sync=full_sync)
+
+        dump_metrics('nyt_newswire') #For the textfile collector and/or the Pushgateway (see nyt_common/metrics.py)
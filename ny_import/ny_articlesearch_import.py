@@ -2,54 +2,53 @@
 
 #Initial imports
 import os
-import requests
-import json
-from pymongo import MongoClient
-
-import time
-import random
-import numpy as np
+import asyncio
 
 import logging
 import sys
 
+from pymongo import UpdateOne
+
+#The shared helpers (HTTP client, rate limiter) live at the root of the repository.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nyt_common.nyt_http import NYTClient, run_in_thread
+from nyt_common.dates import DATE_FIELDS, convert_date_fields
+from nyt_common.indexes import ensure_indexes
+from nyt_common.keywords import normalize_keywords
+from nyt_common.countries import tag_countries
+from nyt_common.metrics import dump_metrics, mongo_batch
+from nyt_common.db import database
+
 logging.basicConfig(level=logging.INFO)
 
 API_KEY = os.getenv('NYTIMES_API_KEY') #If None, will prompt the user to get a key.
 
-MONGO_LABEL = os.environ.get('MONGODB_ADDRESS','localhost') #Unless you have your own address
-MONGO_PORT = int(os.environ.get('MONGODB_PORT',27017)) #Unless you have a specific port, default is 27017
+#MongoDB settings (MONGODB_ADDRESS, MONGODB_PORT, pool size...) are read by nyt_common/db.py
 
 
+# The delay between two requests is no longer a fixed sleep: NYTClient (nyt_common/nyt_http.py)
+# only waits when the Article Search quota requires it.
 
-def natural_variation_delay(min_delay=12, max_delay=15):
-    """
-    Waits for a random amount of time between `min_delay` and `max_delay` seconds.
-    """
-    t_wait = random.uniform(min_delay, max_delay)
-    print(t_wait)
-    time.sleep(t_wait)
-
+def get_article_search_pages(nb_pages=100):
+    asyncio.run(get_article_search_pages_async(nb_pages))
 
 
-def get_article_search_pages(nb_pages=100):
+async def get_article_search_pages_async(nb_pages=100):
+    """
+    Collects `nb_pages` pages of the Article Search API. Each page is written to MongoDB
+    in a worker thread while the request for the next page waits for its slot.
+    """
     logging.info("Starting the import process...")
 
-    global API_KEY
-    global MONGO_LABEL
-    global MONGO_PORT
-
     # Access API
     url = 'https://api.nytimes.com/svc/search/v2/'
     endpoint = 'articlesearch.json'
 
     logging.info('Accessing client')
-    # Access DB
-    client = MongoClient(host=MONGO_LABEL, port=MONGO_PORT)
-
-    # Access the database
-    db = client['NY_Project']
+    # Access the database (through the process' shared client)
+    db = database()
     collection = db['ny_articles']
+    ensure_indexes(db)  # The ny_id sort and the uri upserts rely on them
 
     # Get the maximum _id value from the collection
     max_id = collection.find_one(sort=[("ny_id", -1)])
@@ -58,64 +57,90 @@ def get_article_search_pages(nb_pages=100):
     # Main loop
     page = 0
     attempts = 0
+    pending_write = None
 
     logging.info('Collecting results one page at a time using a while loop.')
 
-    while page < nb_pages:
-        DOCS = []
+    async with NYTClient('articlesearch') as nyt_client:
+        while page < nb_pages:
+            DOCS = []
+
+            try:
+                logging.info(f"Trying page {page+1}, attempt {attempts + 1}")
 
-        #while attempts < 5:
-        try:
-            logging.info(f"Trying page {page+1}, attempt {attempts + 1}")
+                res = await nyt_client.get(url, endpoint, {'page': page, 'api-key': API_KEY})
+                res.raise_for_status()  # Raises an NYTHTTPError if the HTTP request returned an unsuccessful status code
 
-            res = requests.get(f'{url}/{endpoint}?page={page}&api-key={API_KEY}')
-            res.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
+                articles_names_json = await run_in_thread(res.json)
+                documents = articles_names_json.get('response')['docs']
 
-            articles_names_json = res.json()
-            documents = articles_names_json.get('response')['docs']
+                # Assign a new _id to each document
+                for doc in documents:
+                    doc['ny_id'] = index_counter
+                    index_counter += 1
 
-            # Assign a new _id to each document
-            for doc in documents:
-                doc['ny_id'] = index_counter
-                index_counter += 1
+                DOCS.extend(documents)
 
-            DOCS.extend(documents)
+                page += 1
+                attempts = 0
 
-            natural_variation_delay()
+            except TypeError:
+                # TypeError handling here: the rate limiter spaces out the retry, up to max_retries times
+                print(f"TypeError occurred on page {page}, attempt {attempts + 1}")
+                attempts += 1
+                if attempts > nyt_client.max_retries:
+                    # A page that keeps failing to parse would otherwise burn the daily quota
+                    logging.error(f"Skipping page {page}: it could not be parsed after {attempts} attempts")
+                    page += 1
+                    attempts = 0
 
-            page += 1
+            # insert articles by updating, while the next page is being requested
+            if pending_write is not None:
+                await pending_write
+            pending_write = asyncio.ensure_future(run_in_thread(write_article_docs, collection, DOCS))
 
-            #break
+        if pending_write is not None:
+            await pending_write
 
-        except TypeError:
-                # TypeError handling here
-            print(f"TypeError occurred on page {page}, attempt {attempts + 1}")
-            attempts += 1
-            natural_variation_delay()  # Wait before retrying
-            natural_variation_delay()
+    logging.info("Import process completed.")
 
 
-        # insert articles by updating
-        for doc in DOCS:
-            # Assuming 'uri' is the unique identifier field in your article data
-            article_uri = doc['uri']
-            
-            #Removing extra keys - if they aren't in our document, proceed as if
-            #nothing happened.
-            for excess_key in ['multimedia','keywords','_id']:
-                try:
-                    del doc[excess_key]
-                except:
-                    continue
-            
-            #Adjust the byline and headline fields - implement later
-            #doc['byline'] = doc.get('byline',{}).get('original',None)
-            #doc['headline'] = doc.get('headline',{}).get('main',None)
+def write_article_docs(collection, DOCS):
+    """
+    Writes the documents of one page of results to the collection, in one unordered bulk_write of upserts.
+    """
+    operations = []
+    for doc in DOCS:
+        # Assuming 'uri' is the unique identifier field in your article data
+        article_uri = doc['uri']
 
-            # Update the article if it exists, otherwise insert it
-            collection.update_one({'uri': article_uri}, {'$set': doc}, upsert=True)
+        # Keywords are only kept as a list of normalized values, searched by the Articles page
+        doc['keyword_terms'] = normalize_keywords(doc.get('keywords'))
 
-    logging.info("Import process completed.")
+        #Removing extra keys - if they aren't in our document, proceed as if
+        #nothing happened.
+        for excess_key in ['multimedia','keywords','_id']:
+            try:
+                del doc[excess_key]
+            except:
+                continue
+
+        #Adjust the byline and headline fields - implement later
+        #doc['byline'] = doc.get('byline',{}).get('original',None)
+        #doc['headline'] = doc.get('headline',{}).get('main',None)
+
+        # Store pub_date as a datetime, so that MongoDB can sort and group it natively
+        convert_date_fields(doc, DATE_FIELDS['ny_articles'])
+
+        # Countries mentioned in the headline and the abstract
+        tag_countries(doc, 'ny_articles')
+
+        # Update the article if it exists, otherwise insert it
+        operations.append(UpdateOne({'uri': article_uri}, {'$set': doc}, upsert=True))
+
+    if operations:
+        with mongo_batch('ny_articles', 'bulk_write', len(operations)):
+            collection.bulk_write(operations, ordered=False)
 
 
 if __name__ == "__main__":
@@ -130,6 +155,7 @@ If that is fine, please disregard this message.\n''')
 
     if API_KEY is not None:
         get_article_search_pages(nb)
+        dump_metrics('ny_articlesearch_import')  # For the textfile collector and/or the Pushgateway (see nyt_common/metrics.py)
     else:
         print('''Please generate an API key at https://developer.nytimes.com/ and add it to your environment variables as follows:
 
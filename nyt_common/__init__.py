@@ -0,0 +1,2 @@
+'''Helpers shared by the NYT acquisition scripts (newswire_acquisition, archive_acquisition, ny_import).
+Each script adds the root of the repository to its path before importing from here.'''
@@ -0,0 +1,80 @@
+'''Country mentions in articles. Rather than running a 250-way regex alternation over the whole collection
+every time the dashboard's geo tab loads, the ingestors tag each article once with the countries its title
+and abstract mention (the "countries" field). Existing articles can be tagged from the root of the repository:
+
+    python3 -m nyt_common.countries                   #times_newswire, times_archive and ny_articles
+    python3 -m nyt_common.countries times_newswire    #A single collection
+'''
+
+import re
+import sys
+
+from pymongo import UpdateOne
+
+from nyt_common.db import database
+
+#Credits to umpirsky for the country lists - see:
+#github.com/umpirsky/country-list/blob/master/data/en_us/country.json
+COUNTRIES = {"AF":"Afghanistan","AX":"\u00c5land Islands","AL":"Albania","DZ":"Algeria","AS":"American Samoa","AD":"Andorra","AO":"Angola","AI":"Anguilla","AQ":"Antarctica","AG":"Antigua & Barbuda","AR":"Argentina","AM":"Armenia","AW":"Aruba","AU":"Australia","AT":"Austria","AZ":"Azerbaijan","BS":"Bahamas","BH":"Bahrain","BD":"Bangladesh","BB":"Barbados","BY":"Belarus","BE":"Belgium","BZ":"Belize","BJ":"Benin","BM":"Bermuda","BT":"Bhutan","BO":"Bolivia","BA":"Bosnia & Herzegovina","BW":"Botswana","BV":"Bouvet Island","BR":"Brazil","IO":"British Indian Ocean Territory","VG":"British Virgin Islands","BN":"Brunei","BG":"Bulgaria","BF":"Burkina Faso","BI":"Burundi","KH":"Cambodia","CM":"Cameroon","CA":"Canada","CV":"Cape Verde","BQ":"Caribbean Netherlands","KY":"Cayman Islands","CF":"Central African Republic","TD":"Chad","CL":"Chile","CN":"China","CX":"Christmas Island","CC":"Cocos (Keeling) Islands","CO":"Colombia","KM":"Comoros","CG":"Congo - Brazzaville","CD":"Congo - Kinshasa","CK":"Cook Islands","CR":"Costa Rica","CI":"C\u00f4te d\u2019Ivoire","HR":"Croatia","CU":"Cuba","CW":"Cura\u00e7ao","CY":"Cyprus","CZ":"Czechia","DK":"Denmark","DJ":"Djibouti","DM":"Dominica","DO":"Dominican Republic","EC":"Ecuador","EG":"Egypt","SV":"El Salvador","GQ":"Equatorial Guinea","ER":"Eritrea","EE":"Estonia","SZ":"Eswatini","ET":"Ethiopia","FK":"Falkland Islands","FO":"Faroe Islands","FJ":"Fiji","FI":"Finland","FR":"France","GF":"French Guiana","PF":"French Polynesia","TF":"French Southern Territories","GA":"Gabon","GM":"Gambia","GE":"Georgia","DE":"Germany","GH":"Ghana","GI":"Gibraltar","GR":"Greece","GL":"Greenland","GD":"Grenada","GP":"Guadeloupe","GU":"Guam","GT":"Guatemala","GG":"Guernsey","GN":"Guinea","GW":"Guinea-Bissau","GY":"Guyana","HT":"Haiti","HM":"Heard & McDonald Islands","HN":"Honduras","HK":"Hong Kong SAR China","HU":"Hungary","IS":"Iceland","IN":"India","ID":"Indonesia","IR":"Iran","IQ":"Iraq","IE":"Ireland","IM":"Isle of Man","IL":"Israel","IT":"Italy","JM":"Jamaica","JP":"Japan","JE":"Jersey","JO":"Jordan","KZ":"Kazakhstan","KE":"Kenya","KI":"Kiribati","KW":"Kuwait","KG":"Kyrgyzstan","LA":"Laos","LV":"Latvia","LB":"Lebanon","LS":"Lesotho","LR":"Liberia","LY":"Libya","LI":"Liechtenstein","LT":"Lithuania","LU":"Luxembourg","MO":"Macao SAR China","MG":"Madagascar","MW":"Malawi","MY":"Malaysia","MV":"Maldives","ML":"Mali","MT":"Malta","MH":"Marshall Islands","MQ":"Martinique","MR":"Mauritania","MU":"Mauritius","YT":"Mayotte","MX":"Mexico","FM":"Micronesia","MD":"Moldova","MC":"Monaco","MN":"Mongolia","ME":"Montenegro","MS":"Montserrat","MA":"Morocco","MZ":"Mozambique","MM":"Myanmar (Burma)","NA":"Namibia","NR":"Nauru","NP":"Nepal","NL":"Netherlands","NC":"New Caledonia","NZ":"New Zealand","NI":"Nicaragua","NE":"Niger","NG":"Nigeria","NU":"Niue","NF":"Norfolk Island","KP":"North Korea","MK":"North Macedonia","MP":"Northern Mariana Islands","NO":"Norway","OM":"Oman","PK":"Pakistan","PW":"Palau","PS":"Palestinian Territories","PA":"Panama","PG":"Papua New Guinea","PY":"Paraguay","PE":"Peru","PH":"Philippines","PN":"Pitcairn Islands","PL":"Poland","PT":"Portugal","PR":"Puerto Rico","QA":"Qatar","RE":"R\u00e9union","RO":"Romania","RU":"Russia","RW":"Rwanda","WS":"Samoa","SM":"San Marino","ST":"S\u00e3o Tom\u00e9 & Pr\u00edncipe","SA":"Saudi Arabia","SN":"Senegal","RS":"Serbia","SC":"Seychelles","SL":"Sierra Leone","SG":"Singapore","SX":"Sint Maarten","SK":"Slovakia","SI":"Slovenia","SB":"Solomon Islands","SO":"Somalia","ZA":"South Africa","GS":"South Georgia & South Sandwich Islands","KR":"South Korea","SS":"South Sudan","ES":"Spain","LK":"Sri Lanka","BL":"St. Barth\u00e9lemy","SH":"St. Helena","KN":"St. Kitts & Nevis","LC":"St. Lucia","MF":"St. Martin","PM":"St. Pierre & Miquelon","VC":"St. Vincent & Grenadines","SD":"Sudan","SR":"Suriname","SJ":"Svalbard & Jan Mayen","SE":"Sweden","CH":"Switzerland","SY":"Syria","TW":"Taiwan","TJ":"Tajikistan","TZ":"Tanzania","TH":"Thailand","TL":"Timor-Leste","TG":"Togo","TK":"Tokelau","TO":"Tonga","TT":"Trinidad & Tobago","TN":"Tunisia","TR":"Turkey","TM":"Turkmenistan","TC":"Turks & Caicos Islands","TV":"Tuvalu","UM":"U.S. Outlying Islands","VI":"U.S. Virgin Islands","UG":"Uganda","UA":"Ukraine","AE":"United Arab Emirates","GB":"United Kingdom","US":"United States","UY":"Uruguay","UZ":"Uzbekistan","VU":"Vanuatu","VA":"Vatican City","VE":"Venezuela","VN":"Vietnam","WF":"Wallis & Futuna","EH":"Western Sahara","YE":"Yemen","ZM":"Zambia","ZW":"Zimbabwe"}
+
+COUNTRY_NAMES = list(COUNTRIES.values())
+
+#All names compiled into a single pattern, longest names first so that e.g. "Guinea-Bissau" wins over "Guinea".
+#The lookarounds keep names from matching inside other words (plain \b would fail after "Myanmar (Burma)").
+COUNTRY_PATTERN = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(name) for name in sorted(COUNTRY_NAMES, key=len, reverse=True)) + r')(?!\w)')
+
+#Where the text of each field lives, per collection (headline is only flattened in the archive)
+TAGGED_FIELDS = {
+    'times_newswire': {'title':'title', 'abstract':'abstract'},
+    'times_archive': {'title':'headline', 'abstract':'abstract'},
+    'ny_articles': {'title':'headline.main', 'abstract':'abstract'},
+}
+
+def find_countries(text) -> list:
+    '''Every country mentioned in a text (not just the first one), each listed once.'''
+    if not isinstance(text, str) or not text:
+        return []
+    return sorted(set(COUNTRY_PATTERN.findall(text)))
+
+def get_field(doc:dict, path:str):
+    '''Reads a (possibly dotted) field of a document.'''
+    for key in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+def tag_countries(doc:dict, collection_name:str) -> dict:
+    '''Stores the countries mentioned in the title and the abstract of a document, in place:
+    doc['countries'] = {'title': [...], 'abstract': [...]}'''
+    doc['countries'] = {tag:find_countries(get_field(doc, path)) for tag, path in TAGGED_FIELDS[collection_name].items()}
+    return doc
+
+def backfill_countries(db, collection_name:str, chunk_size:int = 1000) -> int:
+    '''Tags the documents of a collection that do not have a countries field yet, chunk by chunk.
+    Already tagged documents are skipped, so an interrupted backfill simply resumes.'''
+    collection = db[collection_name]
+    projection = {path:1 for path in TAGGED_FIELDS[collection_name].values()}
+    tagged = 0
+    last_id = None
+
+    while True:
+        query = {"countries":{"$exists":False}}
+        if last_id is not None:
+            query["_id"] = {"$gt":last_id}
+        chunk = list(collection.find(query, projection).sort("_id", 1).limit(chunk_size))
+        if not chunk:
+            break
+
+        operations = [UpdateOne({"_id":doc['_id']}, {"$set":{"countries":tag_countries(doc, collection_name)['countries']}})
+                      for doc in chunk]
+        tagged += collection.bulk_write(operations, ordered=False).modified_count
+        last_id = chunk[-1]['_id']
+        print(f'{collection_name}: {tagged} documents tagged so far...')
+
+    return tagged
+
+if __name__ == '__main__':
+    db = database()
+    for name in (sys.argv[1:] or list(TAGGED_FIELDS)):
+        print(f'{name}: {backfill_countries(db, name)} documents tagged.')
@@ -0,0 +1,42 @@
+'''Date helpers for the ISO-formatted dates returned by the NY Times APIs.'''
+
+import datetime
+
+def parse_nyt_datetime(value):
+    '''Turns a NYT date into a naive UTC datetime (which is also how MongoDB returns dates).
+    Handles both offset styles of the Times' APIs: "2023-11-20T10:01:42-05:00" (Newswire)
+    and "2023-11-20T15:01:42+0000" (Archive, Article Search). Returns None if the value cannot be parsed.'''
+    if isinstance(value, datetime.datetime):
+        parsed = value
+    elif isinstance(value, str) and value:
+        parsed = None
+        for date_format in ['%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d']:
+            try:
+                parsed = datetime.datetime.strptime(value, date_format)
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            return None
+    else:
+        return None
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+#Date fields stored as native BSON datetimes (naive UTC), per collection of the NY_Project database
+DATE_FIELDS = {
+    'times_newswire': ['updated_date', 'created_date', 'published_date', 'first_published_date'],
+    'times_archive': ['pub_date'],
+    'ny_articles': ['pub_date'],
+}
+
+def convert_date_fields(doc:dict, fields:list) -> dict:
+    '''Replaces the ISO-formatted date strings of a document by datetimes, in place.
+    Fields that are missing or cannot be parsed are left as they are.'''
+    for field in fields:
+        parsed = parse_nyt_datetime(doc.get(field))
+        if parsed is not None:
+            doc[field] = parsed
+    return doc
@@ -0,0 +1,102 @@
+'''Shared MongoDB client: one per process, created on first use.
+Modules get their database with database() at import time, without connecting: the LazyDatabase (and the
+LazyCollections it hands out) resolve to the process' client on every call. After a fork (gunicorn workers,
+multiprocessing pools), the child drops the client it inherited and creates its own on first use, as pymongo
+clients are not fork-safe. Connections per process are bounded by MONGODB_MAX_POOL_SIZE, so the total is
+(number of processes) x (pool size).
+
+Settings, on top of MONGODB_ADDRESS and MONGODB_PORT (unset: pymongo's default):
+MONGODB_MAX_POOL_SIZE, MONGODB_MIN_POOL_SIZE, MONGODB_MAX_IDLE_MS, MONGODB_CONNECT_TIMEOUT_MS,
+MONGODB_SERVER_SELECTION_TIMEOUT_MS, MONGODB_SOCKET_TIMEOUT_MS, MONGODB_COMPRESSORS (e.g. "zstd,snappy,zlib",
+zstd needs the zstandard package and snappy python-snappy) and MONGODB_READ_PREFERENCE (e.g. "secondaryPreferred").
+'''
+
+import os
+import threading
+
+import pymongo
+
+MONGO_LABEL = os.environ.get('MONGODB_ADDRESS','localhost') #Unless you have your own address
+MONGO_PORT = int(os.environ.get('MONGODB_PORT',27017)) #Unless you have a specific port, default is 27017
+DATABASE = 'NY_Project'
+
+#Environment variable -> (MongoClient option, type)
+CLIENT_SETTINGS = {
+    'MONGODB_MAX_POOL_SIZE': ('maxPoolSize', int),
+    'MONGODB_MIN_POOL_SIZE': ('minPoolSize', int),
+    'MONGODB_MAX_IDLE_MS': ('maxIdleTimeMS', int),
+    'MONGODB_CONNECT_TIMEOUT_MS': ('connectTimeoutMS', int),
+    'MONGODB_SERVER_SELECTION_TIMEOUT_MS': ('serverSelectionTimeoutMS', int),
+    'MONGODB_SOCKET_TIMEOUT_MS': ('socketTimeoutMS', int),
+    'MONGODB_COMPRESSORS': ('compressors', str),
+    'MONGODB_READ_PREFERENCE': ('readPreference', str),
+}
+
+CLIENT = None
+CLIENT_PID = None
+CLIENT_LOCK = threading.Lock()
+
+def client_options() -> dict:
+    '''MongoClient options from the environment (only the ones that are set).'''
+    options = {'host': MONGO_LABEL, 'port': MONGO_PORT, 'appname': os.environ.get('MONGODB_APP_NAME', 'nyt_project')}
+    for variable, (option, cast) in CLIENT_SETTINGS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = cast(value)
+    return options
+
+def get_client():
+    '''The MongoClient of this process, created on first use (and again in a forked child).'''
+    global CLIENT, CLIENT_PID
+    if CLIENT is None or CLIENT_PID != os.getpid():
+        with CLIENT_LOCK:
+            if CLIENT is None or CLIENT_PID != os.getpid():
+                CLIENT = pymongo.MongoClient(**client_options())
+                CLIENT_PID = os.getpid()
+    return CLIENT
+
+def forget_client():
+    '''In a forked child: drop the parent's client without closing it (its sockets belong to the parent).'''
+    global CLIENT, CLIENT_PID
+    CLIENT = None
+    CLIENT_PID = None
+
+def close_client():
+    '''Closes the client of this process, if any (the next call to get_client creates a new one).'''
+    with CLIENT_LOCK:
+        if CLIENT is not None and CLIENT_PID == os.getpid():
+            CLIENT.close()
+        forget_client()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_client)
+
+class LazyDatabase:
+    '''Stands for a database of the process' client, connecting on first use.'''
+    def __init__(self, name:str):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'): #Copies and pickles look up special methods before __init__ ran
+            raise AttributeError(attribute)
+        return getattr(get_client()[self.name], attribute)
+
+    def __getitem__(self, collection:str):
+        return LazyCollection(self.name, collection)
+
+class LazyCollection:
+    '''Stands for a collection of the process' client, connecting on first use.'''
+    def __init__(self, database_name:str, name:str):
+        self.database_name = database_name
+        self.name = name
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        return getattr(get_client()[self.database_name][self.name], attribute)
+
+    def __getitem__(self, subcollection:str):
+        return LazyCollection(self.database_name, f'{self.name}.{subcollection}')
+
+def database(name:str = DATABASE) -> LazyDatabase:
+    return LazyDatabase(name)
@@ -0,0 +1,139 @@
+'''Indexes of the NY_Project collections. ensure_indexes() is idempotent: the ingest scripts call it at startup,
+and MongoDB only builds the indexes that are missing. The dash app does not (it must not query MongoDB when it is
+imported): when deploying it on its own database, create them once from the root of the repository:
+
+    python3 -m nyt_common.indexes             #Create the missing indexes
+    python3 -m nyt_common.indexes --explain   #...then show which index each dashboard query uses
+'''
+
+import sys
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from nyt_common.db import database
+from nyt_common.rollups import NEWSWIRE_ROLLUPS
+
+#Every article is identified by its uri: lookups and upserts go through this index.
+UNIQUE_URI = IndexModel([('uri', ASCENDING)], name='uri_unique', unique=True)
+
+INDEXES = {
+    'times_newswire': [
+        UNIQUE_URI,
+        IndexModel([('section', ASCENDING), ('subsection', ASCENDING), ('created_date', ASCENDING)],
+                   name='section_subsection_created_date'),
+        IndexModel([('updated_date', DESCENDING)], name='updated_date'),
+        #Geo tab: articles mentioning at least one country (see nyt_common/countries.py)
+        IndexModel([('countries.title', ASCENDING)], name='countries_title'),
+        IndexModel([('countries.abstract', ASCENDING)], name='countries_abstract'),
+        #Newswire search tab: title matches weigh more than abstract matches
+        IndexModel([('title', TEXT), ('abstract', TEXT)], name='title_abstract_text',
+                   weights={'title':10, 'abstract':3}, default_language='english'),
+    ],
+    'times_archive': [
+        UNIQUE_URI,
+        IndexModel([('pub_date', DESCENDING)], name='pub_date'),
+        IndexModel([('keyword_terms', ASCENDING)], name='keyword_terms'),
+    ],
+    'ny_articles': [
+        UNIQUE_URI,
+        IndexModel([('ny_id', DESCENDING)], name='ny_id'),
+        IndexModel([('pub_date', DESCENDING)], name='pub_date'),
+        #Articles page search: prefix matches on normalized keywords
+        IndexModel([('keyword_terms', ASCENDING)], name='keyword_terms'),
+    ],
+    'sync_state': [
+        IndexModel([('source', ASCENDING), ('section', ASCENDING)], name='source_section', unique=True),
+    ],
+    'archive_checkpoints': [
+        IndexModel([('year', ASCENDING), ('month', ASCENDING)], name='year_month', unique=True),
+    ],
+}
+
+#Partial rollup refreshes look rows up by day
+for rollup_name in NEWSWIRE_ROLLUPS:
+    INDEXES[rollup_name] = [IndexModel([('year', ASCENDING), ('month', ASCENDING), ('day', ASCENDING)], name='day')]
+
+def ensure_indexes(db) -> dict:
+    '''Creates the missing indexes of every collection. A failure (e.g. duplicate uris preventing a unique index)
+    is reported but does not stop the other collections. Returns {collection: index names or errors}.'''
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        report[collection_name] = []
+        #One index at a time, so that a failing index does not prevent the others from being built
+        for index in indexes:
+            try:
+                report[collection_name].extend(db[collection_name].create_indexes([index]))
+            except OperationFailure as error:
+                print(f'Could not create an index of {collection_name}: {error}')
+                report[collection_name].append(f'error: {error}')
+    return report
+
+def dashboard_queries(db) -> dict:
+    '''The queries the dashboard and the ingestors run the most, as {label: explain command}.'''
+    return {
+        'newswire: latest/oldest article (sort on updated_date)':
+            {'find':'times_newswire', 'filter':{'uri':{'$ne':''}}, 'sort':{'updated_date':-1}, 'limit':1},
+        'newswire: section list (distinct section)':
+            {'distinct':'times_newswire', 'key':'section'},
+        'newswire: uri lookup of a batch ($in)':
+            {'find':'times_newswire', 'filter':{'uri':{'$in':['nyt://article/example']}},
+             'projection':{'_id':0, 'uri':1, 'updated_date':1}},
+        'newswire: search tab (text index)':
+            {'find':'times_newswire', 'filter':{'$text':{'$search':'election'}}, 'limit':10},
+        'newswire: geo tab (countries in the title)':
+            {'aggregate':'times_newswire', 'pipeline':[{'$match':{'countries.title':{'$gt':''}}},
+                                                       {'$unwind':'$countries.title'},
+                                                       {'$group':{'_id':'$countries.title', 'nb':{'$sum':1}}}],
+             'cursor':{}},
+        'newswire: subsection of a section':
+            {'find':'times_newswire', 'filter':{'section':'world', 'subsection':'europe'}},
+        'archive: uri lookup of a batch ($in)':
+            {'find':'times_archive', 'filter':{'uri':{'$in':['nyt://article/example']}}},
+        'articles: highest ny_id':
+            {'find':'ny_articles', 'filter':{}, 'sort':{'ny_id':-1}, 'limit':1},
+        'articles: newest articles (sort on pub_date)':
+            {'find':'ny_articles', 'filter':{}, 'sort':{'pub_date':-1}, 'limit':5},
+        'articles: keyword search (prefix on keyword_terms)':
+            {'find':'ny_articles', 'filter':{'keyword_terms':{'$regex':'^elect'}}, 'limit':5},
+    }
+
+def plan_indexes(plan:dict) -> list:
+    '''Walks a query plan and lists the indexes it uses ('COLLSCAN' for collection scans).'''
+    used = []
+    if plan.get('stage') == 'COLLSCAN':
+        used.append('COLLSCAN')
+    if 'indexName' in plan:
+        used.append(plan['indexName'])
+    for child in [plan.get('inputStage'), plan.get('queryPlan')] + plan.get('inputStages', []):
+        if child:
+            used.extend(plan_indexes(child))
+    return used
+
+def explain_section(explained:dict, section:str) -> dict:
+    '''A section of an explain() output (queryPlanner, executionStats), where aggregations may nest it
+    under their first stage.'''
+    if section in explained:
+        return explained[section]
+    return explained.get('stages', [{}])[0].get('$cursor', {}).get(section, {})
+
+def explain_report(db) -> dict:
+    '''Runs explain() on each dashboard query and returns {label: indexes used by the winning plan}.'''
+    report = {}
+    for label, command in dashboard_queries(db).items():
+        try:
+            explained = db.command('explain', command, verbosity='queryPlanner')
+            winning_plan = explain_section(explained, 'queryPlanner').get('winningPlan', {})
+            report[label] = plan_indexes(winning_plan) or [winning_plan.get('stage', 'unknown')]
+        except OperationFailure as error:
+            report[label] = [f'error: {error}']
+    return report
+
+if __name__ == '__main__':
+    db = database()
+    for name, created in ensure_indexes(db).items():
+        print(f'{name}: {created}')
+    if '--explain' in sys.argv:
+        print()
+        for label, used in explain_report(db).items():
+            print(f'{label}: {", ".join(used)}')
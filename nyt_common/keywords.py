@@ -0,0 +1,14 @@
+'''Keyword helpers: the Article Search and Archive APIs return keywords as
+[{"name": "subject", "value": "Elections", "rank": 1, ...}]. We only keep their normalized values.'''
+
+import re
+
+def normalize_term(term:str) -> str:
+    '''Lowercases a keyword or a search query and collapses its whitespace.'''
+    return re.sub(r'\s+', ' ', term or '').strip().lower()
+
+def normalize_keywords(keywords) -> list:
+    '''Turns the keywords of an article into a sorted list of unique, normalized values (the keyword_terms field).'''
+    terms = {normalize_term(keyword.get('value')) for keyword in (keywords or []) if isinstance(keyword, dict)}
+    terms.discard('')
+    return sorted(terms)
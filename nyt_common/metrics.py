@@ -0,0 +1,77 @@
+'''Prometheus metrics of the acquisition scripts and the dashboard.
+Histograms time the hot paths: NY Times API requests, rate limiter waits, MongoDB batches, dashboard datasets
+and Dash callbacks. The dashboard serves them at /metrics (see dash_app/web_gui.py). The cron scripts dump them
+when they are done (see dump_metrics): to a .prom file for the node exporter's textfile collector if
+METRICS_TEXTFILE_DIR is set, and/or to a Pushgateway if PUSHGATEWAY_URL is set.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (an empty folder) so that /metrics adds up every worker.
+'''
+
+import contextlib
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, push_to_gateway, write_to_textfile)
+
+#Buckets from 5 ms to 5 minutes: MongoDB batches are fast, archive months and rate limiter waits are not
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+API_REQUEST_SECONDS = Histogram('nyt_api_request_seconds', 'Duration of NY Times API requests',
+                                ['api', 'status'], buckets=BUCKETS)
+RATE_LIMIT_WAIT_SECONDS = Histogram('nyt_rate_limit_wait_seconds', 'Time spent waiting for the rate limiter',
+                                    ['api'], buckets=BUCKETS)
+API_CACHE_RESPONSES = Counter('nyt_api_cache_responses', 'NY Times API responses served from or stored in the '
+                              'response cache', ['api', 'result'])
+MONGO_BATCH_SECONDS = Histogram('nyt_mongo_batch_seconds', 'Duration of MongoDB read/write batches',
+                                ['collection', 'operation'], buckets=BUCKETS)
+MONGO_BATCH_DOCUMENTS = Counter('nyt_mongo_batch_documents', 'Documents sent or read by MongoDB batches',
+                                ['collection', 'operation'])
+DASHBOARD_DATASET_SECONDS = Histogram('nyt_dashboard_dataset_seconds', 'Duration of the NewswireData getters',
+                                      ['dataset'], buckets=BUCKETS)
+DASH_CALLBACK_SECONDS = Histogram('nyt_dash_callback_seconds', 'Duration of the Dash callbacks',
+                                  ['callback'], buckets=BUCKETS)
+
+@contextlib.contextmanager
+def mongo_batch(collection:str, operation:str, nb_documents:int = 0):
+    '''Times a MongoDB batch (e.g. one bulk_write), and counts its documents.'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        MONGO_BATCH_SECONDS.labels(collection, operation).observe(time.perf_counter() - start)
+        MONGO_BATCH_DOCUMENTS.labels(collection, operation).inc(nb_documents)
+
+def timed_dataset(dataset:str):
+    '''Decorator timing a NewswireData getter.'''
+    return DASHBOARD_DATASET_SECONDS.labels(dataset).time()
+
+def timed_callback(callback:str):
+    '''Decorator timing a Dash callback (place it under @callback).'''
+    return DASH_CALLBACK_SECONDS.labels(callback).time()
+
+def metrics_registry():
+    '''The registry to expose: every worker's metrics in multiprocess mode, this process' otherwise.'''
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def metrics_response() -> tuple:
+    '''(body, content type) of a /metrics response, in the Prometheus text format.'''
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+def dump_metrics(job:str):
+    '''Dumps the metrics of a cron script: to METRICS_TEXTFILE_DIR/<job>.prom and/or to PUSHGATEWAY_URL.
+    Failing to do so is reported, but never fails the script.'''
+    textfile_dir = os.environ.get('METRICS_TEXTFILE_DIR')
+    pushgateway_url = os.environ.get('PUSHGATEWAY_URL')
+    try:
+        if textfile_dir:
+            write_to_textfile(os.path.join(textfile_dir, f'{job}.prom'), REGISTRY)
+        if pushgateway_url:
+            push_to_gateway(pushgateway_url, job=job, registry=REGISTRY)
+    except Exception as error:
+        print(f'Could not dump the metrics of {job}: {error}')
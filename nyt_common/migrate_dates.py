@@ -0,0 +1,62 @@
+'''One-time migration of the ISO-formatted date strings of the NY_Project collections to native datetimes.
+Documents are converted in chunks, in _id order. The last _id of each chunk is saved in the migrations
+collection, so an interrupted migration resumes where it stopped. Run it from the root of the repository:
+
+    python3 -m nyt_common.migrate_dates                   #Every collection in DATE_FIELDS
+    python3 -m nyt_common.migrate_dates times_newswire    #A single collection
+'''
+
+import datetime
+import sys
+
+from pymongo import UpdateOne
+
+from nyt_common.db import database
+from nyt_common.dates import DATE_FIELDS, convert_date_fields
+from nyt_common.rollups import refresh_newswire_rollups
+
+def migrate_collection(db, collection_name:str, chunk_size:int = 1000) -> int:
+    '''Converts the date fields of a collection, chunk by chunk. Returns the number of updated documents.'''
+    collection = db[collection_name]
+    fields = DATE_FIELDS[collection_name]
+    state_id = f'dates:{collection_name}'
+    state = db['migrations'].find_one({"_id":state_id}) or {}
+    last_id = state.get('last_id')
+    updated = 0
+
+    while True:
+        query = {"$or":[{field:{"$type":"string"}} for field in fields]}
+        if last_id is not None:
+            query["_id"] = {"$gt":last_id}
+        chunk = list(collection.find(query, {field:1 for field in fields}).sort("_id", 1).limit(chunk_size))
+        if not chunk:
+            break
+
+        operations = []
+        for doc in chunk:
+            converted = convert_date_fields(dict(doc), fields)
+            changes = {field:converted[field] for field in fields
+                       if isinstance(doc.get(field), str) and isinstance(converted.get(field), datetime.datetime)}
+            if changes:
+                operations.append(UpdateOne({"_id":doc['_id']}, {"$set":changes}))
+        if operations:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+
+        #Documents whose dates cannot be parsed keep their strings: the saved _id keeps us from looping over them.
+        last_id = chunk[-1]['_id']
+        db['migrations'].update_one({"_id":state_id},
+                                    {"$set":{"last_id":last_id, "updated_at":datetime.datetime.utcnow()},
+                                     "$inc":{"updated":len(operations)}},
+                                    upsert=True)
+        print(f'{collection_name}: {updated} documents converted so far...')
+
+    db['migrations'].update_one({"_id":state_id}, {"$set":{"completed_at":datetime.datetime.utcnow()}}, upsert=True)
+    return updated
+
+if __name__ == '__main__':
+    db = database()
+    for name in (sys.argv[1:] or list(DATE_FIELDS)):
+        print(f'{name}: {migrate_collection(db, name)} documents converted.')
+
+    #The dashboard rollups group articles by day, which now comes from native dates.
+    refresh_newswire_rollups(db)
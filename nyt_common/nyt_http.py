@@ -0,0 +1,248 @@
+'''Shared asynchronous HTTP client for the NY Times APIs.
+Instead of sleeping 12 seconds after every request, all requests go through a token bucket
+(one per API) that follows the Times' quotas: a number of requests per minute, plus a daily cap.
+Requests only wait when the bucket is empty, which lets the scripts parse responses and write
+to MongoDB (see run_in_thread) while waiting for the next request slot.
+Raw responses can also be kept in a local cache, and replayed without any network (see response_cache.py).
+'''
+
+import asyncio
+import datetime
+import functools
+import json
+import os
+import tempfile
+import time
+
+import aiohttp
+
+from nyt_common.metrics import API_CACHE_RESPONSES, API_REQUEST_SECONDS, RATE_LIMIT_WAIT_SECONDS
+from nyt_common.response_cache import open_response_cache
+
+class RateLimit:
+    '''Quota of a NY Times API: requests per minute, requests per day, and how many requests
+    can be sent back to back when the bucket is full.'''
+    def __init__(self, per_minute:float, per_day:int, burst:int = 1):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.burst = burst
+
+#The NYT developer portal allows 5 requests per minute and 500 requests per day for each API.
+#Each value can be overridden with environment variables, e.g. NYT_NEWSWIRE_PER_MINUTE or NYT_ARCHIVE_PER_DAY.
+API_LIMITS = {
+    'newswire': RateLimit(per_minute=5, per_day=500, burst=5),
+    'archive': RateLimit(per_minute=5, per_day=500, burst=5),
+    'articlesearch': RateLimit(per_minute=5, per_day=500, burst=5),
+}
+
+def get_rate_limit(api:str) -> RateLimit:
+    '''Returns the quota of an API, taking environment overrides into account.'''
+    default = API_LIMITS.get(api, RateLimit(per_minute=5, per_day=500))
+    prefix = f'NYT_{api.upper()}'
+    return RateLimit(per_minute=float(os.environ.get(f'{prefix}_PER_MINUTE', default.per_minute)),
+                     per_day=int(os.environ.get(f'{prefix}_PER_DAY', default.per_day)),
+                     burst=int(os.environ.get(f'{prefix}_BURST', default.burst)))
+
+class QuotaExceeded(Exception):
+    '''Raised when the daily cap of an API has been reached.'''
+
+class NYTHTTPError(Exception):
+    '''Raised by NYTResponse.raise_for_status() for unsuccessful status codes.'''
+    def __init__(self, status_code:int, content:bytes):
+        super().__init__(f'{status_code} - {content[:200]}')
+        self.status_code = status_code
+        self.content = content
+
+class TokenBucket:
+    '''Token bucket refilled at per_minute/60 tokens per second, holding up to `burst` tokens.
+    On top of that, no more than per_day tokens are handed out per (UTC) day.
+    Must be created and used from within the same event loop.
+    The counts live in this process only: scripts running at the same time (or an earlier run of the same day)
+    do not see each other's requests. The worker pools (archive backfill, newswire_job.py) never send requests
+    themselves, so each script has a single bucket per API; keep NYT_<API>_PER_DAY below the quota accordingly
+    when several scripts share a key.'''
+    def __init__(self, limit:RateLimit):
+        self.rate = limit.per_minute / 60
+        self.capacity = max(1, limit.burst)
+        self.per_day = limit.per_day
+        self.tokens = float(self.capacity)
+        self.last_refill = time.monotonic()
+        self.day = datetime.datetime.utcnow().date()
+        self.day_count = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    async def acquire(self):
+        '''Waits until a request slot is available, then takes it.'''
+        async with self.lock:
+            today = datetime.datetime.utcnow().date()
+            if today != self.day:
+                self.day = today
+                self.day_count = 0
+            if self.day_count >= self.per_day:
+                raise QuotaExceeded(f'Daily cap of {self.per_day} requests reached.')
+
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+
+            self.tokens -= 1
+            self.day_count += 1
+
+    def drain(self):
+        '''Empties the bucket, e.g. after a 429 response: the next requests will wait for a refill.'''
+        self.tokens = 0
+        self.last_refill = time.monotonic()
+
+class NYTResponse:
+    '''Minimal response object, mimicking the parts of requests.Response that the scripts use.
+    The body is kept as bytes so that parsing can happen outside of the event loop.'''
+    def __init__(self, status_code:int, content:bytes, url:str = '', path:str = None):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+        self.path = path #Set when the body was streamed to disk (see NYTClient.download)
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise NYTHTTPError(self.status_code, self.content)
+
+#The scripts build their URLs from the public API root. NYT_API_BASE_URL sends their requests elsewhere
+#instead, e.g. to the fake server of the benchmarks (see benchmarks/fake_nyt.py).
+API_BASE_URL = 'https://api.nytimes.com'
+
+def resolve_url(url:str) -> str:
+    base_url = os.environ.get('NYT_API_BASE_URL')
+    if base_url and url.startswith(API_BASE_URL):
+        return base_url.rstrip('/') + url[len(API_BASE_URL):]
+    return url
+
+class NYTClient:
+    '''Rate-limited client for one NY Times API, with a pooled keep-alive session.
+    Use it as an asynchronous context manager:
+
+        async with NYTClient('newswire') as client:
+            res = await client.get(url, endpoint, payload)
+    '''
+    def __init__(self, api:str, max_retries:int = 3, timeout:int = 300):
+        self.api = api
+        self.limit = get_rate_limit(api)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.bucket = None
+        self.session = None
+        self.cache = open_response_cache() #None unless NYT_RESPONSE_CACHE_DIR is set
+
+    async def __aenter__(self):
+        self.bucket = TokenBucket(self.limit)
+        connector = aiohttp.TCPConnector(limit=4, keepalive_timeout=120)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get(self, url:str, endpoint:str, payload:dict = None,
+                  fresh_after:datetime.datetime = None) -> NYTResponse:
+        '''Sends a GET request once the rate limiter allows it.
+        429 and 5xx responses, connection errors and timeouts are retried (up to max_retries),
+        waiting for Retry-After if provided.
+        fresh_after (UTC) is the moment the response stopped changing, if known: in reuse mode, a response
+        cached after it is served without a request (see response_cache.py).'''
+        return await self._request(url, endpoint, payload, fresh_after=fresh_after)
+
+    async def download(self, url:str, endpoint:str, payload:dict = None,
+                       fresh_after:datetime.datetime = None) -> NYTResponse:
+        '''Same as get(), but a successful body is streamed to a temporary file (NYTResponse.path)
+        instead of being held in memory. Removing the file is up to the caller.'''
+        return await self._request(url, endpoint, payload, spool=True, fresh_after=fresh_after)
+
+    async def _request(self, url:str, endpoint:str, payload:dict = None, spool:bool = False,
+                       fresh_after:datetime.datetime = None) -> NYTResponse:
+        params = dict(payload) if payload else None
+        if self.cache is not None and self.cache.mode != 'record':
+            cached = await run_in_thread(self._cached_response, url, endpoint, params, spool, fresh_after)
+            if cached is not None:
+                return cached
+
+        #Cache keys use the public URL, wherever the request is actually sent
+        public_url = url
+        url = resolve_url(url)
+        for attempt in range(self.max_retries + 1):
+            with RATE_LIMIT_WAIT_SECONDS.labels(self.api).time():
+                await self.bucket.acquire()
+            path = None
+            start = time.perf_counter()
+            try:
+                async with self.session.get(f'{url}{endpoint}', params=params) as resp:
+                    status = resp.status
+                    retry_after = resp.headers.get('Retry-After')
+                    if spool and status == 200:
+                        content = b''
+                        path = await self._spool(resp)
+                    else:
+                        content = await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                API_REQUEST_SECONDS.labels(self.api, type(error).__name__).observe(time.perf_counter() - start)
+                if attempt >= self.max_retries:
+                    raise
+                #Same backoff as a response without Retry-After
+                await asyncio.sleep(60 / self.limit.per_minute * (attempt + 1))
+                continue
+            API_REQUEST_SECONDS.labels(self.api, str(status)).observe(time.perf_counter() - start)
+
+            if (status == 429 or status >= 500) and attempt < self.max_retries:
+                self.bucket.drain()
+                try:
+                    wait_time = float(retry_after)
+                except (TypeError, ValueError):
+                    wait_time = 60 / self.limit.per_minute * (attempt + 1)
+                await asyncio.sleep(wait_time)
+                continue
+
+            if status == 200 and self.cache is not None:
+                await run_in_thread(self.cache.store, self.api, public_url, endpoint, params, content, path)
+                API_CACHE_RESPONSES.labels(self.api, 'stored').inc()
+            return NYTResponse(status, content, f'{url}{endpoint}', path)
+
+    def _cached_response(self, url:str, endpoint:str, params:dict, spool:bool, fresh_after:datetime.datetime):
+        '''The response to serve from the cache, if any. In replay mode, a missing response is a 404.'''
+        entry = self.cache.lookup(self.api, url, endpoint, params, fresh_after)
+        if entry is not None:
+            API_CACHE_RESPONSES.labels(self.api, 'hit').inc()
+            if spool:
+                return NYTResponse(200, b'', f'{url}{endpoint}', self.cache.extract(entry))
+            return NYTResponse(200, self.cache.read(entry), f'{url}{endpoint}')
+
+        API_CACHE_RESPONSES.labels(self.api, 'miss').inc()
+        if self.cache.mode == 'replay':
+            return NYTResponse(404, b'{"fault":"Not in the response cache (replay mode)"}', f'{url}{endpoint}')
+        return None
+
+    @staticmethod
+    async def _spool(resp, chunk_size:int = 1 << 16) -> str:
+        '''Writes the body of a response to a temporary file, chunk by chunk.'''
+        with tempfile.NamedTemporaryFile(prefix='nyt_', suffix='.json', delete=False) as spool_file:
+            try:
+                async for chunk in resp.content.iter_chunked(chunk_size):
+                    spool_file.write(chunk)
+            except BaseException:
+                spool_file.close()
+                os.remove(spool_file.name)
+                raise
+        return spool_file.name
+
+async def run_in_thread(func, *args, **kwargs):
+    '''Runs blocking work (JSON parsing, MongoDB writes) in the default thread pool,
+    so that the event loop can keep sending requests in the meantime.'''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,188 @@
+'''Content-addressed cache of the raw NY Times API responses, compressed with zstd.
+Set NYT_RESPONSE_CACHE_DIR, and NYTClient (see nyt_http.py) stores the body of every successful response:
+
+    objects/<sha256 of the body>.zst    #Each distinct body is stored once
+    keys/<sha256 of the request>.jsonl  #One line per distinct body received for a request, oldest first
+
+A request is identified by its URL, endpoint and parameters, minus the API key. NYT_RESPONSE_CACHE sets the mode:
+
+    record   #(default) Every request goes to the API, every successful response is stored
+    reuse    #Responses that cannot have changed are served from the cache, the others are requested and stored
+    replay   #Everything is served from the cache, without any network: missing responses are answered with a 404
+
+In reuse mode, a cached response is served if it is recent enough: NYT_RESPONSE_CACHE_MAX_AGE_<API> seconds
+(0 by default: Newswire pages and Article Search pages change all the time), or if it was received after the
+moment the caller knows the data stopped changing (e.g. the end of an archive month, see NYTClient.get).
+Replay mode rebuilds the collections at disk speed, e.g. after a schema change:
+
+    NYT_RESPONSE_CACHE=replay python3 archive_acquisition/archive_nyt_data.py backfill 2019-01 2022-12
+    python3 newswire_acquisition/newswire_job.py --replay-history   #Every Newswire page ever received
+
+Needs the zstandard package (NYT_RESPONSE_CACHE_LEVEL sets the compression level, 9 by default).
+'''
+
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+
+MODES = ['off', 'record', 'reuse', 'replay']
+READ_CHUNK_SIZE = 1 << 20
+
+def zstd():
+    '''The zstandard module, only needed once the cache is enabled.'''
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('The response cache (NYT_RESPONSE_CACHE_DIR) needs the zstandard package: '
+                           'pip install zstandard')
+    return zstandard
+
+def request_key(url:str, endpoint:str, params:dict = None) -> str:
+    '''Identifies a request: its URL and parameters, without the API key (which may change).'''
+    params = sorted((name, str(value)) for name, value in (params or {}).items() if name != 'api-key')
+    return hashlib.sha256(json.dumps([f'{url}{endpoint}', params]).encode('utf-8')).hexdigest()
+
+def get_max_age(api:str):
+    '''Seconds during which a cached response of an API is served in reuse mode (None: forever).'''
+    value = os.environ.get(f'NYT_RESPONSE_CACHE_MAX_AGE_{api.upper()}', '0')
+    return None if value.lower() in ['none', 'forever'] else float(value)
+
+def write_atomically(path:str, write):
+    '''Calls write(file) on a temporary file, then moves it to path: readers never see a partial file.'''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.tmp_', delete=False) as temp_file:
+        try:
+            write(temp_file)
+        except BaseException:
+            temp_file.close()
+            os.remove(temp_file.name)
+            raise
+    os.replace(temp_file.name, path)
+
+class ResponseCache:
+    '''Raw responses stored under folder. All methods are blocking: NYTClient calls them in a thread.'''
+    def __init__(self, folder:str, mode:str = 'record', level:int = 9):
+        if mode not in MODES:
+            raise ValueError(f'Unknown response cache mode "{mode}" (expected one of {", ".join(MODES)})')
+        self.folder = folder
+        self.mode = mode
+        self.level = level
+        zstd() #Fail early if the package is missing
+
+    def object_path(self, digest:str) -> str:
+        return os.path.join(self.folder, 'objects', digest[:2], f'{digest}.zst')
+
+    def key_path(self, key:str) -> str:
+        return os.path.join(self.folder, 'keys', key[:2], f'{key}.jsonl')
+
+    def entries(self, key:str) -> list:
+        '''Every body received for a request, oldest first.'''
+        try:
+            with open(self.key_path(key), encoding='utf-8') as key_file:
+                return [json.loads(line) for line in key_file if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def lookup(self, api:str, url:str, endpoint:str, params:dict = None, fresh_after:datetime.datetime = None):
+        '''The latest entry of a request that can be served in the current mode, or None.'''
+        if self.mode not in ['reuse', 'replay']:
+            return None
+        entries = self.entries(request_key(url, endpoint, params))
+        if not entries:
+            return None
+        entry = entries[-1]
+        if self.mode == 'replay':
+            return entry
+
+        fetched_at = datetime.datetime.fromisoformat(entry['fetched_at'])
+        if fresh_after is not None and fetched_at >= fresh_after:
+            return entry
+        max_age = get_max_age(api)
+        if max_age is None or (datetime.datetime.utcnow() - fetched_at).total_seconds() < max_age:
+            return entry
+        return None
+
+    def read(self, entry:dict) -> bytes:
+        with open(self.object_path(entry['object']), 'rb') as object_file:
+            return zstd().ZstdDecompressor().stream_reader(object_file).read()
+
+    def extract(self, entry:dict) -> str:
+        '''Decompresses a cached body to a temporary file (as NYTClient.download would), and returns its path.'''
+        with open(self.object_path(entry['object']), 'rb') as object_file:
+            with tempfile.NamedTemporaryFile(prefix='nyt_', suffix='.json', delete=False) as spool_file:
+                try:
+                    zstd().ZstdDecompressor().copy_stream(object_file, spool_file)
+                except BaseException:
+                    spool_file.close()
+                    os.remove(spool_file.name)
+                    raise
+        return spool_file.name
+
+    def store(self, api:str, url:str, endpoint:str, params:dict = None, content:bytes = None, path:str = None) -> dict:
+        '''Stores a successful response, given as bytes (content) or as a spooled file (path).
+        Nothing is written if the request's latest body is the same.'''
+        digest = hashlib.sha256()
+        if path is None:
+            digest.update(content)
+            size = len(content)
+        else:
+            size = 0
+            with open(path, 'rb') as body_file:
+                for chunk in iter(lambda: body_file.read(READ_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    size += len(chunk)
+        digest = digest.hexdigest()
+
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            compressor = zstd().ZstdCompressor(level=self.level)
+            if path is None:
+                write_atomically(object_path, lambda object_file: object_file.write(compressor.compress(content)))
+            else:
+                def compress_file(object_file):
+                    with open(path, 'rb') as body_file:
+                        compressor.copy_stream(body_file, object_file)
+                write_atomically(object_path, compress_file)
+
+        key = request_key(url, endpoint, params)
+        entries = self.entries(key)
+        if entries and entries[-1]['object'] == digest:
+            return entries[-1]
+
+        entry = {
+            'api': api,
+            'url': f'{url}{endpoint}',
+            'params': {name:value for name, value in (params or {}).items() if name != 'api-key'},
+            'fetched_at': datetime.datetime.utcnow().isoformat(),
+            'object': digest,
+            'size': size,
+        }
+        key_path = self.key_path(key)
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        with open(key_path, 'a', encoding='utf-8') as key_file: #One short line per append: no torn lines
+            key_file.write(json.dumps(entry) + '\n')
+        return entry
+
+    def history(self, api:str = None, url_prefix:str = ''):
+        '''Every entry stored for an API (or all of them) whose URL starts with url_prefix, oldest first.'''
+        entries = []
+        for root, _, filenames in os.walk(os.path.join(self.folder, 'keys')):
+            for filename in filenames:
+                if not filename.endswith('.jsonl'):
+                    continue
+                for entry in self.entries(filename[:-len('.jsonl')]):
+                    if (api is None or entry['api'] == api) and entry['url'].startswith(url_prefix):
+                        entries.append(entry)
+        return sorted(entries, key=lambda entry: entry['fetched_at'])
+
+def open_response_cache():
+    '''The cache set by NYT_RESPONSE_CACHE_DIR and NYT_RESPONSE_CACHE, or None if it is disabled.'''
+    folder = os.environ.get('NYT_RESPONSE_CACHE_DIR')
+    mode = os.environ.get('NYT_RESPONSE_CACHE', 'record' if folder else 'off').lower()
+    if mode == 'off':
+        return None
+    if not folder:
+        raise RuntimeError(f'NYT_RESPONSE_CACHE={mode} needs NYT_RESPONSE_CACHE_DIR.')
+    return ResponseCache(folder, mode, int(os.environ.get('NYT_RESPONSE_CACHE_LEVEL', 9)))
@@ -0,0 +1,96 @@
+'''Daily rollups of the Newswire collection, read by the dashboard instead of aggregating times_newswire.
+Each rollup collection holds one document per (keys, year, month, day), with the number of articles.
+The ingestor refreshes the days it touched; a full rebuild can be scheduled from the root of the repository:
+
+    python3 -m nyt_common.rollups          #Full rebuild
+    python3 -m nyt_common.rollups 3        #Only the last 3 days
+'''
+
+import datetime
+import sys
+
+from nyt_common.dates import parse_nyt_datetime
+from nyt_common.metrics import mongo_batch
+
+#Rollup collection name -> fields it is grouped by (on top of the day)
+NEWSWIRE_ROLLUPS = {
+    'newswire_daily_by_section': ['section'],
+    'newswire_daily_by_subsection': ['section', 'subsection'],
+    'newswire_daily_by_author': ['byline', 'section', 'subsection'],
+}
+
+def day_of(created_date) -> datetime.date:
+    '''The (UTC) day an article counts towards, as grouped by the rollups.'''
+    parsed = parse_nyt_datetime(created_date)
+    return None if parsed is None else parsed.date()
+
+def created_date_range(days) -> dict:
+    '''Filter on created_date (a UTC datetime, see nyt_common/migrate_dates.py) covering the given days.
+    Days in between that were not asked for are dropped after grouping.'''
+    return {"$gte":datetime.datetime.combine(min(days), datetime.time.min),
+            "$lt":datetime.datetime.combine(max(days) + datetime.timedelta(days=1), datetime.time.min)}
+
+def rollup_pipeline(target:str, keys:list, days:list = None) -> list:
+    '''Aggregation recomputing the daily counts of a rollup (for the given days only, if provided),
+    then merging them into the target collection.'''
+    match = {"uri":{"$ne":''}}
+    if 'byline' in keys:
+        match['byline'] = {"$ne":''}
+    if days:
+        match['created_date'] = created_date_range(days)
+
+    projection = {key:1 for key in keys}
+    projection.update({
+        "aYear": {"$year":'$created_date'},
+        "aMonth": {"$month":'$created_date'},
+        "aDay": {"$dayOfMonth":'$created_date'},
+    })
+
+    group_id = {key:f'${key}' for key in keys}
+    group_id.update({"year":"$aYear", "month":"$aMonth", "day":"$aDay"})
+
+    pipeline = [
+        {"$match":match},
+        {"$project":projection},
+        {"$group":{"_id":group_id, "nb_articles":{"$sum":1}}},
+    ]
+    if days:
+        pipeline.append({"$match":{"$or":[{"_id.year":day.year, "_id.month":day.month, "_id.day":day.day}
+                                          for day in days]}})
+
+    output = {key:f'$_id.{key}' for key in keys}
+    output.update({"year":"$_id.year", "month":"$_id.month", "day":"$_id.day",
+                   "nb_articles":1, "refreshed_at":"$$NOW"})
+    pipeline.append({"$project":output})
+
+    #A full rebuild replaces the collection in one go, a partial one only merges the days it recomputed.
+    if days:
+        pipeline.append({"$merge":{"into":target, "on":"_id", "whenMatched":"replace", "whenNotMatched":"insert"}})
+    else:
+        pipeline.append({"$out":target})
+    return pipeline
+
+def refresh_newswire_rollups(db, days=None):
+    '''Recomputes the Newswire rollups for the given days (datetime.date objects), or all of them if days is None.
+    For a partial refresh, the rows of those days are removed first, so that groups which no longer exist
+    (e.g. an article that moved to another section) do not linger.'''
+    if days is not None:
+        days = sorted({day for day in days if day is not None})
+        if not days:
+            return
+
+    for target, keys in NEWSWIRE_ROLLUPS.items():
+        if days is not None:
+            db[target].delete_many({"$or":[{"year":day.year, "month":day.month, "day":day.day} for day in days]})
+        with mongo_batch(target, 'rollup', len(days or [])):
+            list(db['times_newswire'].aggregate(rollup_pipeline(target, keys, days), allowDiskUse=True))
+
+if __name__ == '__main__':
+    from nyt_common.db import database
+    db = database()
+    if len(sys.argv) > 1:
+        today = datetime.datetime.utcnow().date()
+        refresh_newswire_rollups(db,
+                                 [today - datetime.timedelta(days=i) for i in range(int(sys.argv[1]))])
+    else:
+        refresh_newswire_rollups(db)